@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic_settings import BaseSettings
 
 
@@ -7,8 +9,91 @@ class Settings(BaseSettings):
     openai_api_key: str = ""
     openai_base_url: str = ""
     openai_model: str = "o4-mini"
+    # Shared OpenAI HTTP pool (see app/services/openai_client.py)
+    openai_timeout_seconds: float = 120.0
+    openai_max_connections: int = 20
+    openai_max_keepalive_connections: int = 10
+    openai_keepalive_expiry_seconds: float = 30.0
+    openai_http2: bool = True
+    # Provider limiter (see app/services/rate_limiter.py); 0 = unlimited
+    provider_max_concurrency: int = 8
+    provider_requests_per_minute: int = 0
+    provider_tokens_per_minute: int = 0
+    provider_estimated_tokens_per_call: int = 3000
+    provider_max_retries: int = 3
+    # Analysis engine: VLM per photo, YOLO ensemble, both merged, or YOLO
+    # first with VLM escalation (cascade)
+    analysis_engine: Literal["vlm", "yolo", "hybrid", "cascade"] = "vlm"
+    # Cascade: escalate photos with a YOLO score in [low, high), or of a hard vehicle type / angle
+    cascade_uncertain_low: float = 0.35
+    cascade_uncertain_high: float = 0.75
+    cascade_hard_vehicle_types: list[str] = []
+    cascade_hard_angles: list[str] = []
+    cascade_escalate_when_empty: bool = False
+    yolo_workers: int = 0  # YOLO process pool size; 0 = CPU count
+    yolo_batch_window_ms: float = 20.0  # how long a batch waits for more photos
+    yolo_max_batch_size: int = 8
+    yolo_wbf_iou: float = 0.55  # same-type boxes overlapping this much are fused
+    # YOLO backend: ultralytics checkpoints or ONNX Runtime exports (see yolo_export.py)
+    yolo_backend: Literal["torch", "onnx"] = "torch"
+    yolo_model_dir: str = "./data/models"  # local model store (see yolo_models.py)
+    yolo_offline: bool = False  # never download weights; only use the local store
+    yolo_warmup_on_startup: bool = True  # load + warm every pool worker before serving
+    yolo_onnx_int8: bool = False
+    yolo_onnx_threads: int = 1  # per pool worker; the pool already uses every core
+    yolo_torch_threads: int = 1  # same, for the torch backend (torch.set_num_threads)
+    # Self-consistency voting: N VLM passes per photo, keep damages seen by
+    # >= threshold of them (confidence = vote fraction); 1 = single pass
+    vlm_vote_passes: int = 1
+    vlm_vote_threshold: float = 0.5
+    # Stream VLM completions and persist each damage as soon as it is parsed
+    vlm_streaming: bool = False
+    # VLM response cache (see app/services/vlm_cache.py)
+    vlm_cache_enabled: bool = True
+    vlm_cache_ttl_seconds: int = 30 * 24 * 3600  # 30 days
+    vlm_cache_max_entries: int = 5000
+    # Prompt registry hot reload (see app/services/prompt_registry.py)
+    prompt_hot_reload: bool = False
+    prompt_reload_interval_seconds: float = 5.0
+    # Images sent to the VLM: long-edge cap (0 = original), per-model overrides
+    vlm_image_max_edge: int = 1536
+    vlm_image_max_edge_by_model: dict[str, int] = {}
+    vlm_image_jpeg_quality: int = 90
     data_dir: str = "./data"
-    max_photo_size_bytes: int = 2 * 1024 * 1024  # 2MB
+    max_photo_size_bytes: int = 2 * 1024 * 1024  # 2MB per uploaded photo, 0 = no limit (413 above)
+    # Normalize photos once at upload: EXIF transpose, long-edge cap, JPEG re-encode.
+    # Lossy and irreversible (the upload is replaced), hence opt-in. Photos stored
+    # within the model's vlm_image_max_edge are sent to the VLM as is.
+    photo_normalize_on_ingest: bool = False
+    photo_ingest_max_edge: int = 1536  # 0 = keep resolution
+    photo_ingest_jpeg_quality: int = 90
+    file_io_workers: int = 8  # thread pool for blocking disk work (see app/services/file_io.py)
+    # Durable copy of photo bytes for new uploads (see app/services/photo_storage.py)
+    photo_storage_backend: Literal["db", "local", "s3"] = "db"
+    photo_storage_redirect: bool = False  # s3: redirect photo GETs to a presigned URL
+    s3_bucket: str = ""
+    s3_prefix: str = "photos/"
+    s3_endpoint_url: str = ""  # MinIO or another S3-compatible service; empty = AWS
+    s3_region: str = ""
+    s3_access_key_id: str = ""
+    s3_secret_access_key: str = ""
+    s3_presign_seconds: int = 3600
+    # Photo renditions: GET .../photos/{id}?size=thumb|medium|full&format=jpeg|webp
+    photo_thumb_edge: int = 320
+    photo_medium_edge: int = 1024
+    photo_rendition_quality: int = 80
+    photo_rendition_cache_max_bytes: int = 256 * 1024 * 1024  # disk cache under data_dir/renditions
+    # Analysis job queue (see app/services/job_queue.py)
+    analysis_workers: int = 2
+    analysis_job_max_attempts: int = 3
+    analysis_job_lease_seconds: int = 120
+    analysis_job_retry_base_seconds: float = 10.0
+    analysis_job_timeout_seconds: float = 600.0
+    analysis_job_poll_seconds: float = 5.0
+    # Start each photo's VLM call at upload; /complete then only combines results
+    analysis_pipeline_on_upload: bool = False
+    analysis_pipeline_ttl_seconds: float = 1800.0  # unclaimed upload-time calls are dropped
+    analysis_pipeline_max_per_user: int = 12  # unclaimed upload-time calls allowed per user
     cors_origins: list[str] = ["http://localhost:8000", "http://192.168.1.200:8000"]
 
     model_config = {"env_file": ".env", "env_file_encoding": "utf-8"}
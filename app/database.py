@@ -41,7 +41,7 @@ class Base(DeclarativeBase):
 
 async def create_tables():
     async with engine.begin() as conn:
-        from app.models import vehicle, session, photo, analysis, user  # noqa: F401
+        from app.models import vehicle, session, photo, analysis, user, job, vlm_cache, photo_blob  # noqa: F401
         await conn.run_sync(Base.metadata.create_all)
 
     # Migrate: add new columns if missing (Postgres doesn't auto-add via create_all)
@@ -57,6 +57,30 @@ async def create_tables():
             await conn.execute(text(
                 "ALTER TABLE photos ADD COLUMN IF NOT EXISTS image_data BYTEA"
             ))
+            await conn.execute(text(
+                "ALTER TABLE analysis_results ADD COLUMN IF NOT EXISTS prompt_versions VARCHAR"
+            ))
+            await conn.execute(text(
+                "ALTER TABLE damages ADD COLUMN IF NOT EXISTS confidence DOUBLE PRECISION"
+            ))
+            await conn.execute(text(
+                "ALTER TABLE analysis_results ADD COLUMN IF NOT EXISTS metrics VARCHAR"
+            ))
+            await conn.execute(text(
+                "ALTER TABLE photos ADD COLUMN IF NOT EXISTS content_hash VARCHAR"
+            ))
+            await conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_photos_content_hash ON photos (content_hash)"
+            ))
+            await conn.execute(text(
+                "ALTER TABLE photos ADD COLUMN IF NOT EXISTS normalized_edge INTEGER NOT NULL DEFAULT 0"
+            ))
+            await conn.execute(text(
+                "ALTER TABLE photo_blobs ADD COLUMN IF NOT EXISTS storage VARCHAR NOT NULL DEFAULT 'db'"
+            ))
+            await conn.execute(text(
+                "ALTER TABLE photo_blobs ALTER COLUMN data DROP NOT NULL"
+            ))
 
 
 async def get_db():
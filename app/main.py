@@ -1,3 +1,5 @@
+import asyncio
+import logging
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Depends
@@ -7,18 +9,45 @@ from app.config import settings
 from app.database import create_tables, async_session
 from app.dependencies import verify_api_key
 from app.seed import seed_data
+from app.services import job_queue
+from app.services.file_io import shutdown_io_executor
+from app.services.openai_client import close_openai_client, get_openai_client
+from app.services.prompt_registry import prompt_registry
+from app.services.yolo_pool import shutdown_yolo_pool, warm_up_yolo_pool
 from app.routers.auth import router as auth_router
 from app.routers.vehicles import router as vehicles_router
 from app.routers.sessions import router as sessions_router
+from app.routers.metrics import router as metrics_router
 from app.utils.exceptions import register_exception_handlers
 
+logger = logging.getLogger(__name__)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await create_tables()
     async with async_session() as session:
         await seed_data(session)
+    prompt_registry.load()
+    prompt_watcher = None
+    if settings.prompt_hot_reload:
+        prompt_watcher = asyncio.create_task(
+            prompt_registry.watch(settings.prompt_reload_interval_seconds)
+        )
+    if settings.openai_api_key:
+        get_openai_client()
+    if settings.analysis_engine != "vlm" and settings.yolo_warmup_on_startup:
+        if not await warm_up_yolo_pool():
+            logger.error("analysis_engine=%s but no YOLO model could be loaded", settings.analysis_engine)
+    await job_queue.recover_stale_jobs()
+    job_queue.start_workers()
     yield
+    await job_queue.stop_workers()
+    if prompt_watcher:
+        prompt_watcher.cancel()
+    await close_openai_client()
+    shutdown_yolo_pool()
+    shutdown_io_executor()
 
 
 app = FastAPI(
@@ -43,6 +72,7 @@ _api_key_dep = [Depends(verify_api_key)]
 app.include_router(auth_router, prefix="/api/v1", dependencies=_api_key_dep)
 app.include_router(vehicles_router, prefix="/api/v1", dependencies=_api_key_dep)
 app.include_router(sessions_router, prefix="/api/v1", dependencies=_api_key_dep)
+app.include_router(metrics_router, prefix="/api/v1", dependencies=_api_key_dep)
 
 
 @app.get("/health")
@@ -1,7 +1,10 @@
 from app.models.vehicle import Vehicle
 from app.models.session import Session
 from app.models.photo import Photo
+from app.models.photo_blob import PhotoBlob
 from app.models.analysis import AnalysisResult, Damage
 from app.models.user import User
+from app.models.job import AnalysisJob
+from app.models.vlm_cache import VlmResponseCache
 
-__all__ = ["Vehicle", "Session", "Photo", "AnalysisResult", "Damage", "User"]
+__all__ = ["Vehicle", "Session", "Photo", "PhotoBlob", "AnalysisResult", "Damage", "User", "AnalysisJob", "VlmResponseCache"]
@@ -11,6 +11,8 @@ class AnalysisResult(Base):
     status = Column(String, nullable=False, default="pending")
     completed_at = Column(String, nullable=True)
     raw_response = Column(String, nullable=True)
+    prompt_versions = Column(String, nullable=True)  # JSON {angle_label: prompt hash}
+    metrics = Column(String, nullable=True)  # JSON per-stage timings (cascade engine)
 
 
 class Damage(Base):
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, String, Integer, Float, ForeignKey
+
+from app.database import Base
+
+
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+
+    id = Column(String, primary_key=True)
+    session_id = Column(String, ForeignKey("sessions.id"), nullable=False)
+    status = Column(String, nullable=False, default="queued")  # queued | running | done | failed
+    attempts = Column(Integer, nullable=False, default=0)
+    # Epoch seconds (not ISO strings) so claim queries can compare them directly.
+    run_after = Column(Float, nullable=False)
+    lease_expires_at = Column(Float, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(String, nullable=False)
+    finished_at = Column(String, nullable=True)
@@ -1,5 +1,6 @@
 from sqlalchemy import Column, String, Integer, LargeBinary
 from sqlalchemy import ForeignKey
+from sqlalchemy.orm import deferred
 
 from app.database import Base
 
@@ -16,7 +17,17 @@ class Photo(Base):
     # ephemeral — files written under data/sessions are wiped on cold restart.
     # The disk file is still written (faster reads, AI service uses it) but
     # the DB blob is the source of truth and is rehydrated on demand.
-    image_data = Column(LargeBinary, nullable=True)
+    # Deferred: select(Photo) never pulls the bytes; read them explicitly
+    # with photo_store.fallback_bytes (raiseload makes a stray access fail
+    # loudly instead of issuing a hidden query per row).
+    image_data = deferred(Column(LargeBinary, nullable=True), raiseload=True)
+    # sha256 of the bytes in photo_blobs (content-addressed, deduplicated).
+    # New uploads set this and leave image_data empty; image_data is only
+    # read for photos stored before the blob store existed.
+    content_hash = Column(String, nullable=True, index=True)
+    # Long edge of the stored image if it was normalized at ingest (upright
+    # JPEG), else 0: consumers needing at most that size can skip decoding.
+    normalized_edge = Column(Integer, nullable=False, default=0)
     captured_at = Column(String, nullable=False)
     is_valid = Column(Integer, nullable=False, default=0)
     validation_message = Column(String, nullable=True)
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, String, Integer, Float, LargeBinary
+
+from sqlalchemy.orm import deferred
+
+from app.database import Base
+
+
+class PhotoBlob(Base):
+    __tablename__ = "photo_blobs"
+
+    # sha256 of the image bytes; Photo.content_hash points here
+    hash = Column(String, primary_key=True)
+    # Bytes, for blobs kept by the "db" storage backend (NULL for local/s3).
+    # Deferred like Photo.image_data; photo_store.load_bytes selects it explicitly.
+    data = deferred(Column(LargeBinary, nullable=True), raiseload=True)
+    size_bytes = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=1)  # Photo rows using it
+    storage = Column(String, nullable=False, default="db", server_default="db")  # backend holding the bytes
+    created_at = Column(Float, nullable=False)  # epoch seconds
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, String, Integer, Float
+
+from app.database import Base
+
+
+class VlmResponseCache(Base):
+    __tablename__ = "vlm_response_cache"
+
+    # sha256 over image hash + prompt hash + model + request params
+    key = Column(String, primary_key=True)
+    model = Column(String, nullable=False)
+    response = Column(String, nullable=False)
+    created_at = Column(Float, nullable=False)  # epoch seconds, for TTL
+    last_used_at = Column(Float, nullable=False)  # epoch seconds, for LRU eviction
+    hits = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,26 @@
+from fastapi import APIRouter
+
+from app.services.ai_service import cascade_stats
+from app.services.file_io import io_stats
+from app.services.image_processing import preprocess_stats
+from app.services.photo_renditions import rendition_cache
+from app.services.rate_limiter import provider_limiter
+from app.services.yolo_pool import yolo_batcher
+from app.utils.response import success_response
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("")
+async def get_metrics():
+    return success_response(data={
+        "provider": provider_limiter.stats(),
+        "image_preprocessing": preprocess_stats,
+        "photo_renditions": rendition_cache.summary(),
+        "file_io": io_stats,
+        "yolo_batching": yolo_batcher.stats(),
+        "cascade": {
+            **cascade_stats,
+            "escalation_rate": cascade_stats["escalated"] / cascade_stats["photos"] if cascade_stats["photos"] else 0.0,
+        },
+    })
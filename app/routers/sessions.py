@@ -1,23 +1,30 @@
-import asyncio
+import json
 import os
 import uuid as uuid_mod
 from datetime import datetime, timezone
+from typing import Literal
 
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
-from fastapi.responses import FileResponse, Response
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query, Request
+from fastapi.responses import FileResponse, RedirectResponse
 import shutil
 
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, func
 
+from app.config import settings
 from app.database import async_session
 from app.models.analysis import AnalysisResult, Damage
 from app.models.session import Session
 from app.models.photo import Photo
+from app.models.photo_blob import PhotoBlob
 from app.models.vehicle import Vehicle
 from app.models.user import User
 from app.schemas.session import SessionCreate, SessionResponse
-from app.services.ai_service import analyze_session
+from app.services import photo_renditions, photo_store
+from app.services.ai_service import discard_prefetches, prefetch_photo_analysis
+from app.services.file_io import run_io, write_atomic
+from app.services.job_queue import delete_jobs_for_session, enqueue_analysis, has_running_job
 from app.services.photo_validator import validate_photo
+from app.utils import http_cache
 from app.utils.response import success_response
 
 router = APIRouter(prefix="/sessions", tags=["sessions"])
@@ -25,6 +32,33 @@ router = APIRouter(prefix="/sessions", tags=["sessions"])
 UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data", "sessions")
 
 
+async def _stage_photo(file: UploadFile) -> tuple[photo_store.StagedPhoto, int]:
+    """Stream an uploaded photo to a temp file (413 once it exceeds the limit)
+    and normalize it when enabled. Returns (staged photo, normalized edge or 0)."""
+    try:
+        staged = await photo_store.stage_upload(file, settings.max_photo_size_bytes)
+    except photo_store.PhotoTooLargeError as exc:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Foto troppo grande (max {exc.limit / (1024 * 1024):.0f} MB)",
+        )
+    if not settings.photo_normalize_on_ingest:
+        return staged, 0
+    try:
+        return await photo_store.normalize_staged(staged)
+    except BaseException:
+        await photo_store.discard(staged)
+        raise
+
+
+async def _add_ref(db_session, staged: photo_store.StagedPhoto) -> str:
+    """photo_store.add_ref, with a 500 when the only copy can't be written."""
+    try:
+        return await photo_store.add_ref(db_session, staged)
+    except photo_store.BlobWriteError:
+        raise HTTPException(status_code=500, detail="Impossibile salvare la foto, riprovare")
+
+
 @router.post("", status_code=201)
 async def create_session(payload: SessionCreate):
     async with async_session() as session:
@@ -76,21 +110,14 @@ async def upload_photo(
 
         vehicle = await db_session.get(Vehicle, sess.vehicle_id)
 
-        # Save file to disk
-        session_dir = os.path.join(UPLOAD_DIR, session_id)
-        os.makedirs(session_dir, exist_ok=True)
-
         photo_id = str(uuid_mod.uuid4())
-        filename = f"{photo_id}.jpg"
-        file_path = os.path.join(session_dir, filename)
-
-        content = await file.read()
+        staged, normalized_edge = await _stage_photo(file)
         try:
-            with open(file_path, "wb") as f:
-                f.write(content)
-        except OSError:
-            # Disk write may fail on read-only filesystems; DB blob is enough.
-            pass
+            # Stored once per distinct image (disk + DB), shared across re-uploads.
+            content_hash = await _add_ref(db_session, staged)
+        finally:
+            await photo_store.discard(staged)
+        file_path = photo_store.blob_path(content_hash)
 
         # Photo validation disabled — saves one API call per photo
         # vehicle_type = vehicle.type if vehicle else ""
@@ -99,7 +126,7 @@ async def upload_photo(
         #     os.remove(file_path)
         #     raise HTTPException(status_code=422, detail=f"Foto non valida: {validation['reason']}")
 
-        # Create photo record. Image bytes also stored in DB so the photo
+        # Create photo record. The bytes live in photo_blobs (DB) so the photo
         # survives Render's ephemeral disk wipes.
         photo = Photo(
             id=photo_id,
@@ -107,7 +134,8 @@ async def upload_photo(
             angle_index=angle_index,
             angle_label=angle_label,
             file_path=file_path,
-            image_data=content,
+            content_hash=content_hash,
+            normalized_edge=normalized_edge,
             captured_at=datetime.now(timezone.utc).isoformat(),
             is_valid=1,
             upload_status="uploaded",
@@ -115,7 +143,18 @@ async def upload_photo(
         db_session.add(photo)
         await db_session.commit()
 
-    return success_response(data={"photo_id": photo_id, "size_bytes": len(content)})
+        # Pipelined mode: analyse this angle now instead of waiting for /complete.
+        # Not for yolo/cascade, where most photos never reach the VLM.
+        if (
+            settings.analysis_pipeline_on_upload
+            and settings.openai_api_key
+            and settings.analysis_engine in ("vlm", "hybrid")
+        ):
+            user = await db_session.get(User, sess.user_id)
+            if user is None or user.remaining_calls is None or user.remaining_calls > 0:
+                prefetch_photo_analysis(photo, vehicle.type if vehicle else None, sess.user_id)
+
+    return success_response(data={"photo_id": photo_id, "size_bytes": staged.size, "normalized_edge": normalized_edge})
 
 
 @router.post("/{session_id}/complete")
@@ -140,8 +179,8 @@ async def complete_session(session_id: str):
 
         data = SessionResponse.model_validate(sess).model_dump()
 
-    # Trigger AI analysis asynchronously
-    asyncio.create_task(analyze_session(session_id))
+    # Queue AI analysis; a worker from the pool picks it up
+    await enqueue_analysis(session_id)
 
     return success_response(data=data)
 
@@ -167,6 +206,8 @@ async def mark_incomplete(session_id: str):
         await db_session.refresh(sess)
 
         data = SessionResponse.model_validate(sess).model_dump()
+    # Not going to be analysed: stop any upload-time calls
+    discard_prefetches(p.id for p in photos)
     return success_response(data=data)
 
 
@@ -238,6 +279,7 @@ async def get_session_details(session_id: str):
                     "zone": d.zone,
                     "description": d.description,
                     "bounding_box": d.bounding_box,
+                    "confidence": d.confidence,
                 }
                 for d in damages
             ]
@@ -291,7 +333,8 @@ async def get_session_results(session_id: str):
             })
 
         damages_list = []
-        if analysis.status == "completed":
+        # While processing, damages already persisted are returned as partial results.
+        if analysis.status in ("completed", "processing"):
             result = await db_session.execute(
                 select(Damage).where(Damage.analysis_id == analysis.id)
             )
@@ -303,6 +346,7 @@ async def get_session_results(session_id: str):
                     "zone": d.zone,
                     "description": d.description,
                     "bounding_box": d.bounding_box,
+                    "confidence": d.confidence,
                 }
                 for d in damages
             ]
@@ -311,41 +355,98 @@ async def get_session_results(session_id: str):
             "analysis_status": analysis.status,
             "damages": damages_list,
         }
+        if analysis.status == "processing":
+            response_data["partial"] = True
         if analysis.raw_response:
             response_data["raw_response"] = analysis.raw_response
+        if analysis.prompt_versions:
+            response_data["prompt_versions"] = json.loads(analysis.prompt_versions)
+        if analysis.metrics:
+            response_data["metrics"] = json.loads(analysis.metrics)
 
         return success_response(data=response_data)
 
 
 @router.get("/{session_id}/photos/{photo_id}")
-async def get_photo_file(session_id: str, photo_id: str):
-    """Stream the JPEG file for a photo. Tries disk first (faster, supports
-    HTTP range), falls back to DB blob when the disk file was wiped (Render
-    free tier ephemeral storage). Auth via API key dependency."""
+async def get_photo_file(
+    request: Request,
+    session_id: str,
+    photo_id: str,
+    size: Literal["thumb", "medium", "full"] = "full",
+    fmt: Literal["jpeg", "webp"] = Query("jpeg", alias="format"),
+):
+    """Stream the JPEG file for a photo. Tries disk first (faster); when the
+    disk file was wiped (Render free tier ephemeral storage) it is restored
+    from the storage backend (see photo_storage), or served from image_data
+    for older photos. Both paths support HTTP range requests. With
+    `photo_storage_redirect` and the S3 backend, redirects to a presigned URL
+    instead. Auth via API key dependency.
+
+    `size=thumb|medium` and/or `format=webp` serve a cached rendition instead
+    of the original (see photo_renditions); WebP falls back to JPEG when the
+    server can't encode it.
+
+    Stored photos never change: responses carry a strong ETag (content hash),
+    immutable Cache-Control and Last-Modified, and a matching conditional GET
+    gets a 304 without reading the file or the blob."""
     async with async_session() as db_session:
         photo = await db_session.get(Photo, photo_id)
         if not photo or photo.session_id != session_id:
             raise HTTPException(status_code=404, detail="Foto non trovata")
         file_path = photo.file_path
-        blob = photo.image_data
-
-    if file_path and os.path.exists(file_path):
-        return FileResponse(file_path, media_type="image/jpeg")
 
+    fmt = photo_renditions.resolve_format(fmt)
+    is_rendition = size != "full" or fmt != "jpeg"
+    tag = (
+        photo_renditions.rendition_key(photo, size, fmt) if is_rendition
+        else photo.content_hash or f"photo-{photo.id}"
+    )
+    headers = http_cache.cache_headers(tag, http_cache.parse_timestamp(photo.captured_at))
+    if http_cache.is_not_modified(request, headers):
+        return http_cache.not_modified_response(headers)
+
+    if is_rendition:
+        path = await photo_renditions.get_rendition(photo, size, fmt)
+        if path is None:
+            raise HTTPException(status_code=404, detail="File foto non disponibile")
+        return FileResponse(path, media_type=photo_renditions.FORMATS[fmt][1], headers=headers)
+
+    url = await photo_store.redirect_url(photo)
+    if url:
+        return RedirectResponse(url, status_code=307)
+
+    if file_path and await run_io(os.path.exists, file_path):
+        return FileResponse(file_path, media_type="image/jpeg", headers=headers)
+    # Local copy wiped: restore it from the storage backend and serve it
+    if await photo_store.restore_file(photo):
+        return FileResponse(file_path, media_type="image/jpeg", headers=headers)
+
+    # Legacy photo (image_data), or no writable disk: serve from memory.
+    blob = await photo_store.fallback_bytes(photo)
     if blob:
         # Rehydrate disk cache opportunistically so subsequent reads are fast.
         if file_path:
             try:
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                with open(file_path, "wb") as f:
-                    f.write(blob)
+                await run_io(write_atomic, file_path, bytes(blob))
             except OSError:
                 pass
-        return Response(content=bytes(blob), media_type="image/jpeg")
+        return http_cache.bytes_response(request, bytes(blob), "image/jpeg", headers)
 
     raise HTTPException(status_code=404, detail="File foto non disponibile")
 
 
+def _disk_sizes(paths: list[str | None]) -> dict[str, int]:
+    """Size of each existing file in [paths] (missing ones are left out)."""
+    sizes = {}
+    for path in paths:
+        if path:
+            try:
+                sizes[path] = os.path.getsize(path)
+            except OSError:
+                pass
+    return sizes
+
+
 @router.get("/{session_id}/debug-photos")
 async def debug_photos(session_id: str):
     async with async_session() as db_session:
@@ -357,16 +458,29 @@ async def debug_photos(session_id: str):
             select(Photo).where(Photo.session_id == session_id)
         )
         photos = result.scalars().all()
+        blob_sizes = dict((await db_session.execute(
+            select(PhotoBlob.hash, PhotoBlob.size_bytes).where(
+                PhotoBlob.hash.in_([p.content_hash for p in photos if p.content_hash])
+            )
+        )).all())
+        # Sizes computed by the DB, so the legacy blobs are never transferred
+        legacy_sizes = dict((await db_session.execute(
+            select(Photo.id, func.length(Photo.image_data)).where(Photo.session_id == session_id)
+        )).all())
+
+        disk_sizes = await run_io(_disk_sizes, [p.file_path for p in photos])
 
         info = []
         for p in photos:
-            exists = os.path.exists(p.file_path) if p.file_path else False
-            size = os.path.getsize(p.file_path) if exists else 0
-            blob_size = len(p.image_data) if p.image_data else 0
+            size = disk_sizes.get(p.file_path)
+            exists = size is not None
+            size = size or 0
+            blob_size = legacy_sizes.get(p.id) or blob_sizes.get(p.content_hash, 0)
             info.append({
                 "id": p.id,
                 "angle": p.angle_label,
                 "path": p.file_path,
+                "content_hash": p.content_hash,
                 "disk_exists": exists,
                 "disk_size_bytes": size,
                 "blob_size_bytes": blob_size,
@@ -375,6 +489,19 @@ async def debug_photos(session_id: str):
     return success_response(data=info)
 
 
+async def _release_session_photos(db_session, session_id: str) -> list[tuple[str, str]]:
+    """Delete a session's photo rows and drop their blob references.
+    Returns the blobs to `photo_store.purge` after commit."""
+    rows = (await db_session.execute(
+        select(Photo.id, Photo.content_hash).where(Photo.session_id == session_id)
+    )).all()
+    await db_session.execute(
+        delete(Photo).where(Photo.session_id == session_id)
+    )
+    discard_prefetches(photo_id for photo_id, _hash in rows)
+    return await photo_store.release(db_session, [content_hash for _id, content_hash in rows])
+
+
 @router.post("/{session_id}/reanalyze")
 async def reanalyze_session(session_id: str, files: list[UploadFile] = File(default=[])):
     async with async_session() as db_session:
@@ -382,6 +509,11 @@ async def reanalyze_session(session_id: str, files: list[UploadFile] = File(defa
         if not sess:
             raise HTTPException(status_code=404, detail="Sessione non trovata")
 
+        # The running job owns the current analysis row: deleting it under the
+        # worker would fail its commit and run the analysis twice.
+        if await has_running_job(db_session, session_id):
+            raise HTTPException(status_code=409, detail="Analisi in corso, riprovare al termine")
+
         # Delete old analysis and damages
         analyses = await db_session.execute(
             select(AnalysisResult).where(AnalysisResult.session_id == session_id)
@@ -392,27 +524,24 @@ async def reanalyze_session(session_id: str, files: list[UploadFile] = File(defa
             )
             await db_session.delete(analysis)
 
-        # If photos provided, save them to disk and update records
+        # If photos provided, store them and replace the photo records
+        released = []
         if files:
-            # Delete existing photo records
-            await db_session.execute(
-                delete(Photo).where(Photo.session_id == session_id)
-            )
-
-            session_dir = os.path.join(UPLOAD_DIR, session_id)
-            os.makedirs(session_dir, exist_ok=True)
-
-            for i, file in enumerate(files):
+            # Reference the new bytes before releasing the old photos, so
+            # re-sending the same images keeps their blobs instead of
+            # deleting and re-storing them.
+            staged = []
+            try:
+                for file in files:
+                    staged.append(await _stage_photo(file))
+                hashes = [await _add_ref(db_session, photo) for photo, _edge in staged]
+            finally:
+                for photo, _edge in staged:
+                    await photo_store.discard(photo)
+            released = await _release_session_photos(db_session, session_id)
+
+            for i, (file, content_hash, (_staged, normalized_edge)) in enumerate(zip(files, hashes, staged)):
                 photo_id = str(uuid_mod.uuid4())
-                filename = f"{photo_id}.jpg"
-                file_path = os.path.join(session_dir, filename)
-
-                content = await file.read()
-                try:
-                    with open(file_path, "wb") as f:
-                        f.write(content)
-                except OSError:
-                    pass
 
                 # Extract angle info from filename (phone sends angle_label as filename)
                 angle_label = file.filename.rsplit('.', 1)[0] if file.filename else f"angle_{i}"
@@ -422,8 +551,9 @@ async def reanalyze_session(session_id: str, files: list[UploadFile] = File(defa
                     session_id=session_id,
                     angle_index=i,
                     angle_label=angle_label,
-                    file_path=file_path,
-                    image_data=content,
+                    file_path=photo_store.blob_path(content_hash),
+                    content_hash=content_hash,
+                    normalized_edge=normalized_edge,
                     captured_at=datetime.now(timezone.utc).isoformat(),
                     is_valid=1,
                     upload_status="uploaded",
@@ -433,9 +563,10 @@ async def reanalyze_session(session_id: str, files: list[UploadFile] = File(defa
         # Reset session status
         sess.status = "uploaded"
         await db_session.commit()
+    await photo_store.purge(released)
 
-    # Trigger new analysis
-    asyncio.create_task(analyze_session(session_id))
+    # Queue new analysis
+    await enqueue_analysis(session_id)
 
     return success_response(data={"message": "Rianalisi avviata"})
 
@@ -447,7 +578,8 @@ async def delete_session(session_id: str):
         if not sess:
             raise HTTPException(status_code=404, detail="Sessione non trovata")
 
-        # Delete damages -> analysis -> photos -> session
+        # Delete jobs -> damages -> analysis -> photos -> session
+        await delete_jobs_for_session(db_session, session_id)
         analyses = await db_session.execute(
             select(AnalysisResult).where(AnalysisResult.session_id == session_id)
         )
@@ -457,15 +589,13 @@ async def delete_session(session_id: str):
             )
             await db_session.delete(analysis)
 
-        await db_session.execute(
-            delete(Photo).where(Photo.session_id == session_id)
-        )
+        released = await _release_session_photos(db_session, session_id)
         await db_session.delete(sess)
         await db_session.commit()
+    await photo_store.purge(released)
 
-    # Remove photos from disk
+    # Remove legacy (pre blob store) photos from disk
     session_dir = os.path.join(UPLOAD_DIR, session_id)
-    if os.path.isdir(session_dir):
-        shutil.rmtree(session_dir)
+    await run_io(shutil.rmtree, session_dir, ignore_errors=True)
 
     return success_response(data={"deleted": session_id})
@@ -2,10 +2,15 @@ import asyncio
 import base64
 import json
 import logging
+import math
 import os
 import re
+import time
 import uuid
+from collections import Counter
+from typing import NamedTuple
 
+import openai
 from sqlalchemy import select
 
 from app.config import settings
@@ -15,28 +20,17 @@ from app.models.photo import Photo
 from app.models.session import Session
 from app.models.user import User
 from app.models.vehicle import Vehicle
+from app.services import photo_store, vlm_cache
+from app.services.damage_parser import DamageStreamParser
+from app.services.file_io import run_io
+from app.services.image_processing import prepare_jpeg
+from app.services.openai_client import get_openai_client
+from app.services.prompt_registry import Prompt, prompt_registry
+from app.services.rate_limiter import provider_limiter, retry_after_seconds
+from app.services.yolo_pool import detect_damages
 
 logger = logging.getLogger(__name__)
 
-PROMPTS_DIR = os.path.join(
-    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
-    "prompts",
-)
-
-# Map vehicle type -> subdirectory under prompts/ holding per-angle files.
-PROMPT_SUBDIR_BY_VEHICLE_TYPE = {
-    "piaggio": "scooter",
-    "ligier": "scooter",
-    "my_moover": "scooter",
-    "scudo": "scudo",
-}
-
-# Legacy generic prompts used as fallback if a per-angle file is missing.
-FALLBACK_PROMPT_BY_VEHICLE_TYPE = {
-    "scudo": "damage_analysis_scudo.txt",
-}
-DEFAULT_FALLBACK_PROMPT_FILE = "damage_analysis.txt"
-
 ANGLE_LABELS = {
     "fronte": "FOTO FRONTALE",
     "lato_destro": "FOTO LATO DESTRO",
@@ -45,38 +39,22 @@ ANGLE_LABELS = {
 }
 
 
-def _load_prompt(vehicle_type: str | None = None, angle_label: str | None = None) -> str:
-    """Load the per-angle prompt for the given vehicle type.
+def _max_edge_for_model(model: str) -> int:
+    """Target long edge for images sent to [model] (0 = keep original size).
 
-    Falls back to the generic prompt if the per-angle file is not available.
+    `vlm_image_max_edge_by_model` matches the full id ('qwen/qwen3-vl-...') or
+    the name without provider prefix; otherwise `vlm_image_max_edge` applies.
     """
-    subdir = PROMPT_SUBDIR_BY_VEHICLE_TYPE.get(vehicle_type or "")
-    if subdir and angle_label:
-        per_angle_path = os.path.join(PROMPTS_DIR, subdir, f"{angle_label}.txt")
-        if os.path.exists(per_angle_path):
-            logger.info(
-                "Loading per-angle prompt vehicle_type=%s angle=%s -> %s/%s.txt",
-                vehicle_type, angle_label, subdir, angle_label,
-            )
-            with open(per_angle_path) as f:
-                return f.read()
-        logger.warning(
-            "Per-angle prompt missing for vehicle_type=%s angle=%s, falling back to generic",
-            vehicle_type, angle_label,
-        )
-
-    fallback = FALLBACK_PROMPT_BY_VEHICLE_TYPE.get(vehicle_type or "", DEFAULT_FALLBACK_PROMPT_FILE)
-    path = os.path.join(PROMPTS_DIR, fallback)
-    logger.info("Loading fallback prompt vehicle_type=%s -> %s", vehicle_type, fallback)
-    with open(path) as f:
-        return f.read()
-
+    overrides = settings.vlm_image_max_edge_by_model
+    if model in overrides:
+        return overrides[model]
+    name = model.rsplit("/", 1)[-1]
+    return overrides.get(name, settings.vlm_image_max_edge)
 
-def _encode_image_base64(file_path: str, fallback_bytes: bytes | None = None) -> str | None:
-    """Read an image file, apply EXIF orientation, return base64-encoded JPEG.
 
-    Falls back to [fallback_bytes] (DB blob) when the disk file is missing —
-    Render free tier wipes data/sessions on cold restart.
+def _read_photo_bytes(file_path: str, fallback_bytes: bytes | None = None) -> bytes | None:
+    """Read a photo from disk, falling back to [fallback_bytes] (DB blob) when
+    the disk file is missing — Render free tier wipes data/sessions on cold restart.
     """
     raw: bytes | None = None
     if file_path and os.path.exists(file_path):
@@ -94,22 +72,34 @@ def _encode_image_base64(file_path: str, fallback_bytes: bytes | None = None) ->
 
     if raw is None:
         logger.warning("Photo data not available (path=%s, blob=False)", file_path)
+    return raw
+
+
+def _encode_image_base64(
+    file_path: str, fallback_bytes: bytes | None = None, max_edge: int | None = None,
+    normalized_edge: int = 0,
+) -> str | None:
+    """Read an image (see _read_photo_bytes), apply EXIF orientation, downscale
+    to [max_edge] and return base64-encoded JPEG.
+
+    Photos normalized on upload are stored as upright JPEGs with a long edge
+    of [normalized_edge]: when that is within [max_edge], the stored JPEG is
+    sent as is, without decoding it again."""
+    raw = _read_photo_bytes(file_path, fallback_bytes)
+    if raw is None:
         return None
 
+    if normalized_edge and (not max_edge or normalized_edge <= max_edge):
+        b64 = base64.b64encode(raw).decode("utf-8")
+        logger.info("Encoded normalized photo as stored: %d bytes base64", len(b64))
+        return b64
+
     # OpenAI/OpenRouter ignores EXIF orientation. Phone cameras store images
     # rotated with an orientation tag — physically transpose so the model
-    # sees them upright.
+    # sees them upright. Downscaling to what the model actually uses cuts
+    # payload size, image tokens and latency.
     try:
-        from io import BytesIO
-        from PIL import Image, ImageOps
-        with Image.open(BytesIO(raw)) as im:
-            ori = im.getexif().get(274)
-            transposed = ImageOps.exif_transpose(im)
-            buf = BytesIO()
-            transposed.convert("RGB").save(buf, format="JPEG", quality=90)
-            data = buf.getvalue()
-            if ori and ori != 1:
-                logger.info("Photo EXIF orientation=%s — physically rotated before encoding", ori)
+        data = prepare_jpeg(raw, max_edge, settings.vlm_image_jpeg_quality)
     except Exception as e:
         logger.warning("PIL orient/encode failed (%s) — falling back to raw bytes", e)
         data = raw
@@ -121,61 +111,25 @@ def _encode_image_base64(file_path: str, fallback_bytes: bytes | None = None) ->
 def _extract_damages(text: str) -> list:
     """Parse JSON damages from model output, tolerating truncation and extra text.
 
-    Strategy:
-      1. Try strict json.loads of the whole text.
-      2. If that fails, extract the first balanced { ... } object and parse it.
-      3. If that also fails (e.g. truncation), recover by parsing the inner array
-         entry-by-entry up to the last complete object.
+    One pass of DamageStreamParser handles <think> blocks, markdown fences and
+    prose around the JSON. The first complete top-level object wins (its
+    "damages"/"danni" list); if none parses (e.g. truncation), the individual
+    damage entries completed before the cut are returned instead.
     """
-    try:
-        parsed = json.loads(text)
-        return parsed.get("damages", parsed.get("danni", []))
-    except json.JSONDecodeError:
-        pass
-
-    # Find balanced outer object
-    start = text.find("{")
-    if start >= 0:
-        depth = 0
-        in_str = False
-        esc = False
-        for i in range(start, len(text)):
-            ch = text[i]
-            if in_str:
-                if esc:
-                    esc = False
-                elif ch == "\\":
-                    esc = True
-                elif ch == '"':
-                    in_str = False
-            else:
-                if ch == '"':
-                    in_str = True
-                elif ch == "{":
-                    depth += 1
-                elif ch == "}":
-                    depth -= 1
-                    if depth == 0:
-                        try:
-                            parsed = json.loads(text[start:i + 1])
-                            return parsed.get("damages", parsed.get("danni", []))
-                        except json.JSONDecodeError:
-                            break
-
-    # Truncation recovery: extract individual {...} damage entries
-    damages: list = []
-    for m in re.finditer(r"\{[^{}]*\}", text):
-        try:
-            entry = json.loads(m.group(0))
-            if isinstance(entry, dict) and "damage_type" in entry:
-                damages.append(entry)
-        except json.JSONDecodeError:
-            continue
-    if damages:
+    parser = DamageStreamParser()
+    parser.feed(text, final=True)
+    return _final_damages(parser, text)
+
+
+def _final_damages(parser: DamageStreamParser, text: str) -> list:
+    """The damages of a fully fed [parser]; the one rule for both the
+    streaming and the non-streaming path."""
+    damages = parser.result()
+    if damages is None:
+        raise ValueError(f"Could not parse damages from response: {text[:200]}")
+    if parser.document is None:
         logger.warning("Recovered %d damages from malformed JSON via fallback parser", len(damages))
-        return damages
-
-    raise ValueError(f"Could not parse damages from response: {text[:200]}")
+    return damages
 
 
 _REASONING_PREFIXES = ("o1", "o3", "o4")
@@ -231,89 +185,512 @@ def _validate_damages(damages: list) -> list:
     return validated
 
 
-def _call_openai_single(client, model: str, photo: Photo, vehicle_type: str | None) -> tuple[list, str]:
-    """Synchronous: run ONE OpenAI call for ONE photo. Returns (validated_damages, raw_text).
+class AnalysisFailedError(RuntimeError):
+    """Every photo of an analysis failed: nothing usable to save."""
 
-    Raises on transport/API failures; callers should catch and log per-photo.
+
+def _is_retryable(exc: Exception) -> bool:
+    """429s and provider-side 5xx/connection errors are worth another try."""
+    if isinstance(exc, openai.APIConnectionError):
+        return True
+    status = getattr(exc, "status_code", None)
+    return status == 429 or (status is not None and status >= 500)
+
+
+async def _with_provider_retries(call):
+    """Run [call](slot) inside a provider-limiter slot, retrying retryable errors.
+
+    Retries are handled here (the shared client has SDK retries disabled) so a
+    429's Retry-After pauses every queued call, not just this one.
     """
-    b64 = _encode_image_base64(photo.file_path, getattr(photo, "image_data", None))
-    if b64 is None:
-        return [], ""
+    max_retries = settings.provider_max_retries
+    for attempt in range(max_retries + 1):
+        async with provider_limiter.slot() as slot:
+            try:
+                return await call(slot)
+            except Exception as exc:
+                if attempt >= max_retries or not _is_retryable(exc):
+                    raise
+                delay = retry_after_seconds(exc, attempt)
+                if getattr(exc, "status_code", None) == 429:
+                    provider_limiter.pause(delay)
+                logger.warning(
+                    "Provider call failed (%s) — retry %d/%d in %.1fs",
+                    exc, attempt + 1, max_retries, delay,
+                )
+        # Sleep outside the slot so other callers can use it meanwhile.
+        await asyncio.sleep(delay)
 
-    prompt = _load_prompt(vehicle_type, photo.angle_label)
-    label = ANGLE_LABELS.get(photo.angle_label, photo.angle_label)
 
-    content: list[dict] = [
-        {"type": "text", "text": prompt},
-        {"type": "text", "text": f"--- {label} ---"},
-        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}},
-    ]
+async def _create_completion(client, api_kwargs: dict):
+    """Run one chat completion through the process-wide provider limiter."""
+    async def call(slot):
+        response = await client.chat.completions.create(**api_kwargs)
+        usage = getattr(response, "usage", None)
+        slot.report_usage(getattr(usage, "total_tokens", None))
+        return response
 
-    api_kwargs = _build_api_kwargs(model, content)
-    logger.info(
-        "OpenAI request (per-photo): model=%s, angle=%s, vehicle_type=%s",
-        model, photo.angle_label, vehicle_type,
+    return await _with_provider_retries(call)
+
+
+async def _stream_completion(client, api_kwargs: dict, on_text) -> tuple[str, Exception | None]:
+    """Stream one chat completion, passing each text delta to [on_text].
+
+    Returns (text, interruption). If the stream breaks after some text
+    arrived, the partial text is returned with the error that cut it short
+    instead of retrying, since [on_text] has already consumed it.
+    """
+    async def call(slot):
+        parts: list[str] = []
+        stream = await client.chat.completions.create(
+            **api_kwargs, stream=True, stream_options={"include_usage": True},
+        )
+        try:
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    slot.report_usage(getattr(usage, "total_tokens", None))
+                if not chunk.choices:
+                    continue
+                text = chunk.choices[0].delta.content
+                if text:
+                    parts.append(text)
+                    await on_text(text)
+        except Exception as exc:
+            if not parts:
+                raise
+            logger.warning("Stream interrupted after %d chunks (%s) — keeping partial output", len(parts), exc)
+            return "".join(parts), exc
+        return "".join(parts), None
+
+    return await _with_provider_retries(call)
+
+
+async def _encode_photo(photo: Photo, max_edge: int) -> str | None:
+    """Base64 JPEG payload of [photo] for a model taking [max_edge]."""
+    # Decode/rotate/encode is CPU + disk work: keep it off the event loop.
+    return await asyncio.to_thread(
+        _encode_image_base64,
+        photo.file_path,
+        await photo_store.fallback_bytes(photo),
+        max_edge,
+        getattr(photo, "normalized_edge", 0) or 0,
     )
 
-    response = client.chat.completions.create(**api_kwargs)
 
-    if not response.choices:
-        logger.error(
-            "API response has no choices (angle=%s). Response: %s",
-            photo.angle_label, response.model_dump_json()[:1000],
+def _shared_encoder(photo: Photo, max_edge: int):
+    """An `encode` for `_call_openai_single` that encodes [photo] at most once
+    however many calls use it, and only when the first one needs it."""
+    task: asyncio.Future | None = None
+
+    async def encode() -> str | None:
+        nonlocal task
+        if task is None:
+            task = asyncio.ensure_future(_encode_photo(photo, max_edge))
+        # A cancelled caller must not cancel the encode the others wait on
+        return await asyncio.shield(task)
+
+    return encode
+
+
+def _image_cache_key(photo: Photo, max_edge: int) -> str | None:
+    """What determines [photo]'s encoded payload, without encoding it: the
+    stored blob's hash plus the encode parameters. None for legacy photos
+    (no content hash)."""
+    digest = getattr(photo, "content_hash", None)
+    if not digest:
+        return None
+    return json.dumps({
+        "blob": digest,
+        "max_edge": max_edge,
+        "quality": settings.vlm_image_jpeg_quality,
+        "normalized_edge": getattr(photo, "normalized_edge", 0) or 0,
+    }, sort_keys=True)
+
+
+async def _call_openai_single(
+    client,
+    model: str,
+    photo: Photo,
+    vehicle_type: str | None,
+    prompt: Prompt | None = None,
+    on_damage=None,
+    pass_index: int = 0,
+    encode=None,
+) -> tuple[list, str]:
+    """Run ONE OpenAI call for ONE photo. Returns (validated_damages, raw_text).
+
+    [pass_index] tells apart the N identical requests of self-consistency
+    voting in the response cache (pass 0 shares the single-pass entry).
+    [encode] (async, optional) returns the photo's base64 payload, called only
+    if the payload is needed; voting passes share one (`_shared_encoder`).
+
+    [on_damage] (async, optional) is awaited once per validated damage as early
+    as possible: while the response streams in when `vlm_streaming` is on,
+    otherwise once the response has been parsed.
+    Raises on transport/API failures; callers should catch and log per-photo.
+    """
+    if prompt is None:
+        prompt = prompt_registry.get(vehicle_type, photo.angle_label)
+    label = ANGLE_LABELS.get(photo.angle_label, photo.angle_label)
+    max_edge = _max_edge_for_model(model)
+    if encode is None:
+        encode = _shared_encoder(photo, max_edge)
+    api_kwargs = _build_api_kwargs(model, [])  # the message content is set below
+    b64: str | None = None
+
+    cache_key: str | None = None
+    raw_text: str | None = None
+    if settings.vlm_cache_enabled:
+        # Blob-backed photos are keyed without encoding them, so a hit costs
+        # one lookup; legacy photos are identified by their encoded payload.
+        image_key = _image_cache_key(photo, max_edge)
+        if image_key is None:
+            b64 = await encode()
+            if b64 is None:
+                return [], ""
+            image_key = b64
+        key_params = {**api_kwargs, "pass": pass_index} if pass_index else api_kwargs
+        cache_key = vlm_cache.cache_key(image_key, f"{prompt.text}\n--- {label} ---", model, key_params)
+        raw_text = await vlm_cache.get_cached_response(cache_key)
+        if raw_text is not None:
+            logger.info("VLM cache HIT angle=%s key=%s", photo.angle_label, cache_key[:12])
+
+    from_cache = raw_text is not None
+    streamed = False
+    interrupted = False
+    if not from_cache:
+        if b64 is None:
+            b64 = await encode()
+            if b64 is None:
+                return [], ""
+        api_kwargs["messages"][0]["content"] = [
+            {"type": "text", "text": prompt.text},
+            {"type": "text", "text": f"--- {label} ---"},
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}},
+        ]
+        logger.info(
+            "OpenAI request (per-photo): model=%s, angle=%s, vehicle_type=%s, prompt=%s@%s",
+            model, photo.angle_label, vehicle_type, prompt.source, prompt.version,
         )
-        raise RuntimeError(f"API returned no choices (model={model}, angle={photo.angle_label})")
 
-    raw_text = response.choices[0].message.content or ""
-    logger.info(
-        "OpenAI raw response angle=%s (%d chars): %s",
-        photo.angle_label, len(raw_text), raw_text[:500],
-    )
+        if settings.vlm_streaming:
+            parser = DamageStreamParser()
+
+            async def _on_entries(entries: list[dict]) -> None:
+                if on_damage is None:
+                    return
+                for entry in _validate_damages(entries):
+                    await on_damage(entry)
+
+            async def _on_text(text: str) -> None:
+                await _on_entries(parser.feed(text))
+
+            raw_text, interruption = await _stream_completion(client, api_kwargs, _on_text)
+            await _on_entries(parser.close())
+            streamed = True
+            try:
+                damages = _final_damages(parser, raw_text)
+            except ValueError:
+                if interruption is not None:
+                    raise interruption
+                raise
+            # The parser only emits entries of the damages list, so this is
+            # the same list on_damage has already seen, entry for entry.
+            validated = _validate_damages(damages)
+            if interruption is not None:
+                interrupted = True
+                raw_text = f"{raw_text}\n[PARTIAL] Stream interrupted: {interruption}"
+        else:
+            response = await _create_completion(client, api_kwargs)
 
-    # Strip <think>...</think> blocks (Qwen3, DeepSeek, etc.)
-    json_text = re.sub(r"<think>.*?</think>", "", raw_text, flags=re.DOTALL).strip()
+            if not response.choices:
+                logger.error(
+                    "API response has no choices (angle=%s). Response: %s",
+                    photo.angle_label, response.model_dump_json()[:1000],
+                )
+                raise RuntimeError(f"API returned no choices (model={model}, angle={photo.angle_label})")
 
-    # Strip markdown code fences
-    if json_text.startswith("```"):
-        lines = json_text.split("\n")
-        lines = [l for l in lines if not l.strip().startswith("```")]
-        json_text = "\n".join(lines).strip()
+            raw_text = response.choices[0].message.content or ""
+        logger.info(
+            "OpenAI raw response angle=%s (%d chars): %s",
+            photo.angle_label, len(raw_text), raw_text[:500],
+        )
+
+    if not streamed:
+        damages = _extract_damages(raw_text)
+        validated = _validate_damages(damages)
+        if on_damage is not None:
+            for entry in validated:
+                await on_damage(entry)
 
-    damages = _extract_damages(json_text)
-    validated = _validate_damages(damages)
     logger.info(
         "Per-photo analysis angle=%s: %d damages validated out of %d returned",
         photo.angle_label, len(validated), len(damages),
     )
+    # Only cache complete responses that parsed, so a garbled or cut-off
+    # answer gets retried next time.
+    if cache_key and not from_cache and not interrupted:
+        await vlm_cache.store_response(cache_key, model, raw_text)
     return validated, raw_text
 
 
-async def _call_openai(photos: list, vehicle_type: str | None = None) -> tuple[list, str]:
+class _Prefetch(NamedTuple):
+    user_id: str | None
+    model: str
+    prompt_version: str
+    task: asyncio.Task  # -> (damages, raw_text)
+    expiry: asyncio.TimerHandle
+
+
+# Per-photo VLM calls started at upload time (`analysis_pipeline_on_upload`),
+# by photo_id.
+_prefetched: dict[str, _Prefetch] = {}
+
+
+def _expire_prefetch(photo_id: str, task: asyncio.Task) -> None:
+    entry = _prefetched.get(photo_id)
+    if entry is not None and entry.task is task:
+        del _prefetched[photo_id]
+        task.cancel()
+        logger.info("Dropped unclaimed upload-time analysis for photo %s", photo_id)
+
+
+def discard_prefetches(photo_ids) -> None:
+    """Cancel and forget the upload-time calls for photos that will not be
+    analysed (session deleted, closed as incomplete, photos replaced)."""
+    for photo_id in photo_ids:
+        entry = _prefetched.pop(photo_id, None)
+        if entry is not None:
+            entry.expiry.cancel()
+            entry.task.cancel()
+
+
+def prefetch_photo_analysis(photo: Photo, vehicle_type: str | None, user_id: str | None = None) -> bool:
+    """Start the VLM call for [photo] in the background, right after upload.
+
+    The result is kept in memory until `_call_openai` runs for the session and
+    claims it, so most of the model latency overlaps with the remaining uploads.
+    Unclaimed calls are dropped after `analysis_pipeline_ttl_seconds`.
+
+    These calls are not charged (the analysis that claims them is), so each
+    user may have at most `analysis_pipeline_max_per_user` unclaimed at a time;
+    past that nothing is started and False is returned.
+    """
+    if user_id is not None:
+        outstanding = sum(1 for entry in _prefetched.values() if entry.user_id == user_id)
+        if outstanding >= settings.analysis_pipeline_max_per_user:
+            logger.info("Not prefetching photo %s: user %s has %d unclaimed calls", photo.id, user_id, outstanding)
+            return False
+    model = settings.openai_model
+    prompt = prompt_registry.get(vehicle_type, photo.angle_label)
+    task = asyncio.create_task(
+        _call_openai_single(get_openai_client(), model, photo, vehicle_type, prompt)
+    )
+    # Failures are reported (and retried live) by whoever claims the task.
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    expiry = asyncio.get_running_loop().call_later(
+        settings.analysis_pipeline_ttl_seconds, _expire_prefetch, photo.id, task,
+    )
+    _prefetched[photo.id] = _Prefetch(user_id, model, prompt.version, task, expiry)
+    logger.info("Started upload-time analysis for photo %s angle=%s", photo.id, photo.angle_label)
+    return True
+
+
+async def _claim_prefetched(photo: Photo, model: str, prompt: Prompt) -> tuple[list, str] | None:
+    """Result of the upload-time call for [photo], or None if there is none usable."""
+    entry = _prefetched.pop(photo.id, None)
+    if entry is None:
+        return None
+    entry.expiry.cancel()
+    task = entry.task
+    if entry.model != model or entry.prompt_version != prompt.version:
+        logger.info("Discarding upload-time analysis for photo %s: model or prompt changed", photo.id)
+        task.cancel()
+        return None
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if task.cancelled():
+            return None
+        raise
+    except Exception as exc:
+        logger.warning(
+            "Upload-time analysis failed for angle=%s (%s) — calling again", photo.angle_label, exc,
+        )
+        return None
+
+
+def _votes_needed(passes: int) -> int:
+    return max(1, math.ceil(settings.vlm_vote_threshold * passes - 1e-9))
+
+
+def _tally(passes: list[list[dict]]) -> dict[tuple, list[list[dict]]]:
+    """(damage_type, zone) -> that key's entries, one list per pass reporting it."""
+    occurrences: dict[tuple, list[list[dict]]] = {}
+    for entries in passes:
+        by_key: dict[tuple, list[dict]] = {}
+        for entry in entries:
+            by_key.setdefault((entry["damage_type"], entry["zone"]), []).append(entry)
+        for key, matching in by_key.items():
+            occurrences.setdefault(key, []).append(matching)
+    return occurrences
+
+
+def _vote_damages(passes: list[list[dict]], total: int) -> list[dict]:
+    """Combine the damages of several passes over the same photo.
+
+    Damages match across passes by (damage_type, zone); the k-th damage of a
+    key is voted by every pass reporting at least k of them, so two scratches
+    on the same side survive only if enough passes see two. Entries with at
+    least _votes_needed(total) votes are kept, with the majority severity and
+    confidence = votes / [total], so passes cancelled once the vote settled
+    count as not reporting it (never inflating the confidence).
+    """
+    need = _votes_needed(total)
+    kept: list[dict] = []
+    for per_pass in _tally(passes).values():
+        for k in range(max(len(matching) for matching in per_pass)):
+            voters = [matching[k] for matching in per_pass if len(matching) > k]
+            if len(voters) < need:
+                break
+            severity = Counter(d["severity"] for d in voters).most_common(1)[0][0]
+            representative = next(d for d in voters if d["severity"] == severity)
+            kept.append({**representative, "confidence": round(len(voters) / total, 4)})
+    return kept
+
+
+def _vote_settled(passes: list[list[dict]], total: int) -> bool:
+    """True once the remaining passes can no longer change which damages are
+    kept, nor the majority severity of any of them."""
+    remaining = total - len(passes)
+    need = _votes_needed(total)
+    if remaining >= need:
+        return False  # a damage no pass has reported yet could still be kept
+    for per_pass in _tally(passes).values():
+        for k in range(max(len(matching) for matching in per_pass)):
+            voters = [matching[k] for matching in per_pass if len(matching) > k]
+            if len(voters) < need <= len(voters) + remaining:
+                return False
+            if len(voters) >= need and remaining:
+                counts = [n for _severity, n in Counter(d["severity"] for d in voters).most_common(2)]
+                runner_up = counts[1] if len(counts) > 1 else 0
+                if counts[0] <= runner_up + remaining:
+                    return False  # the remaining passes could tie or flip the severity
+    return True
+
+
+async def _call_openai_voted(
+    client,
+    model: str,
+    photo: Photo,
+    vehicle_type: str | None,
+    prompt: Prompt,
+    first: tuple[list, str] | None = None,
+) -> tuple[list, str]:
+    """Self-consistency voting: `vlm_vote_passes` parallel calls for one photo.
+
+    Every pass goes through the shared provider limiter; [first] (an
+    upload-time result) counts as pass 0. Remaining passes are cancelled as
+    soon as the vote is settled. Failed passes are dropped from the count;
+    raises only if every pass failed.
+    """
+    total = settings.vlm_vote_passes
+    passes: list[list[dict]] = []
+    raw_parts: list[str] = []
+    if first is not None:
+        passes.append(first[0])
+        raw_parts.append(f"[pass 0]\n{first[1]}")
+
+    encode = _shared_encoder(photo, _max_edge_for_model(model))
+
+    async def _one(index: int) -> tuple[int, list, str]:
+        damages, raw = await _call_openai_single(
+            client, model, photo, vehicle_type, prompt, pass_index=index, encode=encode,
+        )
+        return index, damages, raw
+
+    pending = {asyncio.create_task(_one(i)) for i in range(len(passes), total)}
+    last_error: Exception | None = None
+    try:
+        while pending and not _vote_settled(passes, total):
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                try:
+                    index, damages, raw = task.result()
+                except Exception as exc:
+                    logger.warning("Vote pass failed for angle=%s: %s", photo.angle_label, exc)
+                    last_error = exc
+                    total -= 1
+                    continue
+                passes.append(damages)
+                raw_parts.append(f"[pass {index}]\n{raw}")
+    finally:
+        for task in pending:
+            task.cancel()
+    if not passes:
+        raise last_error or RuntimeError("no vote pass completed")
+    if pending:
+        logger.info(
+            "Vote settled for angle=%s after %d/%d passes — cancelled %d",
+            photo.angle_label, len(passes), settings.vlm_vote_passes, len(pending),
+        )
+
+    voted = _vote_damages(passes, total)
+    logger.info(
+        "Voting angle=%s: %d damages kept from %d passes", photo.angle_label, len(voted), len(passes),
+    )
+    return voted, "\n\n".join(raw_parts)
+
+
+async def _call_openai(
+    photos: list,
+    vehicle_type: str | None = None,
+    prompts: dict[str, Prompt] | None = None,
+    on_damage=None,
+) -> tuple[list, str]:
     """Call OpenAI Vision API once PER PHOTO, concurrently, and aggregate results.
 
+    [prompts] maps angle_label -> Prompt resolved by the caller (so the versions
+    it records are exactly the ones sent); missing angles use the registry.
+    [on_damage] is forwarded to `_call_openai_single`. Photos whose call was
+    already started at upload time reuse that result instead of calling again.
+    With `vlm_vote_passes` > 1 each photo goes through `_call_openai_voted`.
     Returns (aggregated_validated_damages, concatenated_raw_text).
     Per-photo failures are logged and included as error markers in raw text but do not
-    abort the whole session.
+    abort the whole session, unless every photo failed (AnalysisFailedError).
     """
-    from openai import OpenAI
-
     model = settings.openai_model
     logger.info("Calling OpenAI model=%s with %d photos (one call per photo)", model, len(photos))
 
     if not photos:
         return [], ""
 
-    kwargs = {"api_key": settings.openai_api_key, "timeout": 120.0}
-    if settings.openai_base_url:
-        kwargs["base_url"] = settings.openai_base_url
-    client = OpenAI(**kwargs)
+    client = get_openai_client()
 
     async def _run_one(photo: Photo) -> tuple[str, list, str, str | None]:
         """Wrap _call_openai_single so we can parallelize and capture per-photo errors."""
         try:
-            damages, raw = await asyncio.to_thread(
-                _call_openai_single, client, model, photo, vehicle_type
-            )
+            prompt = (prompts or {}).get(photo.angle_label)
+            if prompt is None:
+                prompt = prompt_registry.get(vehicle_type, photo.angle_label)
+            prefetched = await _claim_prefetched(photo, model, prompt)
+            if settings.vlm_vote_passes > 1:
+                damages, raw = await _call_openai_voted(
+                    client, model, photo, vehicle_type, prompt, prefetched,
+                )
+                if on_damage is not None:
+                    for entry in damages:
+                        await on_damage(entry)
+            elif prefetched is not None:
+                damages, raw = prefetched
+                if on_damage is not None:
+                    for entry in damages:
+                        await on_damage(entry)
+            else:
+                damages, raw = await _call_openai_single(
+                    client, model, photo, vehicle_type, prompt, on_damage,
+                )
             return photo.angle_label, damages, raw, None
         except Exception as exc:
             logger.exception(
@@ -322,27 +699,231 @@ async def _call_openai(photos: list, vehicle_type: str | None = None) -> tuple[l
             return photo.angle_label, [], "", str(exc)
 
     results = await asyncio.gather(*(_run_one(p) for p in photos))
+    _raise_if_all_failed(results, "OpenAI")
+    aggregated_damages, combined_raw = _aggregate_results(results)
+    logger.info(
+        "AI analysis aggregated: %d damages across %d photo-calls",
+        len(aggregated_damages), len(photos),
+    )
+    return aggregated_damages, combined_raw
+
+
+def _raise_if_all_failed(results, engine: str) -> None:
+    """AnalysisFailedError if every per-photo (angle, damages, raw, error) failed."""
+    errors = [error for _angle, _damages, _raw, error in results if error]
+    if results and len(errors) == len(results):
+        raise AnalysisFailedError(f"{engine}: all {len(results)} photos failed ({errors[0]})")
 
+
+def _aggregate_results(results, header_prefix: str = "") -> tuple[list, str]:
+    """Merge per-photo (angle, damages, raw, error) tuples into (damages, raw_text)."""
     aggregated_damages: list = []
     raw_parts: list[str] = []
     for angle, damages, raw, error in results:
-        header = f"=== {angle} ==="
+        header = f"=== {header_prefix}{angle} ==="
         if error:
             raw_parts.append(f"{header}\n[ERROR] {error}")
             continue
         aggregated_damages.extend(damages)
         raw_parts.append(f"{header}\n{raw}" if raw else f"{header}\n[EMPTY_RESPONSE]")
+    return aggregated_damages, "\n\n".join(raw_parts)
+
+
+async def _detect_photo(photo: Photo) -> tuple[str, list, str, str | None]:
+    """YOLO on one photo -> (angle, validated_damages, raw_json, error)."""
+    try:
+        raw = await run_io(
+            _read_photo_bytes, photo.file_path, await photo_store.fallback_bytes(photo),
+        )
+        if raw is None:
+            raise FileNotFoundError(f"Photo data not available: {photo.file_path}")
+        found = await detect_damages(raw, photo.angle_label)
+    except Exception as exc:
+        logger.exception("YOLO detection FAILED for angle=%s: %s", photo.angle_label, exc)
+        return photo.angle_label, [], "", str(exc)
+    return photo.angle_label, _validate_damages(found), json.dumps({"damages": found}, ensure_ascii=False), None
+
+
+async def _run_yolo(photos: list, on_damage=None) -> tuple[list, str]:
+    """Run the YOLO ensemble on every photo (in the process pool) and aggregate.
+
+    Same contract as `_call_openai`: per-photo failures become [ERROR] markers
+    in the raw text, which holds each photo's detections as JSON; raises
+    AnalysisFailedError if every photo failed.
+    """
+    async def _run_one(photo: Photo) -> tuple[str, list, str, str | None]:
+        result = await _detect_photo(photo)
+        if on_damage is not None:
+            for entry in result[1]:
+                await on_damage(entry)
+        return result
+
+    results = await asyncio.gather(*(_run_one(p) for p in photos))
+    _raise_if_all_failed(results, "YOLO")
+    damages, raw = _aggregate_results(results, header_prefix="yolo/")
+    logger.info("YOLO analysis aggregated: %d damages across %d photos", len(damages), len(photos))
+    return damages, raw
+
+
+async def _run_hybrid(
+    photos: list,
+    vehicle_type: str | None,
+    prompts: dict[str, Prompt],
+    on_damage=None,
+) -> tuple[list, str]:
+    """VLM and YOLO concurrently. VLM damages are kept as-is; YOLO adds the
+    detections whose (damage_type, zone) the VLM did not report. One engine
+    failing on every photo leaves the other's result; both failing raises."""
+    vlm_result, yolo_result = await asyncio.gather(
+        _call_openai(photos, vehicle_type, prompts, on_damage=on_damage),
+        _run_yolo(photos),
+        return_exceptions=True,
+    )
+    for result in (vlm_result, yolo_result):
+        if isinstance(result, BaseException) and not isinstance(result, Exception):
+            raise result
+    if isinstance(vlm_result, Exception) and isinstance(yolo_result, Exception):
+        raise vlm_result
+    if isinstance(vlm_result, Exception):
+        logger.error("Hybrid analysis: VLM failed (%s) — keeping YOLO detections only", vlm_result)
+        vlm_result = ([], f"[ERROR] {vlm_result}")
+    if isinstance(yolo_result, Exception):
+        logger.error("Hybrid analysis: YOLO failed (%s) — keeping VLM damages only", yolo_result)
+        yolo_result = ([], f"[ERROR] {yolo_result}")
+    (vlm_damages, vlm_raw), (yolo_damages, yolo_raw) = vlm_result, yolo_result
+    reported = {(d["damage_type"], d["zone"]) for d in vlm_damages}
+    extra = [d for d in yolo_damages if (d["damage_type"], d["zone"]) not in reported]
+    if on_damage is not None:
+        for entry in extra:
+            await on_damage(entry)
+    return vlm_damages + extra, f"{vlm_raw}\n\n{yolo_raw}"
+
+
+# Process-wide cascade counters, exposed on /metrics.
+cascade_stats = {
+    "sessions": 0,
+    "photos": 0,
+    "escalated": 0,
+    "yolo_seconds": 0.0,
+    "vlm_seconds": 0.0,
+}
 
-    combined_raw = "\n\n".join(raw_parts)
+
+def _escalation_reason(
+    photo: Photo, vehicle_type: str | None, damages: list, error: str | None,
+) -> str | None:
+    """Why [photo] needs the VLM after YOLO, or None if YOLO's answer stands."""
+    if error:
+        return "yolo_error"
+    if vehicle_type in settings.cascade_hard_vehicle_types:
+        return "hard_vehicle_type"
+    if photo.angle_label in settings.cascade_hard_angles:
+        return "hard_angle"
+    low, high = settings.cascade_uncertain_low, settings.cascade_uncertain_high
+    if any(low <= (d.get("confidence") or 0.0) < high for d in damages):
+        return "uncertain"
+    if not damages and settings.cascade_escalate_when_empty:
+        return "no_detections"
+    return None
+
+
+async def _run_cascade(
+    photos: list,
+    vehicle_type: str | None,
+    prompts: dict[str, Prompt],
+    on_damage=None,
+) -> tuple[list, str, dict]:
+    """YOLO on every photo first; the VLM only for photos YOLO can't settle.
+
+    A photo is escalated when YOLO failed on it, when any detection scores in
+    [cascade_uncertain_low, cascade_uncertain_high), or when its vehicle type
+    / angle is listed as hard. For escalated photos the VLM answer wins and
+    only YOLO detections at or above the band are added on top (same
+    (damage_type, zone) rule as the hybrid engine); other photos keep YOLO's
+    damages. Returns (damages, raw_text, metrics) with per-stage timings.
+    """
+    started = time.perf_counter()
+    yolo_results = await asyncio.gather(*(_detect_photo(p) for p in photos))
+    yolo_seconds = time.perf_counter() - started
+
+    damages: list = []
+    escalated: list[Photo] = []
+    reasons: dict[str, str] = {}
+    confident_extra: list = []
+    for photo, (_angle, found, _raw, error) in zip(photos, yolo_results):
+        reason = _escalation_reason(photo, vehicle_type, found, error)
+        if reason is None:
+            damages.extend(found)
+            if on_damage is not None:
+                for entry in found:
+                    await on_damage(entry)
+            continue
+        escalated.append(photo)
+        reasons[photo.angle_label] = reason
+        confident_extra.extend(
+            d for d in found if (d.get("confidence") or 0.0) >= settings.cascade_uncertain_high
+        )
     logger.info(
-        "AI analysis aggregated: %d damages across %d photo-calls",
-        len(aggregated_damages), len(photos),
+        "Cascade: YOLO on %d photos in %.2f s, escalating %d to the VLM %s",
+        len(photos), yolo_seconds, len(escalated), reasons,
     )
-    return aggregated_damages, combined_raw
+
+    raw_parts = [_aggregate_results(yolo_results, header_prefix="yolo/")[1]]
+    vlm_seconds = 0.0
+    if escalated:
+        vlm_started = time.perf_counter()
+        vlm_damages, vlm_raw = await _call_openai(escalated, vehicle_type, prompts, on_damage=on_damage)
+        vlm_seconds = time.perf_counter() - vlm_started
+        reported = {(d["damage_type"], d["zone"]) for d in vlm_damages}
+        extra = [d for d in confident_extra if (d["damage_type"], d["zone"]) not in reported]
+        if on_damage is not None:
+            for entry in extra:
+                await on_damage(entry)
+        damages.extend(vlm_damages + extra)
+        raw_parts.insert(0, vlm_raw)
+
+    metrics = {
+        "engine": "cascade",
+        "photos": len(photos),
+        "escalated": len(escalated),
+        "escalation_reasons": reasons,
+        "yolo_seconds": round(yolo_seconds, 3),
+        "vlm_seconds": round(vlm_seconds, 3),
+        "total_seconds": round(time.perf_counter() - started, 3),
+    }
+    cascade_stats["sessions"] += 1
+    cascade_stats["photos"] += len(photos)
+    cascade_stats["escalated"] += len(escalated)
+    cascade_stats["yolo_seconds"] += yolo_seconds
+    cascade_stats["vlm_seconds"] += vlm_seconds
+    return damages, "\n\n".join(raw_parts), metrics
 
 
-async def analyze_session(session_id: str) -> None:
-    """Analyze all photos for a session using AI."""
+async def _save_damage(analysis_id: str, damage_data: dict) -> None:
+    """Persist one validated damage in its own short transaction."""
+    async with async_session() as db_session:
+        db_session.add(Damage(
+            id=str(uuid.uuid4()),
+            analysis_id=analysis_id,
+            damage_type=damage_data["damage_type"],
+            severity=damage_data["severity"],
+            zone=damage_data["zone"],
+            description=damage_data.get("description"),
+            bounding_box=damage_data.get("bounding_box"),
+            confidence=damage_data.get("confidence"),
+        ))
+        await db_session.commit()
+
+
+async def analyze_session(session_id: str, charge_user: bool = True) -> None:
+    """Analyze all photos for a session using AI.
+
+    Transient failures (provider 429/5xx/connection errors) and analyses
+    where every photo failed are re-raised with the analysis left
+    `processing`, so the job queue can retry them (or mark them failed);
+    other errors are recorded on the analysis. [charge_user] is False for
+    retries of a job whose first attempt already used one of the user's calls.
+    """
     async with async_session() as db_session:
         # Create analysis result record
         analysis_id = str(uuid.uuid4())
@@ -367,7 +948,8 @@ async def analyze_session(session_id: str) -> None:
                 await db_session.commit()
                 return
 
-            if not settings.openai_api_key:
+            engine = settings.analysis_engine
+            if engine != "yolo" and not settings.openai_api_key:
                 # No API key = error, not silent mock
                 logger.error("OPENAI_API_KEY not configured — cannot analyze session %s", session_id)
                 analysis.status = "error"
@@ -380,9 +962,9 @@ async def analyze_session(session_id: str) -> None:
                     await db_session.commit()
                 return
 
-            # Decrement remaining calls for the user
+            # Decrement remaining calls for the user (once per job, not per attempt)
             sess = await db_session.get(Session, session_id)
-            if sess:
+            if sess and charge_user:
                 user = await db_session.get(User, sess.user_id)
                 if user and user.remaining_calls is not None:
                     if user.remaining_calls <= 0:
@@ -400,20 +982,29 @@ async def analyze_session(session_id: str) -> None:
                 if vehicle:
                     vehicle_type = vehicle.type
 
-            # Call OpenAI once per photo (concurrently)
-            damage_list, raw_model_text = await _call_openai(photos, vehicle_type)
-
-            # Save damages
-            for damage_data in damage_list:
-                damage = Damage(
-                    id=str(uuid.uuid4()),
-                    analysis_id=analysis_id,
-                    damage_type=damage_data["damage_type"],
-                    severity=damage_data["severity"],
-                    zone=damage_data["zone"],
-                    description=damage_data.get("description"),
-                )
-                db_session.add(damage)
+            # Damages are written as soon as each one is known so /results
+            # can show partial output.
+            def on_damage(damage_data):
+                return _save_damage(analysis_id, damage_data)
+
+            if engine == "yolo":
+                damage_list, raw_model_text = await _run_yolo(photos, on_damage)
+            else:
+                # Pin the prompt versions used for this analysis
+                prompts = {p.angle_label: prompt_registry.get(vehicle_type, p.angle_label) for p in photos}
+                analysis.prompt_versions = json.dumps({a: p.version for a, p in prompts.items()})
+                if engine == "hybrid":
+                    damage_list, raw_model_text = await _run_hybrid(photos, vehicle_type, prompts, on_damage)
+                elif engine == "cascade":
+                    damage_list, raw_model_text, metrics = await _run_cascade(
+                        photos, vehicle_type, prompts, on_damage,
+                    )
+                    analysis.metrics = json.dumps(metrics)
+                else:
+                    # Call OpenAI once per photo (concurrently)
+                    damage_list, raw_model_text = await _call_openai(
+                        photos, vehicle_type, prompts, on_damage=on_damage,
+                    )
 
             analysis.status = "completed"
             analysis.raw_response = raw_model_text
@@ -428,6 +1019,8 @@ async def analyze_session(session_id: str) -> None:
 
         except Exception as e:
             logger.exception("AI analysis FAILED for session %s: %s", session_id, e)
+            if isinstance(e, AnalysisFailedError) or _is_retryable(e):
+                raise  # the job queue retries it, or marks it failed
             analysis.status = "error"
             # Mask sensitive info (API keys, tokens) from error message
             error_msg = str(e)
@@ -0,0 +1,159 @@
+"""Incremental, tolerant parser for the model's damage JSON.
+
+The model is asked for `{"damages": [{...}, ...]}` but in practice may wrap
+it in `<think>` blocks or markdown fences, or get cut off mid-array. The
+parser is fed text as it arrives (whole responses or streaming chunks),
+tracks JSON nesting itself, and hands back every damage object the moment
+its closing brace is seen, so nothing emitted before a truncation is lost.
+
+Only the first top-level JSON value counts, and only the entries of its
+"damages"/"danni" list (or the value itself, if it is a bare list), so the
+entries emitted while streaming are exactly those of `result()` on the
+complete text.
+"""
+import json
+import re
+
+# A full JSON string literal (group 1 is the closing quote, empty if the
+# string is still open at the end of the buffer) or a structural character.
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*("?)|[{}\[\]<]', re.DOTALL)
+_DECODER = json.JSONDecoder()
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+_DAMAGES_KEY = re.compile(r'"(?:damages|danni)"\s*:\s*$')
+
+
+class DamageStreamParser:
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._in_think = False
+        # (opening char, offset, whether it is the damages list)
+        self._stack: list[tuple[str, int, bool]] = []
+        self._top_level = 0  # top-level JSON values seen so far
+        self._closed = False
+        # The first top-level JSON value, if it is an object that parsed.
+        self.document: dict | None = None
+        # Every damage entry emitted so far, in order.
+        self.damages: list[dict] = []
+
+    def feed(self, chunk: str, final: bool = False) -> list[dict]:
+        """Consume [chunk]; return the damage objects completed by it.
+
+        final=True marks [chunk] as the end of input (same as calling close()).
+        """
+        self._text += chunk
+        self._closed = self._closed or final
+        return self._scan()
+
+    def close(self) -> list[dict]:
+        """Signal end of input (flushes a trailing partial `<think` marker)."""
+        return self.feed("", final=True)
+
+    def result(self) -> list | None:
+        """The damages once all input is in: the "damages"/"danni" list of the
+        top-level object if it parsed, else the entries completed before the
+        JSON broke off; None if there is neither."""
+        if self.document is not None:
+            return self.document.get("damages", self.document.get("danni", []))
+        return self.damages or None
+
+    def _open(self, ch: str, i: int) -> None:
+        if not self._stack:
+            self._top_level += 1
+            is_list = ch == "[" and self._top_level == 1
+        else:
+            # `"damages": [` directly inside the first top-level object
+            outer, start, _ = self._stack[0]
+            is_list = (
+                ch == "[" and len(self._stack) == 1 and outer == "{" and self._top_level == 1
+                and _DAMAGES_KEY.search(self._text, start, i) is not None
+            )
+        self._stack.append((ch, i, is_list))
+
+    def _scan(self) -> list[dict]:
+        # One compiled-regex search per token (a whole string literal counts as
+        # one token) instead of stepping through every character in Python.
+        text = self._text
+        n = len(text)
+        i = self._pos
+        emitted: list[dict] = []
+        while i < n:
+            if self._in_think:
+                end = text.find(_THINK_CLOSE, i)
+                if end < 0:
+                    # Keep the tail in case "</think>" is split across chunks.
+                    i = n if self._closed else max(i, n - len(_THINK_CLOSE) + 1)
+                    break
+                i = end + len(_THINK_CLOSE)
+                self._in_think = False
+                continue
+
+            m = _TOKEN.search(text, i)
+            if m is None:
+                i = n
+                break
+            i = m.start()
+            ch = text[i]
+            if ch == '"':
+                if not self._stack:
+                    i += 1  # quotes in prose around the JSON are ignored
+                    continue
+                if not m.group(1):  # string not terminated yet
+                    if not self._closed:
+                        break
+                    i = n
+                    break
+                i = m.end()
+                continue
+            if ch == "<":
+                if text.startswith(_THINK_OPEN, i):
+                    self._in_think = True
+                    i += len(_THINK_OPEN)
+                    continue
+                if not self._closed and n - i < len(_THINK_OPEN) and _THINK_OPEN.startswith(text[i:]):
+                    break  # possibly the start of "<think>", wait for more text
+            elif ch == "{" and not self._stack and self._closed and self._top_level == 0:
+                # Whole input available: let the C decoder take the top-level
+                # object in one go. Only if it fails (truncated/malformed) do we
+                # keep tokenizing inside it to recover individual entries.
+                try:
+                    parsed, end = _DECODER.raw_decode(text, i)
+                except json.JSONDecodeError:
+                    self._open(ch, i)
+                else:
+                    self._top_level += 1
+                    if isinstance(parsed, dict):
+                        self.document = parsed
+                    i = end
+                    continue
+            elif ch in "{[":
+                self._open(ch, i)
+            elif self._stack:
+                opener, start, _ = self._stack.pop()
+                if ch == "}" and opener == "{":
+                    self._on_object(text[start:i + 1], emitted)
+            i += 1
+        self._pos = i
+        return emitted
+
+    def _on_object(self, raw: str, emitted: list[dict]) -> None:
+        if self._top_level != 1:
+            return  # only the first top-level value counts
+        if not self._stack:
+            try:
+                parsed = json.loads(raw)
+            except json.JSONDecodeError:
+                return
+            if isinstance(parsed, dict):
+                self.document = parsed
+            return
+        if not self._stack[-1][2] or '"damage_type"' not in raw:
+            return  # not an entry of the damages list
+        try:
+            entry = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        if isinstance(entry, dict) and "damage_type" in entry:
+            self.damages.append(entry)
+            emitted.append(entry)
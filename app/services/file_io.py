@@ -0,0 +1,70 @@
+"""Bounded thread pool for blocking filesystem work.
+
+Everything the photo and analysis paths do on disk (staging uploads, moving
+and reading blobs, renditions, rehydrating wiped files, removing session
+directories, stat calls) goes through `run_io` instead of running on the
+event loop. The pool is separate from the default executor used by
+asyncio.to_thread (Pillow encoding and other CPU work) and is sized by
+`file_io_workers`. A burst of large uploads therefore queues for disk
+bandwidth here, instead of stalling the loop or taking every default thread.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_executor: ThreadPoolExecutor | None = None
+io_stats = {"submitted": 0, "in_flight": 0, "max_in_flight": 0}
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.file_io_workers), thread_name_prefix="file-io",
+        )
+        logger.info("Started file I/O pool with %d threads", settings.file_io_workers)
+    return _executor
+
+
+async def run_io(fn, /, *args, **kwargs):
+    """Run blocking [fn] in the file I/O pool (context vars preserved, like
+    asyncio.to_thread)."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    io_stats["submitted"] += 1
+    io_stats["in_flight"] += 1
+    io_stats["max_in_flight"] = max(io_stats["max_in_flight"], io_stats["in_flight"])
+    try:
+        return await loop.run_in_executor(get_io_executor(), call)
+    finally:
+        io_stats["in_flight"] -= 1
+
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write [data] to [path] via a temp file + rename: readers never see a
+    partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def shutdown_io_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
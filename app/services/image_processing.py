@@ -0,0 +1,108 @@
+"""Image preparation: EXIF orientation, downscale, JPEG re-encode.
+
+Used once at ingest (normalize_photo), for the VLM payload (prepare_jpeg)
+and for the photo renditions (render_image).
+
+Phone photos are typically 12MP+, far above what the provider actually looks
+at. Large JPEGs are decoded with Pillow's draft mode, which lets libjpeg scale
+by 1/2, 1/4 or 1/8 during DCT decoding, so full-size pixels are never
+materialised just to be thrown away by the resize.
+"""
+import logging
+import time
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+EXIF_ORIENTATION_TAG = 274
+
+# Running totals, exposed on /metrics.
+preprocess_stats = {
+    "photos": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+    "encode_seconds": 0.0,
+}
+
+
+def _transcode(
+    raw: bytes, max_edge: int | None, quality: int, image_format: str = "JPEG",
+) -> tuple[bytes, tuple[int, int], tuple[int, int], int | None]:
+    """Decode [raw], apply EXIF orientation, cap the long edge, encode.
+
+    Returns (data, source size, output size, EXIF orientation).
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(raw)) as im:
+        src_size = im.size
+        src_w, src_h = src_size
+        ori = im.getexif().get(EXIF_ORIENTATION_TAG)
+        if max_edge and max(src_w, src_h) > max_edge and im.format == "JPEG":
+            scale = max_edge / max(src_w, src_h)
+            # draft() picks the largest DCT reduction that stays >= the requested size
+            im.draft("RGB", (int(src_w * scale), int(src_h * scale)))
+        upright = ImageOps.exif_transpose(im).convert("RGB")
+        if max_edge and max(upright.size) > max_edge:
+            upright.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        buf = BytesIO()
+        upright.save(buf, format=image_format, quality=quality)
+        return buf.getvalue(), src_size, upright.size, ori
+
+
+def render_image(raw: bytes, max_edge: int | None, quality: int, image_format: str = "JPEG") -> bytes:
+    """Like prepare_jpeg, in any Pillow output format, without touching the
+    VLM preprocessing stats (used for the photo renditions)."""
+    return _transcode(raw, max_edge, quality, image_format)[0]
+
+
+def normalize_photo(raw: bytes, max_edge: int | None, quality: int) -> tuple[bytes | None, int]:
+    """Ingest-time normalization: upright (EXIF applied), long edge <=
+    [max_edge], JPEG. Returns (data, long edge of the result); data is None
+    when [raw] already is all of that, so it is stored as is instead of
+    losing quality to a re-encode.
+
+    Raises if Pillow can't decode the image.
+    """
+    from PIL import Image
+
+    with Image.open(BytesIO(raw)) as im:
+        ori = im.getexif().get(EXIF_ORIENTATION_TAG)
+        if im.format == "JPEG" and ori in (None, 1) and (not max_edge or max(im.size) <= max_edge):
+            return None, max(im.size)
+    data, (src_w, src_h), (out_w, out_h), ori = _transcode(raw, max_edge, quality)
+    logger.info(
+        "Normalized photo at ingest %dx%d -> %dx%d (EXIF orientation=%s): %d -> %d bytes",
+        src_w, src_h, out_w, out_h, ori, len(raw), len(data),
+    )
+    return data, max(out_w, out_h)
+
+
+def webp_supported() -> bool:
+    from PIL import features
+
+    return bool(features.check("webp"))
+
+
+def prepare_jpeg(raw: bytes, max_edge: int | None, quality: int) -> bytes:
+    """Return [raw] upright (EXIF applied), long edge <= [max_edge], as JPEG.
+
+    max_edge None/0 keeps the original resolution. Raises if Pillow can't
+    decode the image; callers decide whether to fall back to the raw bytes.
+    """
+    started = time.perf_counter()
+    data, (src_w, src_h), (out_w, out_h), ori = _transcode(raw, max_edge, quality)
+    elapsed = time.perf_counter() - started
+
+    preprocess_stats["photos"] += 1
+    preprocess_stats["bytes_in"] += len(raw)
+    preprocess_stats["bytes_out"] += len(data)
+    preprocess_stats["encode_seconds"] += elapsed
+    if ori and ori != 1:
+        logger.info("Photo EXIF orientation=%s — physically rotated before encoding", ori)
+    logger.info(
+        "Prepared photo %dx%d -> %dx%d: %d -> %d bytes (saved %d, %.0f%%) in %.1f ms",
+        src_w, src_h, out_w, out_h, len(raw), len(data), len(raw) - len(data),
+        100.0 * (len(raw) - len(data)) / len(raw) if raw else 0.0, elapsed * 1000,
+    )
+    return data
@@ -0,0 +1,337 @@
+"""DB-backed queue for session analysis jobs.
+
+`complete_session` / `reanalyze_session` only enqueue a row in `analysis_jobs`;
+a bounded pool of workers started in the app lifespan claims jobs with a lease,
+runs `analyze_session`, retries failures with exponential backoff and, on
+startup, re-queues work left behind by a process that died mid-analysis.
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, delete, or_, select, update
+
+from app.config import settings
+from app.database import async_session
+from app.models.analysis import AnalysisResult, Damage
+from app.models.job import AnalysisJob
+from app.models.session import Session
+from app.services.ai_service import analyze_session
+
+logger = logging.getLogger(__name__)
+
+_workers: list[asyncio.Task] = []
+_wakeup: asyncio.Event | None = None
+
+
+def _iso_now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _notify_workers() -> None:
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def enqueue_analysis(session_id: str) -> str:
+    """Queue an analysis for [session_id] and return the job id.
+
+    A job still waiting in the queue for the same session is reused instead of
+    stacking a duplicate.
+    """
+    async with async_session() as db:
+        result = await db.execute(
+            select(AnalysisJob).where(
+                AnalysisJob.session_id == session_id,
+                AnalysisJob.status == "queued",
+            )
+        )
+        job = result.scalars().first()
+        if job:
+            job.run_after = min(job.run_after, time.time())
+        else:
+            job = AnalysisJob(
+                id=str(uuid.uuid4()),
+                session_id=session_id,
+                status="queued",
+                attempts=0,
+                run_after=time.time(),
+                created_at=_iso_now(),
+            )
+            db.add(job)
+        await db.commit()
+        job_id = job.id
+
+    logger.info("Analysis job %s queued for session %s", job_id, session_id)
+    _notify_workers()
+    return job_id
+
+
+async def has_running_job(db, session_id: str) -> bool:
+    """True while a worker holds a live lease on a job of [session_id]."""
+    running = await db.scalar(
+        select(AnalysisJob.id).where(
+            AnalysisJob.session_id == session_id,
+            AnalysisJob.status == "running",
+            AnalysisJob.lease_expires_at > time.time(),
+        ).limit(1)
+    )
+    return running is not None
+
+
+async def delete_jobs_for_session(db, session_id: str) -> None:
+    """Drop every job of a session (caller commits). Used when the session is deleted."""
+    await db.execute(delete(AnalysisJob).where(AnalysisJob.session_id == session_id))
+
+
+async def _claim_next_job() -> tuple[str, str, int] | None:
+    """Claim the next runnable job. Returns (job_id, session_id, attempt) or None.
+
+    Runnable = queued and due, or running with an expired lease (its worker
+    died). Sessions that already have a live running job are skipped so two
+    analyses of the same session never overlap. The claim is an optimistic
+    UPDATE guarded on status + attempts, which is safe across processes on
+    both SQLite and Postgres.
+    """
+    now = time.time()
+    async with async_session() as db:
+        busy_sessions = select(AnalysisJob.session_id).where(
+            AnalysisJob.status == "running",
+            AnalysisJob.lease_expires_at > now,
+        )
+        result = await db.execute(
+            select(AnalysisJob)
+            .where(
+                or_(
+                    and_(AnalysisJob.status == "queued", AnalysisJob.run_after <= now),
+                    and_(AnalysisJob.status == "running", AnalysisJob.lease_expires_at <= now),
+                ),
+                AnalysisJob.session_id.not_in(busy_sessions),
+            )
+            .order_by(AnalysisJob.run_after)
+            .limit(1)
+        )
+        job = result.scalars().first()
+        if not job:
+            return None
+
+        if job.status == "running":
+            logger.warning(
+                "Analysis job %s lease expired (attempt %d) — reclaiming", job.id, job.attempts,
+            )
+            if job.attempts >= settings.analysis_job_max_attempts:
+                await _fail_job(db, job.id, job.session_id, "Lease scaduto: worker interrotto")
+                await db.commit()
+                return None
+
+        job_id, session_id, attempt = job.id, job.session_id, job.attempts + 1
+        claimed = await db.execute(
+            update(AnalysisJob)
+            .where(
+                AnalysisJob.id == job_id,
+                AnalysisJob.status == job.status,
+                AnalysisJob.attempts == job.attempts,
+            )
+            .values(
+                status="running",
+                attempts=attempt,
+                lease_expires_at=now + settings.analysis_job_lease_seconds,
+            )
+        )
+        await db.commit()
+        if claimed.rowcount != 1:
+            return None  # another worker won the race
+        return job_id, session_id, attempt
+
+
+async def _renew_lease(job_id: str) -> None:
+    """Keep extending the lease while the job runs so it isn't reclaimed."""
+    interval = max(settings.analysis_job_lease_seconds / 3, 1.0)
+    while True:
+        await asyncio.sleep(interval)
+        async with async_session() as db:
+            await db.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.id == job_id, AnalysisJob.status == "running")
+                .values(lease_expires_at=time.time() + settings.analysis_job_lease_seconds)
+            )
+            await db.commit()
+
+
+async def _discard_unfinished_analysis(db, session_id: str) -> None:
+    """Remove `processing` analysis rows (and their damages) left by an interrupted attempt."""
+    result = await db.execute(
+        select(AnalysisResult.id).where(
+            AnalysisResult.session_id == session_id,
+            AnalysisResult.status == "processing",
+        )
+    )
+    stale_ids = list(result.scalars().all())
+    if not stale_ids:
+        return
+    await db.execute(delete(Damage).where(Damage.analysis_id.in_(stale_ids)))
+    await db.execute(delete(AnalysisResult).where(AnalysisResult.id.in_(stale_ids)))
+    logger.info("Discarded %d unfinished analysis rows for session %s", len(stale_ids), session_id)
+
+
+async def _fail_job(db, job_id: str, session_id: str, error: str) -> None:
+    """Mark a job permanently failed and surface it on the session's analysis (caller commits)."""
+    await db.execute(
+        update(AnalysisJob)
+        .where(AnalysisJob.id == job_id)
+        .values(status="failed", last_error=error, finished_at=_iso_now(), lease_expires_at=None)
+    )
+    await db.execute(
+        update(AnalysisResult)
+        .where(AnalysisResult.session_id == session_id, AnalysisResult.status == "processing")
+        .values(status="error", raw_response=json.dumps({"error": f"Analisi non completata: {error[:200]}"}))
+    )
+    logger.error("Analysis job %s for session %s FAILED permanently: %s", job_id, session_id, error)
+
+
+async def _record_failure(job_id: str, session_id: str, attempt: int, exc: BaseException) -> None:
+    error = re.sub(r"sk-[A-Za-z0-9_-]+", "sk-***", f"{type(exc).__name__}: {exc}")
+    async with async_session() as db:
+        if attempt >= settings.analysis_job_max_attempts:
+            await _fail_job(db, job_id, session_id, error)
+        else:
+            delay = settings.analysis_job_retry_base_seconds * (2 ** (attempt - 1))
+            await db.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.id == job_id)
+                .values(
+                    status="queued",
+                    run_after=time.time() + delay,
+                    lease_expires_at=None,
+                    last_error=error,
+                )
+            )
+            logger.warning(
+                "Analysis job %s attempt %d failed (%s) — retrying in %.0fs",
+                job_id, attempt, error, delay,
+            )
+        await db.commit()
+
+
+async def process_next_job() -> bool:
+    """Claim and run one job. Returns False when nothing was runnable."""
+    claimed = await _claim_next_job()
+    if claimed is None:
+        return False
+    job_id, session_id, attempt = claimed
+    logger.info("Running analysis job %s for session %s (attempt %d)", job_id, session_id, attempt)
+
+    heartbeat = asyncio.create_task(_renew_lease(job_id))
+    try:
+        async with async_session() as db:
+            await _discard_unfinished_analysis(db, session_id)
+            await db.commit()
+        # The user's call is charged by the first attempt only
+        await asyncio.wait_for(
+            analyze_session(session_id, charge_user=attempt == 1),
+            timeout=settings.analysis_job_timeout_seconds,
+        )
+    except Exception as exc:
+        logger.exception("Analysis job %s raised", job_id)
+        await _record_failure(job_id, session_id, attempt, exc)
+    else:
+        async with async_session() as db:
+            await db.execute(
+                update(AnalysisJob)
+                .where(AnalysisJob.id == job_id)
+                .values(status="done", finished_at=_iso_now(), lease_expires_at=None)
+            )
+            await db.commit()
+    finally:
+        heartbeat.cancel()
+    return True
+
+
+async def _worker_loop(worker_no: int) -> None:
+    assert _wakeup is not None
+    while True:
+        # Cleared before claiming: a job enqueued while we claim sets it again
+        # and the wait below returns at once instead of after the poll timeout.
+        _wakeup.clear()
+        try:
+            ran = await process_next_job()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Analysis worker %d crashed while claiming a job", worker_no)
+            ran = False
+        if ran:
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=settings.analysis_job_poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def recover_stale_jobs() -> int:
+    """Startup sweep: make sure every unfinished analysis has a runnable job.
+
+    - running jobs whose lease already expired go straight back to the queue;
+    - sessions still `uploaded` with no job and no finished analysis (e.g.
+      started by the old fire-and-forget task and lost in a restart) get one.
+    Returns the number of jobs re-queued or created.
+    """
+    now = time.time()
+    recovered = 0
+    async with async_session() as db:
+        expired = await db.execute(
+            update(AnalysisJob)
+            .where(AnalysisJob.status == "running", AnalysisJob.lease_expires_at <= now)
+            .values(status="queued", run_after=now, lease_expires_at=None)
+        )
+        recovered += expired.rowcount or 0
+
+        jobless = await db.execute(
+            select(Session.id).where(
+                Session.status == "uploaded",
+                Session.id.not_in(select(AnalysisJob.session_id)),
+                Session.id.not_in(
+                    select(AnalysisResult.session_id).where(AnalysisResult.status != "processing")
+                ),
+            )
+        )
+        for session_id in jobless.scalars().all():
+            db.add(AnalysisJob(
+                id=str(uuid.uuid4()),
+                session_id=session_id,
+                status="queued",
+                attempts=0,
+                run_after=now,
+                created_at=_iso_now(),
+            ))
+            recovered += 1
+        await db.commit()
+
+    if recovered:
+        logger.warning("Recovery sweep re-queued %d analysis jobs", recovered)
+    return recovered
+
+
+def start_workers() -> None:
+    global _wakeup
+    if _workers:
+        return
+    _wakeup = asyncio.Event()
+    for n in range(max(settings.analysis_workers, 1)):
+        _workers.append(asyncio.create_task(_worker_loop(n), name=f"analysis-worker-{n}"))
+    logger.info("Started %d analysis workers", len(_workers))
+
+
+async def stop_workers() -> None:
+    """Cancel the worker pool. Jobs interrupted here keep their lease and are
+    reclaimed once it expires (or by the next startup sweep)."""
+    global _wakeup
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _wakeup = None
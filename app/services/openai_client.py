@@ -0,0 +1,70 @@
+"""Process-wide AsyncOpenAI client.
+
+One client (and one httpx connection pool) is shared by every analysis so
+TLS sessions stay warm across sessions and photos. It is opened in the app
+lifespan and closed on shutdown; `get_openai_client()` also creates it lazily
+for code paths that run outside the lifespan (scripts, tests).
+"""
+import logging
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_client = None  # openai.AsyncOpenAI
+
+
+def _http2_enabled() -> bool:
+    if not settings.openai_http2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("openai_http2 enabled but the 'h2' package is missing — using HTTP/1.1")
+        return False
+    return True
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.openai_max_connections,
+        max_keepalive_connections=settings.openai_max_keepalive_connections,
+        keepalive_expiry=settings.openai_keepalive_expiry_seconds,
+    )
+    return httpx.AsyncClient(
+        http2=_http2_enabled(),
+        limits=limits,
+        timeout=httpx.Timeout(settings.openai_timeout_seconds, connect=10.0),
+    )
+
+
+def get_openai_client():
+    """Return the shared AsyncOpenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        from openai import AsyncOpenAI
+
+        kwargs = {
+            "api_key": settings.openai_api_key,
+            "timeout": settings.openai_timeout_seconds,
+            # Retries go through the provider limiter (ai_service._create_completion)
+            "max_retries": 0,
+            "http_client": _build_http_client(),
+        }
+        if settings.openai_base_url:
+            kwargs["base_url"] = settings.openai_base_url
+        _client = AsyncOpenAI(**kwargs)
+        logger.info(
+            "Created shared AsyncOpenAI client (max_connections=%d, keepalive=%d)",
+            settings.openai_max_connections, settings.openai_max_keepalive_connections,
+        )
+    return _client
+
+
+async def close_openai_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
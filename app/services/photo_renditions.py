@@ -0,0 +1,211 @@
+"""Derived photo renditions (thumbnail / medium / full, JPEG or WebP).
+
+GET /sessions/{id}/photos/{photo_id}?size=thumb&format=webp serves a resized,
+re-encoded copy of the photo instead of the multi-megabyte original, so list
+views load in kilobytes. Each rendition is rendered once, off the event loop,
+and kept in a disk cache under `<data_dir>/renditions`:
+
+    <data_dir>/renditions/<key[:2]>/<key>.<ext>
+
+The key covers the source (content hash, or photo id for photos stored before
+the blob store), the variant and the encoder settings, so changing an edge or
+quality setting never serves a stale file. Total size is capped at
+`photo_rendition_cache_max_bytes`; the least recently served files are
+evicted first (recency = file mtime, refreshed on every hit).
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import settings
+from app.services import photo_store
+from app.services.file_io import read_file, run_io, write_atomic
+from app.services.image_processing import render_image, webp_supported
+
+logger = logging.getLogger(__name__)
+
+SIZES = ("thumb", "medium", "full")
+FORMATS = {
+    # format -> (Pillow format, media type, file extension)
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+}
+
+# Bump when rendering changes so old cached files stop matching.
+_KEY_VERSION = 1
+
+
+def _max_edge(size: str) -> int | None:
+    if size == "thumb":
+        return settings.photo_thumb_edge
+    if size == "medium":
+        return settings.photo_medium_edge
+    return None
+
+
+def resolve_format(fmt: str) -> str:
+    """[fmt], or "jpeg" when this Pillow build can't encode WebP."""
+    if fmt == "webp" and not webp_supported():
+        return "jpeg"
+    return fmt
+
+
+class RenditionCache:
+    """Size-capped LRU of rendered files on disk.
+
+    The index (path -> size, least recently used first) is built from a
+    directory scan on first use and kept in memory; files another process
+    removed are simply re-rendered.
+    """
+
+    def __init__(self):
+        self._directory: str | None = None
+        self._index: OrderedDict[str, int] = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()  # get/put run in worker threads
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "render_seconds": 0.0}
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(settings.data_dir, "renditions")
+
+    def _load_index(self) -> None:
+        if self._directory == self.directory:
+            return
+        self._directory = self.directory
+        entries = []
+        for root, _dirs, files in os.walk(self._directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+        entries.sort()
+        self._index = OrderedDict((path, size) for _mtime, path, size in entries)
+        self._total = sum(self._index.values())
+
+    def path_for(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ext)
+
+    def get(self, path: str) -> str | None:
+        """[path] if cached (marking it most recently used), else None."""
+        with self._lock:
+            self._load_index()
+            try:
+                os.utime(path)
+                size = os.path.getsize(path)
+            except OSError:
+                self._forget(path)
+                return None
+            if path not in self._index:
+                self._index[path] = size
+                self._total += size
+            self._index.move_to_end(path)
+            return path
+
+    def put(self, path: str, data: bytes) -> None:
+        write_atomic(path, data)
+        with self._lock:
+            self._load_index()
+            self._forget(path)
+            self._index[path] = len(data)
+            self._total += len(data)
+            self._evict(keep=path)
+
+    def _forget(self, path: str) -> None:
+        size = self._index.pop(path, None)
+        if size is not None:
+            self._total -= size
+
+    def _evict(self, keep: str) -> None:
+        limit = settings.photo_rendition_cache_max_bytes
+        while self._total > limit and len(self._index) > 1:
+            path = next(iter(self._index))
+            if path == keep:
+                self._index.move_to_end(path)
+                continue
+            self._forget(path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.stats["evictions"] += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {**self.stats, "files": len(self._index), "bytes": self._total}
+
+
+rendition_cache = RenditionCache()
+_rendering: dict[str, asyncio.Future] = {}
+
+
+def rendition_key(photo, size: str, fmt: str) -> str:
+    """Cache key (and ETag) of one rendition of [photo]."""
+    source = photo.content_hash or f"photo:{photo.id}"
+    material = (
+        f"{_KEY_VERSION}|{source}|{size}|{fmt}|{_max_edge(size)}|{settings.photo_rendition_quality}"
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _render(raw: bytes, size: str, fmt: str) -> bytes:
+    started = time.perf_counter()
+    data = render_image(raw, _max_edge(size), settings.photo_rendition_quality, FORMATS[fmt][0])
+    rendition_cache.stats["render_seconds"] += time.perf_counter() - started
+    logger.info("Rendered %s/%s photo rendition: %d -> %d bytes", size, fmt, len(raw), len(data))
+    return data
+
+
+def _read_source(file_path: str | None) -> bytes | None:
+    if file_path and os.path.exists(file_path):
+        return read_file(file_path)
+    return None
+
+
+async def get_rendition(photo, size: str, fmt: str) -> str | None:
+    """Path of [photo]'s [size]/[fmt] rendition, rendering it on a cache miss.
+
+    Returns None if the photo's bytes are not available anywhere. [fmt] must
+    already be resolved (see resolve_format). Concurrent requests for the same
+    missing rendition share one render.
+    """
+    key = rendition_key(photo, size, fmt)
+    path = rendition_cache.path_for(key, FORMATS[fmt][2])
+    if await run_io(rendition_cache.get, path):
+        rendition_cache.stats["hits"] += 1
+        return path
+
+    pending = _rendering.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    future = asyncio.get_running_loop().create_future()
+    _rendering[key] = future
+    try:
+        raw = await run_io(_read_source, photo.file_path)
+        if raw is None:
+            raw = await photo_store.fallback_bytes(photo)
+        if raw is None:
+            future.set_result(None)
+            return None
+        rendition_cache.stats["misses"] += 1
+        data = await asyncio.to_thread(_render, raw, size, fmt)  # CPU: default executor
+        await run_io(rendition_cache.put, path, data)
+        future.set_result(path)
+        return path
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as exc:
+        future.set_exception(exc)
+        future.exception()  # waiters re-raise; don't log "never retrieved"
+        raise
+    finally:
+        del _rendering[key]
@@ -0,0 +1,202 @@
+"""Where the bytes of a photo blob live (the durable copy).
+
+photo_store keeps the index (photo_blobs rows: hash, size, ref_count) and a
+local file per blob under `<data_dir>/blobs`; the backend selected by
+`photo_storage_backend` holds the durable copy:
+
+    db      photo_blobs.data (BYTEA). Survives Render's ephemeral disk, but
+            bloats the database and its backups. Default, as before.
+    local   the local file itself. For hosts with a persistent volume.
+    s3      an S3-compatible bucket (AWS, MinIO, ...). Needs boto3, which is
+            imported only when this backend is used. With
+            `photo_storage_redirect`, photo requests are answered with a
+            redirect to a presigned URL, so the API never proxies the bytes.
+
+Each blob row records the backend it was written to, so switching the
+setting only affects new uploads; existing blobs are still read from where
+they are. Writes take the staged upload file and stream it (S3 multipart
+upload); reads of the S3 object stream into the local file.
+"""
+import logging
+import os
+from abc import ABC, abstractmethod
+
+from sqlalchemy import select, update
+
+from app.config import settings
+from app.database import async_session
+from app.models.photo_blob import PhotoBlob
+from app.services.file_io import read_file, run_io, write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoStorage(ABC):
+    """Backend interface. Blocking work (files, boto3) runs in the file I/O pool."""
+
+    name = ""
+
+    @abstractmethod
+    async def put(self, db, digest: str, path: str) -> None:
+        """Store the file at [path] as blob [digest] (in [db]'s transaction
+        where the backend is the DB). [path] is left in place."""
+
+    @abstractmethod
+    async def read(self, digest: str) -> bytes | None:
+        """Bytes of blob [digest], or None if the backend doesn't have it."""
+
+    async def fetch_to_file(self, digest: str, path: str) -> bool:
+        """Write blob [digest] to [path]; False if the backend doesn't have it."""
+        data = await self.read(digest)
+        if data is None:
+            return False
+        await run_io(write_atomic, path, data)
+        return True
+
+    @abstractmethod
+    async def delete(self, digests: list[str]) -> None:
+        """Remove the given blobs (missing ones are ignored)."""
+
+    async def presigned_url(self, digest: str) -> str | None:
+        """A URL clients can fetch the blob from directly, if supported."""
+        return None
+
+
+class DbStorage(PhotoStorage):
+    name = "db"
+
+    async def put(self, db, digest: str, path: str) -> None:
+        data = await run_io(read_file, path)
+        await db.execute(update(PhotoBlob).where(PhotoBlob.hash == digest).values(data=data))
+
+    async def read(self, digest: str) -> bytes | None:
+        async with async_session() as db:
+            data = await db.scalar(select(PhotoBlob.data).where(PhotoBlob.hash == digest))
+        return bytes(data) if data is not None else None
+
+    async def delete(self, digests: list[str]) -> None:
+        pass  # the bytes go with the photo_blobs row
+
+
+class LocalStorage(PhotoStorage):
+    """The local blob file is the durable copy: nothing else to write."""
+
+    name = "local"
+
+    async def put(self, db, digest: str, path: str) -> None:
+        pass
+
+    async def read(self, digest: str) -> bytes | None:
+        from app.services.photo_store import blob_path
+
+        try:
+            return await run_io(read_file, blob_path(digest))
+        except FileNotFoundError:
+            return None
+
+    async def fetch_to_file(self, digest: str, path: str) -> bool:
+        return await run_io(os.path.exists, path)
+
+    async def delete(self, digests: list[str]) -> None:
+        pass  # photo_store removes the local files of released blobs
+
+
+class S3Storage(PhotoStorage):
+    name = "s3"
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            try:
+                import boto3
+            except ImportError as e:
+                raise RuntimeError(
+                    "photo_storage_backend=s3 needs boto3 (pip install boto3)"
+                ) from e
+            self._client = boto3.client(
+                "s3",
+                endpoint_url=settings.s3_endpoint_url or None,
+                region_name=settings.s3_region or None,
+                aws_access_key_id=settings.s3_access_key_id or None,
+                aws_secret_access_key=settings.s3_secret_access_key or None,
+            )
+            logger.info("Created S3 client for bucket %s (endpoint=%s)", settings.s3_bucket, settings.s3_endpoint_url or "aws")
+        return self._client
+
+    def _key(self, digest: str) -> str:
+        return f"{settings.s3_prefix}{digest[:2]}/{digest}.jpg"
+
+    async def put(self, db, digest: str, path: str) -> None:
+        # upload_file streams from disk (multipart for large files)
+        await run_io(
+            self.client.upload_file, path, settings.s3_bucket, self._key(digest),
+            ExtraArgs={"ContentType": "image/jpeg"},
+        )
+
+    async def read(self, digest: str) -> bytes | None:
+        def _get() -> bytes | None:
+            try:
+                response = self.client.get_object(Bucket=settings.s3_bucket, Key=self._key(digest))
+            except self.client.exceptions.NoSuchKey:
+                return None
+            return response["Body"].read()
+
+        return await run_io(_get)
+
+    async def fetch_to_file(self, digest: str, path: str) -> bool:
+        def _download() -> bool:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                self.client.download_file(settings.s3_bucket, self._key(digest), tmp_path)
+            except Exception as e:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                if _is_not_found(e):
+                    return False
+                raise
+            os.replace(tmp_path, path)
+            return True
+
+        return await run_io(_download)
+
+    async def delete(self, digests: list[str]) -> None:
+        if not digests:
+            return
+        objects = [{"Key": self._key(d)} for d in digests]
+        for i in range(0, len(objects), 1000):  # DeleteObjects limit
+            await run_io(
+                self.client.delete_objects,
+                Bucket=settings.s3_bucket,
+                Delete={"Objects": objects[i:i + 1000], "Quiet": True},
+            )
+
+    async def presigned_url(self, digest: str) -> str | None:
+        return await run_io(
+            self.client.generate_presigned_url,
+            "get_object",
+            Params={"Bucket": settings.s3_bucket, "Key": self._key(digest)},
+            ExpiresIn=settings.s3_presign_seconds,
+        )
+
+
+def _is_not_found(exc: Exception) -> bool:
+    error = getattr(exc, "response", None) or {}
+    return str(error.get("Error", {}).get("Code")) in ("404", "NoSuchKey", "NotFound")
+
+
+_backends: dict[str, PhotoStorage] = {}
+
+
+def get_storage(name: str | None = None) -> PhotoStorage:
+    """Backend [name] (default: the configured one for new uploads)."""
+    name = name or settings.photo_storage_backend
+    if name not in _backends:
+        backend_classes = {"db": DbStorage, "local": LocalStorage, "s3": S3Storage}
+        if name not in backend_classes:
+            raise ValueError(f"Unknown photo storage backend: {name}")
+        _backends[name] = backend_classes[name]()
+    return _backends[name]
@@ -0,0 +1,336 @@
+"""Content-addressed, reference-counted store for photo bytes.
+
+Each distinct image is kept once, keyed by the sha256 of its bytes:
+
+    photo_blobs row                            index: size, ref_count, backend
+    storage backend (photo_storage.py)         durable copy: DB, local or S3
+    <data_dir>/blobs/<hash[:2]>/<hash>.jpg     local copy (fast reads; with the
+                                               db/s3 backends a cache that may be wiped)
+
+`Photo.content_hash` references the blob and `Photo.file_path` points at the
+disk copy, so readers that only know about `file_path` keep working. Retries,
+re-uploads and `/reanalyze` with the same files only bump `ref_count`; a blob
+and its file are removed when the last photo using it is deleted.
+
+Uploads go through `stage_upload` (chunked copy to a temp file, hashed on the
+way, size limit enforced), `normalize_staged` (upright, capped JPEG; see
+`photo_normalize_on_ingest`) and then `add_ref`, which moves the staged file into
+place; only a blob not seen before is read back into memory for the DB copy.
+
+Photos stored before this module existed have no hash and keep their bytes in
+`Photo.image_data` under data/sessions; they are still served as before.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+from sqlalchemy import delete, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.database import async_session
+from app.models.photo import Photo
+from app.models.photo_blob import PhotoBlob
+from app.services.file_io import read_file, run_io, write_atomic
+from app.services.image_processing import normalize_photo
+from app.services.photo_storage import PhotoStorage, get_storage
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_BYTES = 256 * 1024
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def blob_path(digest: str) -> str:
+    return os.path.abspath(os.path.join(settings.data_dir, "blobs", digest[:2], f"{digest}.jpg"))
+
+
+class PhotoTooLargeError(Exception):
+    def __init__(self, limit: int):
+        super().__init__(f"photo larger than {limit} bytes")
+        self.limit = limit
+
+
+class BlobWriteError(OSError):
+    """The local blob file could not be written where it is the only copy
+    (`local` storage backend)."""
+
+
+@dataclass
+class StagedPhoto:
+    """An upload copied to a temp file, with its hash, ready for add_ref."""
+    path: str
+    digest: str
+    size: int
+
+
+def _open_staging_file():
+    staging_dir = os.path.join(settings.data_dir, "blobs", "tmp")
+    try:
+        os.makedirs(staging_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=staging_dir, suffix=".part")
+    except OSError:
+        # Read-only data dir: stage in the system temp dir instead.
+        fd, path = tempfile.mkstemp(suffix=".part")
+    return os.fdopen(fd, "wb"), path
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def stage_upload(upload, max_bytes: int = 0) -> StagedPhoto:
+    """Copy [upload] (anything with `async read(n)`, e.g. UploadFile) to a
+    temp file in UPLOAD_CHUNK_BYTES chunks, hashing as they arrive, so the
+    photo is never held in memory whole. File writes run in the file I/O pool.
+
+    Raises PhotoTooLargeError as soon as more than [max_bytes] (0 = no limit)
+    have been read; nothing is left on disk in that case.
+    """
+    if max_bytes and (getattr(upload, "size", None) or 0) > max_bytes:
+        raise PhotoTooLargeError(max_bytes)
+    f, path = await run_io(_open_staging_file)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+            size += len(chunk)
+            if max_bytes and size > max_bytes:
+                raise PhotoTooLargeError(max_bytes)
+            digest.update(chunk)
+            await run_io(f.write, chunk)
+        await run_io(f.close)
+    except BaseException:
+        f.close()
+        _remove_quietly(path)
+        raise
+    return StagedPhoto(path=path, digest=digest.hexdigest(), size=size)
+
+
+async def normalize_staged(staged: StagedPhoto) -> tuple[StagedPhoto, int]:
+    """Normalize a staged upload in place (see image_processing.normalize_photo).
+
+    Returns the (possibly re-encoded) staged photo, hashed again, and the
+    long edge of the normalized image (0 = not normalized: bytes Pillow
+    can't decode are kept as uploaded).
+    """
+    raw = await run_io(read_file, staged.path)
+    try:
+        data, edge = await asyncio.to_thread(
+            normalize_photo, raw, settings.photo_ingest_max_edge, settings.photo_ingest_jpeg_quality,
+        )
+    except Exception as e:
+        logger.warning("Could not normalize uploaded photo (%s) — storing it as uploaded", e)
+        return staged, 0
+    if data is None:
+        return staged, edge
+    await run_io(write_atomic, staged.path, data)
+    return StagedPhoto(path=staged.path, digest=content_hash(data), size=len(data)), edge
+
+
+async def discard(staged: StagedPhoto) -> None:
+    """Remove [staged]'s temp file if add_ref did not consume it."""
+    await run_io(_remove_quietly, staged.path)
+
+
+def _place_file(staged_path: str, path: str, durable: bool = False) -> None:
+    """Move a staged upload to its blob path unless already there (same hash
+    = same bytes). [durable]: the file is the only copy of the bytes, so it
+    is always (re)placed and a failure raises BlobWriteError."""
+    if os.path.exists(path) and not durable:
+        _remove_quietly(staged_path)
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(staged_path, path)  # atomic: readers never see a partial file
+    except OSError as e:
+        _remove_quietly(staged_path)
+        if durable:
+            logger.error("Could not write photo blob to %s (its only copy): %s", path, e)
+            raise BlobWriteError(f"Could not write photo blob to {path}: {e}") from e
+        # Disk write may fail on read-only filesystems; the backend copy is enough.
+        logger.warning("Could not write photo blob to %s", path)
+
+
+def _remove_files(digests: list[str]) -> None:
+    for digest in digests:
+        try:
+            os.remove(blob_path(digest))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.warning("Could not remove photo blob %s", digest)
+
+
+async def add_ref(db: AsyncSession, staged: StagedPhoto) -> str:
+    """Store [staged] (or reference the existing copy) and return its hash.
+
+    Runs in the caller's transaction: the reference is only kept if the caller
+    commits together with the Photo row that uses it. The staged file is
+    consumed: written to the storage backend when the blob is new, then moved
+    to the local blob path. Raises BlobWriteError if that move fails for a
+    blob whose backend is `local` (the file is its only copy).
+    """
+    digest = staged.digest
+    bump = (
+        update(PhotoBlob)
+        .where(PhotoBlob.hash == digest)
+        .values(ref_count=PhotoBlob.ref_count + 1)
+    )
+    if (await db.execute(bump)).rowcount == 0:
+        storage = get_storage()
+        try:
+            async with db.begin_nested():
+                db.add(PhotoBlob(
+                    hash=digest,
+                    size_bytes=staged.size,
+                    ref_count=1,
+                    storage=storage.name,
+                    created_at=time.time(),
+                ))
+        except IntegrityError:
+            # The same bytes were stored concurrently by another upload.
+            await db.execute(bump)
+        else:
+            await storage.put(db, digest, staged.path)
+    else:
+        logger.info("Photo blob %s already stored — deduplicated %d bytes", digest[:12], staged.size)
+    storage_name = await db.scalar(select(PhotoBlob.storage).where(PhotoBlob.hash == digest))
+    await run_io(_place_file, staged.path, blob_path(digest), storage_name == "local")
+    return digest
+
+
+async def release(db: AsyncSession, digests: list[str]) -> list[tuple[str, str]]:
+    """Drop one reference per entry of [digests] and delete the rows of blobs
+    nobody uses any more. Returns those blobs as (hash, storage); pass them
+    to `purge` once the caller has committed."""
+    counts = Counter(d for d in digests if d)
+    if not counts:
+        return []
+    for digest, n in counts.items():
+        await db.execute(
+            update(PhotoBlob)
+            .where(PhotoBlob.hash == digest)
+            .values(ref_count=PhotoBlob.ref_count - n)
+        )
+    orphans = (await db.execute(
+        select(PhotoBlob.hash, PhotoBlob.storage)
+        .where(PhotoBlob.hash.in_(counts), PhotoBlob.ref_count <= 0)
+    )).all()
+    if orphans:
+        await db.execute(
+            delete(PhotoBlob).where(PhotoBlob.hash.in_([h for h, _s in orphans]), PhotoBlob.ref_count <= 0)
+        )
+    return [(digest, storage or "db") for digest, storage in orphans]
+
+
+async def purge(orphans: list[tuple[str, str]]) -> None:
+    """Delete the bytes of blobs released (and committed) by `release`.
+
+    Done after the commit so a rolled-back release never loses bytes that
+    live outside the DB (local files, S3 objects). Blobs stored again in the
+    meantime (a concurrent upload of the same bytes re-created the row) are
+    left alone.
+    """
+    if not orphans:
+        return
+    async with async_session() as db:
+        revived = set((await db.scalars(
+            select(PhotoBlob.hash).where(PhotoBlob.hash.in_([digest for digest, _storage in orphans]))
+        )).all())
+    if revived:
+        logger.info("Keeping %d released photo blobs stored again meanwhile", len(revived))
+        orphans = [(digest, storage) for digest, storage in orphans if digest not in revived]
+    by_storage: dict[str, list[str]] = {}
+    for digest, storage in orphans:
+        by_storage.setdefault(storage, []).append(digest)
+    for storage, digests in by_storage.items():
+        try:
+            await get_storage(storage).delete(digests)
+        except Exception:
+            logger.exception("Could not delete %d photo blobs from %s", len(digests), storage)
+    if orphans:
+        await run_io(_remove_files, [digest for digest, _storage in orphans])
+
+
+async def _storage_of(digest: str) -> PhotoStorage | None:
+    async with async_session() as db:
+        row = await db.execute(select(PhotoBlob.storage).where(PhotoBlob.hash == digest))
+        found = row.first()
+    return get_storage(found[0] or "db") if found else None
+
+
+async def load_bytes(digest: str) -> bytes | None:
+    """Durable copy of blob [digest] (from its storage backend), or None."""
+    async with async_session() as db:
+        found = (await db.execute(
+            select(PhotoBlob.storage, PhotoBlob.data).where(PhotoBlob.hash == digest)
+        )).first()
+    if found is None:
+        return None
+    storage, data = found
+    if (storage or "db") == "db":
+        return bytes(data) if data is not None else None
+    return await get_storage(storage).read(digest)
+
+
+async def restore_file(photo) -> bool:
+    """Bring back [photo]'s local file from its storage backend (streamed
+    for S3). False for legacy photos or if it can't be written."""
+    digest = getattr(photo, "content_hash", None)
+    if not digest or not photo.file_path:
+        return False
+    storage = await _storage_of(digest)
+    if storage is None:
+        return False
+    try:
+        return await storage.fetch_to_file(digest, photo.file_path)
+    except OSError:
+        logger.warning("Could not restore photo blob %s to %s", digest[:12], photo.file_path)
+        return False
+
+
+async def redirect_url(photo) -> str | None:
+    """Presigned URL to send clients to instead of proxying [photo]'s bytes
+    (`photo_storage_redirect`, backends that support it)."""
+    digest = getattr(photo, "content_hash", None)
+    if not settings.photo_storage_redirect or not digest:
+        return None
+    storage = await _storage_of(digest)
+    return await storage.presigned_url(digest) if storage else None
+
+
+async def load_legacy_bytes(photo_id: str) -> bytes | None:
+    """`Photo.image_data` of a photo stored before the blob store existed."""
+    async with async_session() as db:
+        data = await db.scalar(select(Photo.image_data).where(Photo.id == photo_id))
+    return bytes(data) if data is not None else None
+
+
+async def fallback_bytes(photo) -> bytes | None:
+    """DB copy of [photo]'s bytes, loaded only when its disk file is gone
+    (see _read_photo_bytes). Returns None while the disk file exists.
+
+    Blob-backed photos read photo_blobs; older ones their own deferred
+    `image_data` column, unless it was already loaded (or set in memory).
+    """
+    if photo.file_path and await run_io(os.path.exists, photo.file_path):
+        return None
+    digest = getattr(photo, "content_hash", None)
+    if digest:
+        return await load_bytes(digest)
+    if "image_data" not in inspect(photo).unloaded:
+        return photo.image_data
+    return await load_legacy_bytes(photo.id)
@@ -4,6 +4,7 @@ import json
 import logging
 
 from app.config import settings
+from app.services.openai_client import get_openai_client
 
 logger = logging.getLogger(__name__)
 
@@ -98,18 +99,14 @@ async def validate_photo(file_path: str, vehicle_type: str, angle_label: str = "
         with open(file_path, "rb") as f:
             b64 = base64.b64encode(f.read()).decode("utf-8")
 
-        from openai import OpenAI
-        kwargs = {"api_key": settings.openai_api_key}
-        if settings.openai_base_url:
-            kwargs["base_url"] = settings.openai_base_url
-        client = OpenAI(**kwargs)
+        client = get_openai_client()
 
         prompt = VALIDATION_PROMPT.format(
             category=category,
             angle=ANGLE_IT.get(angle_label, angle_label or "qualsiasi"),
         )
 
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=settings.openai_model,
             messages=[{
                 "role": "user",
@@ -0,0 +1,119 @@
+"""In-memory registry of the analysis prompts under prompts/.
+
+Every prompt file is read once (at startup, or on first use) and kept with a
+content hash so each AnalysisResult can record which prompt version produced
+it. With `prompt_hot_reload` enabled, a background task polls file mtimes
+and swaps in a fresh snapshot when anything under prompts/ changes.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+PROMPTS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+    "prompts",
+)
+
+# Map vehicle type -> subdirectory under prompts/ holding per-angle files.
+PROMPT_SUBDIR_BY_VEHICLE_TYPE = {
+    "piaggio": "scooter",
+    "ligier": "scooter",
+    "my_moover": "scooter",
+    "scudo": "scudo",
+}
+
+# Legacy generic prompts used as fallback if a per-angle file is missing.
+FALLBACK_PROMPT_BY_VEHICLE_TYPE = {
+    "scudo": "damage_analysis_scudo.txt",
+}
+DEFAULT_FALLBACK_PROMPT_FILE = "damage_analysis.txt"
+
+
+@dataclass(frozen=True)
+class Prompt:
+    text: str
+    version: str  # sha256 of the text, truncated
+    source: str  # path relative to prompts/
+
+
+class PromptRegistry:
+    def __init__(self, prompts_dir: str = PROMPTS_DIR):
+        self.prompts_dir = prompts_dir
+        self._files: dict[str, Prompt] = {}
+        self._mtimes: dict[str, float] = {}
+        self._resolved: dict[tuple[str, str], Prompt] = {}
+        self._loaded = False
+
+    def _scan_mtimes(self) -> dict[str, float]:
+        mtimes: dict[str, float] = {}
+        for root, _dirs, names in os.walk(self.prompts_dir):
+            for name in names:
+                if name.endswith(".txt"):
+                    path = os.path.join(root, name)
+                    mtimes[os.path.relpath(path, self.prompts_dir)] = os.path.getmtime(path)
+        return mtimes
+
+    def load(self) -> None:
+        """(Re)read every prompt file and reset the resolution cache."""
+        mtimes = self._scan_mtimes()
+        files: dict[str, Prompt] = {}
+        for rel in mtimes:
+            with open(os.path.join(self.prompts_dir, rel), encoding="utf-8") as f:
+                text = f.read()
+            version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+            files[rel.replace(os.sep, "/")] = Prompt(text=text, version=version, source=rel)
+        # Swap whole snapshots so concurrent readers never see a half-loaded registry.
+        self._files, self._mtimes, self._resolved = files, mtimes, {}
+        self._loaded = True
+        logger.info("Loaded %d prompts from %s", len(files), self.prompts_dir)
+
+    def reload_if_changed(self) -> bool:
+        if self._scan_mtimes() == self._mtimes:
+            return False
+        logger.info("Prompt files changed on disk — reloading registry")
+        self.load()
+        return True
+
+    def get(self, vehicle_type: str | None = None, angle_label: str | None = None) -> Prompt:
+        """Per-angle prompt for the vehicle type, or the generic fallback."""
+        if not self._loaded:
+            self.load()
+        key = (vehicle_type or "", angle_label or "")
+        prompt = self._resolved.get(key)
+        if prompt is None:
+            prompt = self._resolve(vehicle_type, angle_label)
+            self._resolved[key] = prompt
+        return prompt
+
+    def _resolve(self, vehicle_type: str | None, angle_label: str | None) -> Prompt:
+        subdir = PROMPT_SUBDIR_BY_VEHICLE_TYPE.get(vehicle_type or "")
+        if subdir and angle_label:
+            prompt = self._files.get(f"{subdir}/{angle_label}.txt")
+            if prompt is not None:
+                return prompt
+            logger.warning(
+                "Per-angle prompt missing for vehicle_type=%s angle=%s, falling back to generic",
+                vehicle_type, angle_label,
+            )
+
+        fallback = FALLBACK_PROMPT_BY_VEHICLE_TYPE.get(vehicle_type or "", DEFAULT_FALLBACK_PROMPT_FILE)
+        prompt = self._files.get(fallback)
+        if prompt is None:
+            raise FileNotFoundError(os.path.join(self.prompts_dir, fallback))
+        return prompt
+
+    async def watch(self, interval: float) -> None:
+        """Poll prompt mtimes forever; run as a background task."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.reload_if_changed)
+            except Exception:
+                logger.exception("Prompt hot reload failed — keeping previous prompts")
+
+
+prompt_registry = PromptRegistry()
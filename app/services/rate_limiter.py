@@ -0,0 +1,184 @@
+"""Process-wide limiter for calls to the VLM provider (OpenRouter/OpenAI).
+
+Every per-photo call goes through `provider_limiter.slot()`, which combines:
+  - a semaphore capping in-flight requests,
+  - token buckets for requests-per-minute and tokens-per-minute,
+  - a shared pause set from `Retry-After` when the provider answers 429.
+Callers that can't proceed wait in line instead of hitting the provider, and
+the limiter keeps queue-depth / wait-time counters exposed on /metrics.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at [per_minute] / 60 per second.
+
+    per_minute <= 0 disables the bucket (always has capacity).
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self._updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until [amount] tokens are available (0 if available now)."""
+        if not self.enabled:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        if self.enabled:
+            self._refill()
+            self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        """Give back (delta > 0) or take more (delta < 0) once actual usage is known."""
+        if self.enabled:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + delta)
+
+
+class _Slot:
+    def __init__(self, limiter: "ProviderLimiter", estimated_tokens: int):
+        self._limiter = limiter
+        self.estimated_tokens = estimated_tokens
+
+    def report_usage(self, total_tokens: int | None) -> None:
+        """Reconcile the TPM bucket with the tokens the provider actually billed."""
+        if total_tokens is not None:
+            self._limiter.tokens.adjust(self.estimated_tokens - total_tokens)
+
+
+class ProviderLimiter:
+    def __init__(self, max_concurrency: int, requests_per_minute: int, tokens_per_minute: int):
+        self.max_concurrency = max(max_concurrency, 1)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._lock = asyncio.Lock()
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._paused_until = 0.0
+        # Metrics
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.total_calls = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.rate_limited = 0
+
+    @classmethod
+    def from_settings(cls) -> "ProviderLimiter":
+        return cls(
+            max_concurrency=settings.provider_max_concurrency,
+            requests_per_minute=settings.provider_requests_per_minute,
+            tokens_per_minute=settings.provider_tokens_per_minute,
+        )
+
+    def pause(self, seconds: float) -> None:
+        """Hold every queued call for [seconds] (provider asked us to back off)."""
+        self.rate_limited += 1
+        until = time.monotonic() + seconds
+        if until > self._paused_until:
+            self._paused_until = until
+            logger.warning("Provider rate limited — pausing all calls for %.1fs", seconds)
+
+    async def _wait_for_budget(self, estimated_tokens: int) -> None:
+        while True:
+            async with self._lock:
+                delay = max(
+                    self._paused_until - time.monotonic(),
+                    self.requests.time_until(1),
+                    self.tokens.time_until(estimated_tokens),
+                )
+                if delay <= 0:
+                    self.requests.consume(1)
+                    self.tokens.consume(estimated_tokens)
+                    return
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int | None = None):
+        """Wait for a free slot and enough RPM/TPM budget, then yield a `_Slot`."""
+        if estimated_tokens is None:
+            estimated_tokens = settings.provider_estimated_tokens_per_call
+        queued_at = time.monotonic()
+        self.queue_depth += 1
+        try:
+            await self._semaphore.acquire()
+            try:
+                await self._wait_for_budget(estimated_tokens)
+            except BaseException:
+                self._semaphore.release()
+                raise
+        finally:
+            self.queue_depth -= 1
+
+        waited = time.monotonic() - queued_at
+        self.total_calls += 1
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        if waited > 1.0:
+            logger.info("Provider call waited %.1fs in limiter queue (depth=%d)", waited, self.queue_depth)
+
+        self.in_flight += 1
+        try:
+            yield _Slot(self, estimated_tokens)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "total_calls": self.total_calls,
+            "avg_wait_seconds": round(self.total_wait_seconds / self.total_calls, 3) if self.total_calls else 0.0,
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+            "rate_limited": self.rate_limited,
+            "paused_for_seconds": round(max(self._paused_until - time.monotonic(), 0.0), 3),
+        }
+
+
+def retry_after_seconds(exc: Exception, attempt: int) -> float:
+    """Read `Retry-After` (seconds or HTTP date) / `retry-after-ms` from a provider
+    error; fall back to exponential backoff when the header is absent."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return max(float(value), 0.0)
+            except ValueError:
+                return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        pass
+    return min(2.0 ** attempt, 30.0)
+
+
+provider_limiter = ProviderLimiter.from_settings()
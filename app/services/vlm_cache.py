@@ -0,0 +1,103 @@
+"""Persistent cache of raw VLM responses, content-addressed by request inputs.
+
+The key covers everything that determines the model's answer: the image
+(the stored blob's hash plus the resize/encode parameters, or the payload
+itself for photos without a hash), the prompt text, the model id and the
+request parameters. Blob-backed photos are therefore looked up before the
+image is decoded and re-encoded. Re-running
+an analysis on unchanged photos (e.g. `/reanalyze` without new files) is then
+served from the DB instead of the provider. Entries expire after a TTL and the
+table is trimmed to the least recently used `vlm_cache_max_entries`.
+"""
+import hashlib
+import json
+import logging
+import time
+
+from sqlalchemy import delete, select
+
+from app.config import settings
+from app.database import async_session
+from app.models.vlm_cache import VlmResponseCache
+
+logger = logging.getLogger(__name__)
+
+# Bump when the key layout changes so old entries stop matching.
+_KEY_VERSION = 2
+
+
+def _sha256(data: str | bytes) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_key(image_payload: str | bytes, prompt_text: str, model: str, api_kwargs: dict) -> str:
+    """Build the cache key for one per-photo request.
+
+    [image_payload] identifies the image sent: its encoded payload, or any
+    string that determines it (see ai_service._image_cache_key).
+
+    [api_kwargs] are the chat-completion kwargs; `messages` is excluded since
+    its content is already represented by the image and prompt hashes.
+    """
+    params = {k: v for k, v in api_kwargs.items() if k != "messages"}
+    material = json.dumps(
+        {
+            "v": _KEY_VERSION,
+            "image": _sha256(image_payload),
+            "prompt": _sha256(prompt_text),
+            "model": model,
+            "params": params,
+        },
+        sort_keys=True,
+    )
+    return _sha256(material)
+
+
+async def get_cached_response(key: str) -> str | None:
+    """Return the cached raw response for [key], or None if missing/expired."""
+    now = time.time()
+    async with async_session() as db:
+        entry = await db.get(VlmResponseCache, key)
+        if entry is None:
+            return None
+        if now - entry.created_at > settings.vlm_cache_ttl_seconds:
+            await db.delete(entry)
+            await db.commit()
+            return None
+        entry.last_used_at = now
+        entry.hits = (entry.hits or 0) + 1
+        response = entry.response
+        await db.commit()
+    return response
+
+
+async def store_response(key: str, model: str, response: str) -> None:
+    """Insert/replace a cache entry, then evict expired and least recently used rows."""
+    now = time.time()
+    async with async_session() as db:
+        await db.merge(VlmResponseCache(
+            key=key,
+            model=model,
+            response=response,
+            created_at=now,
+            last_used_at=now,
+            hits=0,
+        ))
+        await db.execute(
+            delete(VlmResponseCache).where(
+                VlmResponseCache.created_at < now - settings.vlm_cache_ttl_seconds
+            )
+        )
+        keep = (
+            select(VlmResponseCache.key)
+            .order_by(VlmResponseCache.last_used_at.desc())
+            .limit(settings.vlm_cache_max_entries)
+        )
+        evicted = await db.execute(
+            delete(VlmResponseCache).where(VlmResponseCache.key.not_in(keep))
+        )
+        await db.commit()
+    if evicted.rowcount:
+        logger.info("VLM cache evicted %d least recently used entries", evicted.rowcount)
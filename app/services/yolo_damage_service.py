@@ -4,12 +4,25 @@ Models:
   - vineetsarpal/yolov11n-car-damage (HuggingFace, 14 classes component+damage)
   - shawnmichael/yolo-car-damage-detection (HuggingFace, 6 generic damage classes)
 
-Outputs damages in the project schema: damage_type, severity, zone, description, bounding_box.
+Backends (`yolo_backend`): "torch" runs the ultralytics checkpoints; "onnx"
+runs ONNX exports (optionally INT8, see yolo_export.py) with onnxruntime,
+which is much lighter to import and faster on CPU-only hosts.
+
+Outputs damages in the project schema: damage_type, severity, zone, description,
+bounding_box, confidence.
 """
 import logging
 import os
-from pathlib import Path
-from typing import Optional
+import time
+from dataclasses import dataclass
+from io import BytesIO
+from typing import TYPE_CHECKING, Optional
+
+from app.config import settings
+from app.services.yolo_models import fetch_weights, onnx_model_path, verify_file, weights_path
+
+if TYPE_CHECKING:
+    import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -57,30 +70,85 @@ YOLO_M_MAPPING = {
 }
 
 
+def _checked(path: str) -> bool:
+    if verify_file(path) is False:
+        logger.error("Checksum mismatch for %s — refusing to load it", path)
+        return False
+    return True
+
+
+def _resolve_weights(key: str) -> str | None:
+    """Local checkpoint for model [key], downloading it unless `yolo_offline`."""
+    path = weights_path(key)
+    if not os.path.exists(path):
+        if settings.yolo_offline:
+            logger.error(
+                "YOLO weights missing at %s and yolo_offline is set "
+                "(run `python -m app.services.yolo_models fetch`)", path,
+            )
+            return None
+        path = fetch_weights(key)
+    return path if _checked(path) else None
+
+
+def _load_onnx_models():
+    global _MODEL_N, _MODEL_M
+    try:
+        from app.services.yolo_onnx import OnnxYoloModel
+        import onnxruntime  # noqa: F401
+    except Exception as e:
+        logger.warning("onnxruntime/numpy not available: %s — YOLO disabled", e)
+        return
+
+    for key in ("n", "m"):
+        if (_MODEL_N if key == "n" else _MODEL_M) is not None:
+            continue
+        path = onnx_model_path(key, settings.yolo_onnx_int8)
+        if not os.path.exists(path):
+            logger.error("ONNX model missing: %s (run `python -m app.services.yolo_export`)", path)
+            continue
+        if not _checked(path):
+            continue
+        try:
+            model = OnnxYoloModel(path, threads=settings.yolo_onnx_threads)
+        except Exception as e:
+            logger.warning("Failed to load ONNX model %s: %s", path, e)
+            continue
+        if key == "n":
+            _MODEL_N = model
+        else:
+            _MODEL_M = model
+        logger.info("Loaded ONNX damage model from %s", path)
+
+
 def _load_models():
     global _MODEL_N, _MODEL_M
     if _MODEL_N is not None and _MODEL_M is not None:
         return
+    if settings.yolo_backend == "onnx":
+        _load_onnx_models()
+        return
     try:
         from ultralytics import YOLO
-        from huggingface_hub import hf_hub_download
     except Exception as e:
-        logger.warning("ultralytics/huggingface_hub not available: %s — YOLO disabled", e)
+        logger.warning("ultralytics not available: %s — YOLO disabled", e)
         return
 
     if _MODEL_N is None:
         try:
-            path = hf_hub_download(repo_id="vineetsarpal/yolov11n-car-damage", filename="best.pt")
-            _MODEL_N = YOLO(path)
-            logger.info("Loaded YOLOv11n damage model from %s", path)
+            path = _resolve_weights("n")
+            if path:
+                _MODEL_N = YOLO(path)
+                logger.info("Loaded YOLOv11n damage model from %s", path)
         except Exception as e:
             logger.warning("Failed to load YOLOv11n: %s", e)
 
     if _MODEL_M is None:
         try:
-            path = hf_hub_download(repo_id="shawnmichael/yolo-car-damage-detection", filename="best_dts.pt")
-            _MODEL_M = YOLO(path)
-            logger.info("Loaded generic YOLO damage model from %s", path)
+            path = _resolve_weights("m")
+            if path:
+                _MODEL_M = YOLO(path)
+                logger.info("Loaded generic YOLO damage model from %s", path)
         except Exception as e:
             logger.warning("Failed to load shawnmichael YOLO: %s", e)
 
@@ -90,107 +158,267 @@ def yolo_available() -> bool:
     return _MODEL_N is not None or _MODEL_M is not None
 
 
-def _det_signature(damage_type: str, zone: str) -> tuple:
-    """Signature for near-duplicate dedup across YOLO models."""
-    return (damage_type, zone)
+def warm_up() -> bool:
+    """Load the models and run one dummy inference, so the first real photo
+    runs at steady-state latency. Returns whether any model is available."""
+    if not yolo_available():
+        return False
+    import numpy as np
+
+    started = time.perf_counter()
+    detect_batch([(np.zeros((640, 640, 3), dtype=np.uint8), "fronte")])
+    logger.info("YOLO warm-up inference in %.0f ms", (time.perf_counter() - started) * 1000)
+    return True
 
 
-def _upright_path(file_path: str) -> str:
-    """Return path to an upright copy of the image (EXIF-transposed).
-    Browsers honor EXIF for img tags, but YOLO reads raw pixels. Caller must
-    use this so bbox coords match the rendered image.
+def _to_bgr_array(image: "bytes | np.ndarray") -> "np.ndarray":
+    """Decode [image] (JPEG/PNG bytes) into an upright HxWx3 BGR array.
+
+    Browsers honor EXIF for img tags, but YOLO reads raw pixels, so the EXIF
+    transpose is applied here so bbox coords match the rendered image.
+    Arrays are assumed already decoded and upright (BGR, ultralytics' layout).
     """
-    import tempfile
+    import numpy as np
     from PIL import Image, ImageOps
-    try:
-        with Image.open(file_path) as im:
-            ori = im.getexif().get(274)
-            if not ori or ori == 1:
-                return file_path
-            upright = ImageOps.exif_transpose(im).convert("RGB")
-            fd, tmp = tempfile.mkstemp(suffix=".jpg", prefix="yolo_upright_")
-            os.close(fd)
-            upright.save(tmp, format="JPEG", quality=92)
-            return tmp
-    except Exception as e:
-        logger.warning("EXIF transpose failed for %s: %s — using raw", file_path, e)
-        return file_path
 
+    if isinstance(image, np.ndarray):
+        return image
+    with Image.open(BytesIO(image)) as im:
+        upright = ImageOps.exif_transpose(im).convert("RGB")
+    return np.ascontiguousarray(np.asarray(upright)[:, :, ::-1])
+
+
+# YOLO11m per-class thresholds because shattered_glass and broken_lamp trigger
+# on asphalt cracks, shoes, parking lot textures.
+YOLO_M_CLASS_THRESHOLDS = {
+    "dent": 0.45,
+    "scratch": 0.50,
+    "crack": 0.55,
+    "shattered_glass": 0.85,
+    "glass shatter": 0.85,
+    "broken_lamp": 0.55,
+    "lamp broken": 0.55,
+    "flat_tire": 0.60,
+    "tire flat": 0.60,
+    "none": 1.1,  # never trigger (placeholder class)
+}
+
+
+YOLO_N_MIN_CONFIDENCE = 0.30
+
+# Zones in a fixed order so (damage_type, zone) can be encoded as one int label.
+_ZONES = ("frontale", "laterale_destro", "laterale_sinistro", "posteriore", "superiore")
+_ZONE_INDEX = {zone: i for i, zone in enumerate(_ZONES)}
+_DAMAGE_TYPES = sorted(
+    {m[0] for m in YOLO_N_MAPPING.values()} | {m[0] for m in YOLO_M_MAPPING.values()}
+)
+_DAMAGE_TYPE_INDEX = {dtype: i for i, dtype in enumerate(_DAMAGE_TYPES)}
+
+
+@dataclass(frozen=True)
+class _ClassTable:
+    """Lookup arrays over the class ids of every loaded model, concatenated
+    (model k's class c is row offsets[k] + c). Mapping, thresholds and labels
+    for all boxes of a photo are then a few fancy-indexing steps."""
+    offsets: tuple[int, ...]
+    mapped: "np.ndarray"  # bool
+    threshold: "np.ndarray"  # float32
+    damage_type: "np.ndarray"  # int index into _DAMAGE_TYPES
+    zone_hint: "np.ndarray"  # int index into _ZONES, -1 = zone of the photo's angle
+    model_bit: "np.ndarray"  # 1 = YOLOv11n, 2 = generic model
+    severity: list  # str per row (None if unmapped)
+    description: list
+
+
+_class_tables: dict[tuple, _ClassTable] = {}  # model ids -> table
+
+
+def _class_table(models: list[tuple[object, str]]) -> _ClassTable:
+    key = tuple(id(model) for model, _tag in models)
+    table = _class_tables.get(key)
+    if table is not None:
+        return table
+    import numpy as np
+
+    offsets, mapped, threshold, damage_type, zone_hint, model_bit, severity, description = (
+        [], [], [], [], [], [], [], []
+    )
+    for model, tag in models:
+        names: dict[int, str] = dict(model.names)
+        offsets.append(len(mapped))
+        for cls_id in range(max(names, default=-1) + 1):
+            cls_name = names.get(cls_id)
+            if tag == "n":
+                mapping = YOLO_N_MAPPING.get(cls_name)
+                if mapping:
+                    dtype, zhint, sev, desc = mapping
+                    thr = YOLO_N_MIN_CONFIDENCE
+            else:
+                mapping = YOLO_M_MAPPING.get(cls_name)
+                if mapping:
+                    dtype, sev, desc = mapping
+                    zhint = None
+                    thr = YOLO_M_CLASS_THRESHOLDS.get(cls_name, 0.45)
+            mapped.append(bool(mapping))
+            threshold.append(thr if mapping else 1.1)
+            damage_type.append(_DAMAGE_TYPE_INDEX[dtype] if mapping else 0)
+            zone_hint.append(_ZONE_INDEX[zhint] if mapping and zhint else -1)
+            model_bit.append(1 if tag == "n" else 2)
+            severity.append(sev if mapping else None)
+            description.append(desc if mapping else None)
+    table = _ClassTable(
+        offsets=tuple(offsets),
+        mapped=np.asarray(mapped, dtype=bool),
+        threshold=np.asarray(threshold, dtype=np.float32),
+        damage_type=np.asarray(damage_type, dtype=np.int64),
+        zone_hint=np.asarray(zone_hint, dtype=np.int64),
+        model_bit=np.asarray(model_bit, dtype=np.int64),
+        severity=severity,
+        description=description,
+    )
+    _class_tables[key] = table
+    return table
+
+
+def _as_numpy(values) -> "np.ndarray":
+    import numpy as np
+
+    if hasattr(values, "cpu"):  # torch tensor (ultralytics backend)
+        values = values.cpu().numpy()
+    return np.asarray(values)
+
+
+def _pairwise_iou(boxes: "np.ndarray") -> "np.ndarray":
+    import numpy as np
+
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    inter = (
+        (np.minimum.outer(x2, x2) - np.maximum.outer(x1, x1)).clip(min=0)
+        * (np.minimum.outer(y2, y2) - np.maximum.outer(y1, y1)).clip(min=0)
+    )
+    return inter / (np.add.outer(areas, areas) - inter + 1e-9)
+
+
+def _fuse_photo(
+    table: _ClassTable, xyxy: "np.ndarray", conf: "np.ndarray", cls: "np.ndarray", zone: str,
+) -> list[dict]:
+    """Map, threshold and fuse one photo's detections from every model.
+
+    [cls] holds table rows (class id + model offset). Boxes with the same
+    (damage_type, zone) overlapping by >= `yolo_wbf_iou` are merged by
+    weighted box fusion: coordinates are averaged weighted by confidence;
+    the fused confidence, severity and description come from the strongest
+    box. Distinct, non-overlapping damages of one type are all kept.
+    """
+    import numpy as np
+
+    keep = table.mapped[cls] & (conf >= table.threshold[cls])
+    if not keep.any():
+        return []
+    xyxy, conf, cls = xyxy[keep], conf[keep], cls[keep]
+    zone_hint = table.zone_hint[cls]
+    labels = table.damage_type[cls] * len(_ZONES) + np.where(zone_hint >= 0, zone_hint, _ZONE_INDEX[zone])
+
+    # Greedy clustering, strongest box first: each unassigned box seeds a
+    # cluster with every unassigned box linked to it (same label, IoU >= thr).
+    # Only the cluster ids are computed in Python; the fusion below is array math.
+    linked = (labels[:, None] == labels) & (_pairwise_iou(xyxy) >= settings.yolo_wbf_iou)
+    neighbours: list[list[int]] = [[] for _ in range(len(conf))]
+    for i, j in zip(*(idx.tolist() for idx in np.nonzero(linked))):
+        neighbours[i].append(j)
+    cluster = [-1] * len(conf)
+    seeds: list[int] = []
+    for seed in np.argsort(-conf, kind="stable").tolist():
+        if cluster[seed] >= 0:
+            continue
+        for j in neighbours[seed]:
+            if cluster[j] < 0:
+                cluster[j] = len(seeds)
+        seeds.append(seed)
+
+    cluster_ids = np.asarray(cluster)
+    weighted = np.zeros((len(seeds), 4))
+    np.add.at(weighted, cluster_ids, conf[:, None] * xyxy)
+    fused = weighted / np.bincount(cluster_ids, weights=conf, minlength=len(seeds))[:, None]
+    model_bits = np.zeros(len(seeds), dtype=np.int64)
+    np.bitwise_or.at(model_bits, cluster_ids, table.model_bit[cls])
 
-def detect_on_photo(file_path: str, angle_label: str) -> list[dict]:
-    """Run both YOLO models on a photo and return merged damages in schema format."""
-    _load_models()
-    zone = ANGLE_TO_ZONE.get(angle_label, "frontale")
     found: list[dict] = []
-    seen: set = set()
-    file_path = _upright_path(file_path)
+    for (x1, y1, x2, y2), seed, row, label, score, bits in zip(
+        np.rint(fused).astype(np.int64).tolist(),
+        seeds,
+        cls[seeds].tolist(),
+        labels[seeds].tolist(),
+        conf[seeds].tolist(),
+        model_bits.tolist(),
+    ):
+        models = {1: "n", 2: "m", 3: "m+n"}[bits]
+        found.append({
+            "damage_type": _DAMAGE_TYPES[label // len(_ZONES)],
+            "severity": table.severity[row],
+            "zone": _ZONES[label % len(_ZONES)],
+            "description": f"{table.description[row]} (YOLO-{models} {score:.0%})",
+            "bounding_box": f"{x1},{y1},{x2},{y2}",
+            "confidence": round(score, 4),
+        })
+    return found
+
+
+def detect_batch(items: list[tuple["bytes | np.ndarray", str]]) -> list[list[dict]]:
+    """Run both YOLO models on a batch of (image, angle_label) photos.
+
+    [image] is raw encoded bytes or a decoded BGR array (see _to_bgr_array);
+    each photo is decoded once, in memory. Each model does a single predict()
+    over the whole batch; returns the fused damages in schema format for each
+    photo, in input order, strongest first. A photo that cannot be decoded
+    gets no damages; the rest of the batch is unaffected.
+    """
+    import numpy as np
 
-    # YOLOv11n pass (component-aware)
-    if _MODEL_N is not None:
+    _load_models()
+    zones = [ANGLE_TO_ZONE.get(angle_label, "frontale") for _image, angle_label in items]
+    models = [(m, tag) for m, tag in ((_MODEL_N, "n"), (_MODEL_M, "m")) if m is not None]
+    if not models:
+        return [[] for _ in items]
+    arrays = []
+    slots = []  # index in [items] of each entry of [arrays]
+    for i, (image, angle_label) in enumerate(items):
         try:
-            res = _MODEL_N.predict(file_path, conf=0.30, verbose=False)[0]
-            for b in res.boxes:
-                cls_name = _MODEL_N.names[int(b.cls[0])]
-                mapping = YOLO_N_MAPPING.get(cls_name)
-                if not mapping:
-                    continue
-                dtype, zhint, sev, desc = mapping
-                final_zone = zhint or zone
-                sig = _det_signature(dtype, final_zone)
-                if sig in seen:
-                    continue
-                seen.add(sig)
-                conf = float(b.conf[0])
-                x1, y1, x2, y2 = [float(v) for v in b.xyxy[0].tolist()]
-                found.append({
-                    "damage_type": dtype,
-                    "severity": sev,
-                    "zone": final_zone,
-                    "description": f"{desc} (YOLO-n {conf:.0%})",
-                    "bounding_box": f"{x1:.0f},{y1:.0f},{x2:.0f},{y2:.0f}",
-                })
+            arrays.append(_to_bgr_array(image))
         except Exception as e:
-            logger.warning("YOLOv11n inference failed on %s: %s", file_path, e)
-
-    # YOLO11m pass (generic damages) — per-class thresholds because shattered_glass
-    # and broken_lamp trigger on asphalt cracks, shoes, parking lot textures.
-    YOLO_M_CLASS_THRESHOLDS = {
-        "dent": 0.45,
-        "scratch": 0.50,
-        "crack": 0.55,
-        "shattered_glass": 0.85,
-        "glass shatter": 0.85,
-        "broken_lamp": 0.55,
-        "lamp broken": 0.55,
-        "flat_tire": 0.60,
-        "tire flat": 0.60,
-        "none": 1.1,  # never trigger (placeholder class)
-    }
-    if _MODEL_M is not None:
+            logger.warning("YOLO skipping undecodable photo angle=%s: %s", angle_label, e)
+            continue
+        slots.append(i)
+    if not arrays:
+        return [[] for _ in items]
+    table = _class_table(models)
+    parts: list[list] = [[] for _ in items]
+
+    for (model, tag), offset in zip(models, table.offsets):
         try:
-            res = _MODEL_M.predict(file_path, conf=0.30, verbose=False)[0]
-            for b in res.boxes:
-                cls_name = _MODEL_M.names[int(b.cls[0])]
-                mapping = YOLO_M_MAPPING.get(cls_name)
-                if not mapping:
-                    continue
-                conf = float(b.conf[0])
-                if conf < YOLO_M_CLASS_THRESHOLDS.get(cls_name, 0.45):
-                    continue
-                dtype, sev, desc = mapping
-                sig = _det_signature(dtype, zone)
-                if sig in seen:
-                    continue
-                seen.add(sig)
-                x1, y1, x2, y2 = [float(v) for v in b.xyxy[0].tolist()]
-                found.append({
-                    "damage_type": dtype,
-                    "severity": sev,
-                    "zone": zone,
-                    "description": f"{desc} (YOLO-m {conf:.0%})",
-                    "bounding_box": f"{x1:.0f},{y1:.0f},{x2:.0f},{y2:.0f}",
-                })
+            results = model.predict(arrays, conf=YOLO_N_MIN_CONFIDENCE, verbose=False)
         except Exception as e:
-            logger.warning("YOLO11m inference failed on %s: %s", file_path, e)
+            logger.warning("YOLO-%s inference failed on batch of %d: %s", tag, len(arrays), e)
+            continue
+        for i, res in zip(slots, results):
+            boxes = res.boxes
+            parts[i].append((
+                _as_numpy(boxes.xyxy).reshape(-1, 4),
+                _as_numpy(boxes.conf).reshape(-1),
+                _as_numpy(boxes.cls).reshape(-1).astype(np.int64) + offset,
+            ))
 
+    found = []
+    for photo_parts, zone in zip(parts, zones):
+        if not photo_parts:
+            found.append([])
+            continue
+        xyxy, conf, cls = (np.concatenate(column) for column in zip(*photo_parts))
+        found.append(_fuse_photo(table, xyxy.astype(np.float64), conf.astype(np.float64), cls, zone))
     return found
+
+
+def detect_on_photo(image: "bytes | np.ndarray", angle_label: str) -> list[dict]:
+    """Run both YOLO models on a photo and return merged damages in schema format."""
+    return detect_batch([(image, angle_label)])[0]
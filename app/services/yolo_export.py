@@ -0,0 +1,61 @@
+"""Export the YOLO damage models to ONNX for the onnxruntime backend.
+
+    python -m app.services.yolo_export [--int8] [--imgsz 640]
+
+Needs ultralytics + huggingface_hub (and onnxruntime for --int8) on the
+machine doing the export only; the serving host just needs onnxruntime.
+Files are written to `yolo_model_dir` under the names the backend expects
+(see `onnx_model_path`) and recorded in the store's checksum manifest. Exports use a dynamic batch axis so a whole
+micro-batch runs in one session call. --int8 additionally writes a
+dynamically quantized copy (INT8 weights), selected with `yolo_onnx_int8`.
+"""
+import argparse
+import logging
+import os
+import shutil
+
+from app.config import settings
+from app.services.yolo_models import MODEL_SOURCES, fetch_weights, onnx_model_path, record_checksum
+
+logger = logging.getLogger(__name__)
+
+
+def export_model(key: str, imgsz: int = 640, int8: bool = False) -> list[str]:
+    """Export model [key] ("n" or "m"); returns the paths written."""
+    from ultralytics import YOLO
+
+    weights = fetch_weights(key)
+    exported = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+
+    os.makedirs(settings.yolo_model_dir, exist_ok=True)
+    fp32_path = onnx_model_path(key)
+    shutil.copyfile(exported, fp32_path)
+    record_checksum(fp32_path)
+    written = [fp32_path]
+    logger.info("Exported %s -> %s", weights, fp32_path)
+
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = onnx_model_path(key, int8=True)
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        record_checksum(int8_path)
+        written.append(int8_path)
+        logger.info("Quantized %s -> %s", fp32_path, int8_path)
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export the YOLO damage models to ONNX")
+    parser.add_argument("--int8", action="store_true", help="also write INT8-quantized models")
+    parser.add_argument("--imgsz", type=int, default=640)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    for key in MODEL_SOURCES:
+        for path in export_model(key, imgsz=args.imgsz, int8=args.int8):
+            print(f"{path}  {os.path.getsize(path) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Local store for the YOLO model files, with a checksum manifest.
+
+All weights live under `yolo_model_dir`:
+
+    <yolo_model_dir>/<name>/<weights file>      ultralytics checkpoints
+    <yolo_model_dir>/<name>[.int8].onnx         ONNX exports (yolo_export.py)
+    <yolo_model_dir>/manifest.json              {relative path: sha256}
+
+Downloaded weights are checked against the revision and sha256 pinned in
+MODEL_SOURCES. A model without a pin is trusted on first use: its download is
+recorded in the manifest (with a warning) and checked against that from then
+on. `pin` prints the Hub's current revision and LFS sha256 of each model, to
+review and copy into MODEL_SOURCES.
+
+Pre-fetch and verify on a machine with network access, then ship the
+directory (or run with `yolo_offline` on a host without it):
+
+    python -m app.services.yolo_models pin
+    python -m app.services.yolo_models fetch
+    python -m app.services.yolo_models verify
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+from typing import NamedTuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ModelSource(NamedTuple):
+    repo_id: str  # HuggingFace repo
+    filename: str  # weights file in the repo
+    name: str  # local directory / ONNX file name
+    revision: str | None  # Hub commit the weights are pinned to
+    sha256: str | None  # expected checksum of the weights file
+
+
+# model key -> source. Fill revision/sha256 from `python -m app.services.yolo_models pin`.
+MODEL_SOURCES = {
+    "n": ModelSource("vineetsarpal/yolov11n-car-damage", "best.pt", "yolov11n-car-damage", None, None),
+    "m": ModelSource(
+        "shawnmichael/yolo-car-damage-detection", "best_dts.pt", "yolo-car-damage-detection", None, None,
+    ),
+}
+
+MANIFEST_FILE = "manifest.json"
+
+
+def weights_path(key: str) -> str:
+    source = MODEL_SOURCES[key]
+    return os.path.join(settings.yolo_model_dir, source.name, source.filename)
+
+
+def onnx_model_path(key: str, int8: bool = False) -> str:
+    """Where `yolo_export` writes (and the onnx backend reads) model [key]."""
+    suffix = ".int8.onnx" if int8 else ".onnx"
+    return os.path.join(settings.yolo_model_dir, MODEL_SOURCES[key].name + suffix)
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _relpath(path: str) -> str:
+    return os.path.relpath(path, settings.yolo_model_dir).replace(os.sep, "/")
+
+
+def _manifest_path() -> str:
+    return os.path.join(settings.yolo_model_dir, MANIFEST_FILE)
+
+
+def load_manifest() -> dict[str, str]:
+    try:
+        with open(_manifest_path(), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def record_checksum(path: str) -> str:
+    """Add/refresh [path]'s checksum in the manifest; returns it."""
+    checksum = sha256_file(path)
+    manifest = load_manifest()
+    manifest[_relpath(path)] = checksum
+    os.makedirs(settings.yolo_model_dir, exist_ok=True)
+    with open(_manifest_path(), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return checksum
+
+
+def _pinned_checksums() -> dict[str, str]:
+    """{relative weights path: pinned sha256} for the pinned MODEL_SOURCES."""
+    return {
+        _relpath(weights_path(key)): source.sha256
+        for key, source in MODEL_SOURCES.items() if source.sha256
+    }
+
+
+def verify_file(path: str) -> bool | None:
+    """True/False if [path] matches/doesn't match its pinned checksum (or the
+    manifest, for files without a pin), None if neither lists it."""
+    rel = _relpath(path)
+    expected = _pinned_checksums().get(rel) or load_manifest().get(rel)
+    if expected is None:
+        return None
+    return sha256_file(path) == expected
+
+
+def fetch_weights(key: str) -> str:
+    """Download model [key] at its pinned revision into the store (no-op if
+    already there) and check it; returns its path.
+
+    The check is against the pinned sha256, or for an unpinned model against
+    the manifest; an unpinned model not in the manifest yet is trusted on
+    first use and recorded. Raises RuntimeError if the file doesn't match.
+    """
+    source = MODEL_SOURCES[key]
+    path = weights_path(key)
+    downloaded = not os.path.exists(path)
+    if downloaded:
+        from huggingface_hub import hf_hub_download
+
+        hf_hub_download(
+            repo_id=source.repo_id,
+            filename=source.filename,
+            revision=source.revision,
+            local_dir=os.path.join(settings.yolo_model_dir, source.name),
+        )
+        logger.info("Downloaded %s/%s@%s -> %s", source.repo_id, source.filename, source.revision, path)
+    expected = source.sha256 or (None if downloaded else load_manifest().get(_relpath(path)))
+    if expected is None:
+        checksum = record_checksum(path)
+        logger.warning(
+            "YOLO model %r (%s) has no pinned sha256 in MODEL_SOURCES: trusting %s on first use "
+            "(sha256 %s, now in the manifest). Pin it: `python -m app.services.yolo_models pin`",
+            key, source.repo_id, path, checksum,
+        )
+        return path
+    checksum = sha256_file(path)
+    if checksum != expected:
+        os.remove(path)
+        raise RuntimeError(
+            f"Checksum mismatch for {path}: expected {expected}, got {checksum} — removed it"
+        )
+    record_checksum(path)
+    return path
+
+
+def pin_sources() -> dict[str, tuple[str, str | None]]:
+    """{key: (current Hub revision, LFS sha256 of the weights file)}, to review
+    and copy into MODEL_SOURCES."""
+    from huggingface_hub import HfApi
+
+    api = HfApi()
+    pins = {}
+    for key, source in MODEL_SOURCES.items():
+        info = api.model_info(source.repo_id, files_metadata=True)
+        sibling = next((f for f in info.siblings if f.rfilename == source.filename), None)
+        lfs = getattr(sibling, "lfs", None)
+        pins[key] = (info.sha, getattr(lfs, "sha256", None))
+    return pins
+
+
+def verify_store() -> list[str]:
+    """Check every manifest entry (pinned weights against their pin); returns
+    a list of problems (empty = OK)."""
+    problems = []
+    manifest = load_manifest()
+    if not manifest:
+        return [f"no manifest at {_manifest_path()}"]
+    manifest.update((rel, pin) for rel, pin in _pinned_checksums().items() if rel in manifest)
+    for rel, expected in sorted(manifest.items()):
+        path = os.path.join(settings.yolo_model_dir, rel)
+        if not os.path.exists(path):
+            problems.append(f"{rel}: missing")
+        elif sha256_file(path) != expected:
+            problems.append(f"{rel}: checksum mismatch")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manage the local YOLO model store")
+    parser.add_argument("command", choices=["pin", "fetch", "verify"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "pin":
+        for key, (revision, sha256) in pin_sources().items():
+            print(f"{key}: revision={revision} sha256={sha256}")
+        return
+    if args.command == "fetch":
+        for key in MODEL_SOURCES:
+            path = fetch_weights(key)
+            print(f"{path}  {sha256_file(path)}")
+    problems = verify_store()
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    if problems:
+        sys.exit(1)
+    print(f"{len(load_manifest())} files OK in {settings.yolo_model_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""ONNX Runtime backend for the YOLO damage models (CPU deployments).
+
+`OnnxYoloModel` exposes the small part of the ultralytics `YOLO` API that
+yolo_damage_service uses (`names`, `predict(images, conf=...)` returning
+results with `.boxes`), so detect_on_photo works unchanged on either backend.
+Pre-processing (letterbox to the export size) and post-processing (decode,
+per-class NMS, undo letterbox) are plain NumPy; onnxruntime is imported only
+when a model is actually loaded.
+
+The .onnx files are produced by `python -m app.services.yolo_export`.
+"""
+import ast
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NMS_IOU = 0.45
+MAX_DETECTIONS = 300
+
+
+def letterbox(image_bgr: np.ndarray, size: int) -> tuple[np.ndarray, float, tuple[float, float]]:
+    """Resize keeping aspect ratio and pad to [size]x[size] (ultralytics layout).
+
+    Returns (CHW float32 RGB in [0, 1], scale ratio, (pad_x, pad_y)).
+    """
+    from PIL import Image
+
+    h, w = image_bgr.shape[:2]
+    ratio = min(size / h, size / w)
+    new_w, new_h = round(w * ratio), round(h * ratio)
+    resized = np.asarray(
+        Image.fromarray(image_bgr[:, :, ::-1]).resize((new_w, new_h), Image.Resampling.BILINEAR)
+    )
+    pad_x, pad_y = (size - new_w) / 2, (size - new_h) / 2
+    top, left = round(pad_y - 0.1), round(pad_x - 0.1)
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[top:top + new_h, left:left + new_w] = resized
+    return canvas.transpose(2, 0, 1).astype(np.float32) / 255.0, ratio, (pad_x, pad_y)
+
+
+def _nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Greedy NMS over xyxy [boxes]; returns kept indices, best score first."""
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep: list[int] = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def postprocess(
+    output: np.ndarray,
+    conf: float,
+    ratio: float,
+    pad: tuple[float, float],
+    image_shape: tuple[int, int],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Decode one image's raw YOLOv8/11 head output of shape (4 + classes, anchors).
+
+    Returns (xyxy in original image pixels, scores, class ids).
+    """
+    preds = output.T  # (anchors, 4 + classes)
+    class_scores = preds[:, 4:]
+    cls = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(cls)), cls]
+    mask = scores >= conf
+    preds, cls, scores = preds[mask], cls[mask], scores[mask]
+    if not len(preds):
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int64)
+
+    cx, cy, w, h = preds[:, 0], preds[:, 1], preds[:, 2], preds[:, 3]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+    # Offset boxes per class so one NMS pass never suppresses across classes.
+    offsets = cls[:, None].astype(np.float32) * 4096.0
+    keep = _nms(boxes + offsets, scores, NMS_IOU)[:MAX_DETECTIONS]
+    boxes, scores, cls = boxes[keep], scores[keep], cls[keep]
+
+    boxes[:, [0, 2]] -= pad[0]
+    boxes[:, [1, 3]] -= pad[1]
+    boxes /= ratio
+    img_h, img_w = image_shape
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, img_w)
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, img_h)
+    return boxes, scores, cls
+
+
+@dataclass
+class _Boxes:
+    # Same attributes as ultralytics' Boxes (arrays over all boxes of one image)
+    xyxy: np.ndarray
+    conf: np.ndarray
+    cls: np.ndarray
+
+
+@dataclass
+class _Result:
+    boxes: _Boxes
+
+
+class OnnxYoloModel:
+    def __init__(self, path: str, threads: int = 0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input = self.session.get_inputs()[0]
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.names: dict[int, str] = ast.literal_eval(meta["names"]) if "names" in meta else {}
+        shape = self.input.shape
+        self.imgsz = shape[2] if isinstance(shape[2], int) else int(ast.literal_eval(meta.get("imgsz", "[640]"))[0])
+        self.dynamic_batch = not isinstance(shape[0], int)
+        self.path = path
+
+    def predict(self, images: list[np.ndarray], conf: float = 0.25, **_kwargs) -> list[_Result]:
+        """Run on BGR arrays; returns one ultralytics-like result per image."""
+        prepared = [letterbox(image, self.imgsz) for image in images]
+        batch = np.stack([p[0] for p in prepared])
+        if self.dynamic_batch:
+            outputs = self.session.run(None, {self.input.name: batch})[0]
+        else:
+            outputs = np.concatenate([
+                self.session.run(None, {self.input.name: batch[i:i + 1]})[0] for i in range(len(batch))
+            ])
+
+        results: list[_Result] = []
+        for image, (_tensor, ratio, pad), output in zip(images, prepared, outputs):
+            boxes, scores, cls = postprocess(output, conf, ratio, pad, image.shape[:2])
+            results.append(_Result(boxes=_Boxes(xyxy=boxes, conf=scores, cls=cls)))
+        return results
@@ -0,0 +1,206 @@
+"""Process pool and micro-batching front end for YOLO inference.
+
+YOLO detection is CPU-bound and holds the GIL for hundreds of milliseconds
+per photo, so it runs in worker processes instead of the event loop. Each
+worker loads the models once (pool initializer) and keeps them for its whole
+life. Workers are started with the "spawn" method: forking a process that
+already runs an event loop and torch threads is not safe.
+
+Requests are not sent to the pool one by one. `detect_damages` hands the
+photo to a `YoloBatcher`, which collects photos from every concurrent session
+for up to `yolo_batch_window_ms` (or until `yolo_max_batch_size`), runs each
+model once over the batch in a worker and routes detections back to callers.
+Several batches can be in flight at once, one per pool worker.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_pool: ProcessPoolExecutor | None = None
+_pool_size = 0
+
+
+def _init_worker() -> None:
+    from app.services.yolo_damage_service import warm_up
+
+    if settings.yolo_backend == "torch":
+        # torch defaults to one intra-op thread per core in every worker,
+        # i.e. cores² threads across the pool.
+        try:
+            import torch
+        except ImportError:
+            pass
+        else:
+            torch.set_num_threads(settings.yolo_torch_threads)
+
+    if not warm_up():
+        logger.warning("YOLO worker %d started without any model", os.getpid())
+
+
+def _worker_ready() -> tuple[int, bool]:
+    from app.services.yolo_damage_service import yolo_available
+
+    return os.getpid(), yolo_available()
+
+
+def _detect_batch(items: list[tuple[bytes, str]]) -> list[list[dict]]:
+    from app.services.yolo_damage_service import detect_batch, yolo_available
+
+    if not yolo_available():
+        raise RuntimeError("YOLO models not available (ultralytics/huggingface_hub missing?)")
+    return detect_batch(items)
+
+
+def get_yolo_pool() -> ProcessPoolExecutor:
+    global _pool, _pool_size
+    if _pool is None:
+        workers = _pool_size = settings.yolo_workers or os.cpu_count() or 1
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+        logger.info("Started YOLO process pool with %d workers", workers)
+    return _pool
+
+
+async def _run_in_pool(items: list[tuple[bytes, str]]) -> list[list[dict]]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_yolo_pool(), _detect_batch, items)
+
+
+class YoloBatcher:
+    def __init__(self, run_batch=_run_in_pool):
+        self._run_batch = run_batch
+        self._queue: asyncio.Queue | None = None
+        self._collector: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._in_flight: set[asyncio.Task] = set()
+        self._stats = {
+            "batches": 0,
+            "photos": 0,
+            "max_batch_size": 0,
+            "batch_seconds_total": 0.0,
+            "batch_seconds_max": 0.0,
+            "last_batch_size": 0,
+            "last_batch_seconds": 0.0,
+        }
+
+    def _ensure_started(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._collector is None or self._collector.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._collector = loop.create_task(self._collect())
+        return self._queue
+
+    async def submit(self, image: bytes, angle_label: str) -> list[dict]:
+        """Queue one photo (encoded bytes) for the next batch and wait for its detections."""
+        future = asyncio.get_running_loop().create_future()
+        self._ensure_started().put_nowait(((image, angle_label), future))
+        return await future
+
+    async def _collect(self) -> None:
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            deadline = time.monotonic() + settings.yolo_batch_window_ms / 1000
+            while len(batch) < settings.yolo_max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch: list) -> None:
+        items = [item for item, _future in batch]
+        started = time.perf_counter()
+        try:
+            results = await self._run_batch(items)
+        except Exception as exc:
+            for _item, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        elapsed = time.perf_counter() - started
+        for (_item, future), detections in zip(batch, results):
+            if not future.done():
+                future.set_result(detections)
+
+        stats = self._stats
+        stats["batches"] += 1
+        stats["photos"] += len(batch)
+        stats["max_batch_size"] = max(stats["max_batch_size"], len(batch))
+        stats["batch_seconds_total"] += elapsed
+        stats["batch_seconds_max"] = max(stats["batch_seconds_max"], elapsed)
+        stats["last_batch_size"] = len(batch)
+        stats["last_batch_seconds"] = elapsed
+        logger.info("YOLO batch of %d photos in %.0f ms", len(batch), elapsed * 1000)
+
+    def stats(self) -> dict:
+        batches = self._stats["batches"]
+        return {
+            **self._stats,
+            "avg_batch_size": self._stats["photos"] / batches if batches else 0.0,
+            "avg_batch_seconds": self._stats["batch_seconds_total"] / batches if batches else 0.0,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches_in_flight": len(self._in_flight),
+        }
+
+    def stop(self) -> None:
+        if self._collector is not None:
+            self._collector.cancel()
+            self._collector = None
+        for task in self._in_flight:
+            task.cancel()
+
+
+yolo_batcher = YoloBatcher()
+
+
+async def detect_damages(image: bytes, angle_label: str) -> list[dict]:
+    """Run the YOLO ensemble on one photo's encoded bytes (batched with
+    concurrent requests). Decoding happens in the worker, in memory."""
+    return await yolo_batcher.submit(image, angle_label)
+
+
+async def warm_up_yolo_pool() -> int:
+    """Start every pool worker and wait until each has loaded its models and
+    run its warm-up inference (done in the worker initializer).
+
+    Returns how many workers have models available.
+    """
+    pool = get_yolo_pool()
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    # With no idle worker, each submission spawns a new process, so one
+    # concurrent call per slot brings the whole pool up.
+    statuses = await asyncio.gather(*(
+        loop.run_in_executor(pool, _worker_ready) for _ in range(_pool_size)
+    ))
+    ready = len({pid for pid, available in statuses if available})
+    logger.info(
+        "YOLO pool warm: %d/%d workers ready in %.1f s",
+        ready, _pool_size, time.perf_counter() - started,
+    )
+    return ready
+
+
+def shutdown_yolo_pool() -> None:
+    global _pool
+    yolo_batcher.stop()
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,116 @@
+"""HTTP caching helpers for immutable resources (stored photos).
+
+A stored photo never changes (its bytes are addressed by sha256), so the
+responses carry a strong ETag derived from the content hash, a long
+`immutable` Cache-Control and Last-Modified. Conditional GETs are answered
+with 304 before anything is read from disk or the DB.
+
+Disk files are served with Starlette's FileResponse, which already handles
+Range / If-Range using the headers set here. `bytes_response` gives in-memory
+bodies (the DB-blob fallback) the same single-range support.
+"""
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request
+from fastapi.responses import Response
+
+# "private": photos sit behind the API key, shared caches must not keep them.
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+def cache_headers(tag: str, last_modified: datetime | None = None) -> dict[str, str]:
+    """Headers for an immutable resource identified by [tag] (e.g. a sha256)."""
+    headers = {"etag": f'"{tag}"', "cache-control": IMMUTABLE_CACHE_CONTROL}
+    if last_modified is not None:
+        headers["last-modified"] = http_date(last_modified)
+    return headers
+
+
+def http_date(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def parse_timestamp(value: str | None) -> datetime | None:
+    """ISO 8601 timestamp as stored in the DB (captured_at), or None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def is_not_modified(request: Request, headers: dict[str, str]) -> bool:
+    """True if the client's cached copy (If-None-Match / If-Modified-Since)
+    is still valid for a response with [headers]."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison, as RFC 9110 requires for If-None-Match
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or headers["etag"] in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and "last-modified" in headers:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+            modified = parsedate_to_datetime(headers["last-modified"])
+        except (TypeError, ValueError):
+            return False
+        return modified <= since
+    return False
+
+
+def not_modified_response(headers: dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def _single_range(header: str, size: int) -> tuple[int, int] | None:
+    """Inclusive (start, end) of a single `bytes=` range; None if the header
+    should be ignored (syntax we don't serve partially, e.g. several ranges).
+    Raises ValueError if the range can't be satisfied."""
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash or not (first or last) or any(part and not part.isdigit() for part in (first, last)):
+        return None  # malformed: ignore it and serve the whole body
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start > end and start < size:
+            return None  # invalid (last < first): ignored like a malformed one
+    else:
+        suffix = int(last)  # bytes=-N: the last N bytes
+        start, end = max(size - suffix, 0), size - 1
+        if suffix == 0:
+            raise ValueError("empty suffix range")
+    if start >= size:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def bytes_response(
+    request: Request, data: bytes, media_type: str, headers: dict[str, str],
+) -> Response:
+    """[data] as a 200, or a 206/416 when the request carries a Range that
+    applies (If-Range, when present, must match the ETag or Last-Modified)."""
+    headers = {**headers, "accept-ranges": "bytes"}
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range in (headers["etag"], headers.get("last-modified"))):
+        try:
+            byte_range = _single_range(range_header, len(data))
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{len(data)}"})
+        if byte_range is not None:
+            start, end = byte_range
+            return Response(
+                content=data[start:end + 1],
+                status_code=206,
+                media_type=media_type,
+                headers={**headers, "content-range": f"bytes {start}-{end}/{len(data)}"},
+            )
+    return Response(content=data, media_type=media_type, headers=headers)
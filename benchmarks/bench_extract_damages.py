@@ -0,0 +1,152 @@
+"""Microbenchmark: damage extraction from raw model output.
+
+Compares the single-pass `ai_service._extract_damages` with the previous
+three-stage implementation (regex <think>/fence stripping, json.loads,
+Python balanced-brace scan, regex entry recovery), kept below for reference.
+
+Corpus: benchmarks/data/raw_responses.jsonl holds representative responses
+in the prompt's output format (clean, fenced, <think>-prefixed, truncated,
+prose-wrapped, unparseable). `--db` benchmarks the `raw_response` column of
+the configured database instead, split per photo on the `=== angle ===`
+headers written by `_call_openai`.
+
+    python -m benchmarks.bench_extract_damages [--db] [--repeat 2000]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import statistics
+import time
+
+from app.services.ai_service import _extract_damages
+
+CORPUS = os.path.join(os.path.dirname(__file__), "data", "raw_responses.jsonl")
+
+
+def _legacy_extract(raw_text: str) -> list:
+    json_text = re.sub(r"<think>.*?</think>", "", raw_text, flags=re.DOTALL).strip()
+    if json_text.startswith("```"):
+        lines = [l for l in json_text.split("\n") if not l.strip().startswith("```")]
+        json_text = "\n".join(lines).strip()
+    text = json_text
+
+    try:
+        parsed = json.loads(text)
+        return parsed.get("damages", parsed.get("danni", []))
+    except json.JSONDecodeError:
+        pass
+
+    start = text.find("{")
+    if start >= 0:
+        depth = 0
+        in_str = False
+        esc = False
+        for i in range(start, len(text)):
+            ch = text[i]
+            if in_str:
+                if esc:
+                    esc = False
+                elif ch == "\\":
+                    esc = True
+                elif ch == '"':
+                    in_str = False
+            else:
+                if ch == '"':
+                    in_str = True
+                elif ch == "{":
+                    depth += 1
+                elif ch == "}":
+                    depth -= 1
+                    if depth == 0:
+                        try:
+                            parsed = json.loads(text[start:i + 1])
+                            return parsed.get("damages", parsed.get("danni", []))
+                        except json.JSONDecodeError:
+                            break
+
+    damages = []
+    for m in re.finditer(r"\{[^{}]*\}", text):
+        try:
+            entry = json.loads(m.group(0))
+            if isinstance(entry, dict) and "damage_type" in entry:
+                damages.append(entry)
+        except json.JSONDecodeError:
+            continue
+    if damages:
+        return damages
+    raise ValueError("unparseable")
+
+
+def _load_corpus() -> list[dict]:
+    with open(CORPUS, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def _load_db_samples() -> list[dict]:
+    from sqlalchemy import select
+
+    from app.database import async_session
+    from app.models.analysis import AnalysisResult
+
+    async with async_session() as db:
+        rows = (await db.execute(
+            select(AnalysisResult.raw_response).where(AnalysisResult.raw_response.is_not(None))
+        )).scalars().all()
+    samples = []
+    for raw in rows:
+        for part in re.split(r"^=== \w+ ===\n", raw, flags=re.MULTILINE):
+            part = part.strip()
+            if part and not part.startswith(("[ERROR]", "[EMPTY_RESPONSE]")):
+                samples.append({"kind": "db", "raw_response": part})
+    return samples
+
+
+def _run(fn, text: str) -> list | None:
+    try:
+        return fn(text)
+    except ValueError:
+        return None
+
+
+def _time_per_call(fn, text: str, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        _run(fn, text)
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", action="store_true", help="use raw_response rows from the database")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    logging.getLogger("app").setLevel(logging.ERROR)  # silence per-call recovery warnings
+
+    samples = asyncio.run(_load_db_samples()) if args.db else _load_corpus()
+    if not samples:
+        raise SystemExit("No samples found")
+
+    by_kind: dict[str, list[tuple[float, float]]] = {}
+    disagreements = 0
+    for sample in samples:
+        text = sample["raw_response"]
+        if _run(_extract_damages, text) != _run(_legacy_extract, text):
+            disagreements += 1
+        by_kind.setdefault(sample["kind"], []).append((
+            _time_per_call(_legacy_extract, text, args.repeat),
+            _time_per_call(_extract_damages, text, args.repeat),
+        ))
+
+    print(f"{'kind':<12} {'n':>3} {'legacy us':>10} {'single-pass us':>15} {'speedup':>8}")
+    for kind, timings in sorted(by_kind.items()):
+        legacy = statistics.mean(t[0] for t in timings)
+        new = statistics.mean(t[1] for t in timings)
+        print(f"{kind:<12} {len(timings):>3} {legacy:>10.1f} {new:>15.1f} {legacy / new:>7.2f}x")
+    print(f"samples with different output: {disagreements}/{len(samples)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark: photo metadata queries with and without the bytes in the row.
+
+Builds a throwaway SQLite DB of sessions with 4 photos each, every photo
+carrying a legacy `image_data` blob, then runs the per-session query that
+/complete, /details and analyze_session do (`select(Photo)` by session) over
+the whole list. Compares the deferred mapping against the old behaviour
+(`undefer(Photo.image_data)`) by latency and Python peak memory (tracemalloc).
+
+    python -m benchmarks.bench_photo_queries [--sessions 25] [--photo-kb 1500] [--repeat 3]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import undefer
+
+from app.database import Base
+from app.models import Photo
+
+
+async def _populate(maker, sessions: int, photo_bytes: int) -> list[str]:
+    blob = os.urandom(photo_bytes)
+    session_ids = [f"bench-{i}" for i in range(sessions)]
+    async with maker() as db:
+        for session_id in session_ids:
+            for angle in range(4):
+                db.add(Photo(
+                    id=f"{session_id}-{angle}",
+                    session_id=session_id,
+                    angle_index=angle,
+                    angle_label=f"angle_{angle}",
+                    file_path=f"/missing/{session_id}-{angle}.jpg",
+                    image_data=blob,
+                    captured_at="2026-01-01T00:00:00Z",
+                    is_valid=1,
+                    upload_status="uploaded",
+                ))
+        await db.commit()
+    return session_ids
+
+
+async def _list_sessions(maker, session_ids: list[str], options: list) -> int:
+    valid = 0
+    async with maker() as db:
+        for session_id in session_ids:
+            photos = (await db.execute(
+                select(Photo).where(Photo.session_id == session_id).options(*options)
+            )).scalars().all()
+            valid += sum(1 for p in photos if p.is_valid)
+    return valid
+
+
+async def _measure(maker, session_ids: list[str], options: list, repeat: int) -> dict:
+    await _list_sessions(maker, session_ids, options)  # warm the SQLite page cache
+    latencies = []
+    peaks = []
+    for _ in range(repeat):
+        tracemalloc.start()
+        started = time.perf_counter()
+        await _list_sessions(maker, session_ids, options)
+        latencies.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {"seconds": statistics.median(latencies), "peak_mb": max(peaks) / 1e6}
+
+
+async def _main(sessions: int, photo_kb: int, repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.sqlite3')}")
+        async with engine.begin() as conn:
+            # Photo has a FK to sessions; SQLite does not enforce it here.
+            await conn.run_sync(Base.metadata.create_all)
+        maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        session_ids = await _populate(maker, sessions, photo_kb * 1024)
+
+        print(f"{sessions} sessions x 4 photos x {photo_kb} KB, median of {repeat}")
+        print(f"{'mapping':<24}{'latency ms':>12}{'peak MB':>10}")
+        for name, options in (("image_data loaded", [undefer(Photo.image_data)]), ("deferred (current)", [])):
+            result = await _measure(maker, session_ids, options, repeat)
+            print(f"{name:<24}{result['seconds'] * 1000:>12.1f}{result['peak_mb']:>10.2f}")
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=25)
+    parser.add_argument("--photo-kb", type=int, default=1500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(_main(args.sessions, args.photo_kb, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Benchmark: YOLO backends (PyTorch vs ONNX Runtime fp32 vs ONNX INT8).
+
+Each backend runs in its own fresh process so import time and memory are
+measured in isolation. Reports load time, per-photo latency (mean / p95),
+peak RSS, and detection agreement with the PyTorch path (same damage_type,
+zone and box IoU >= 0.5).
+
+    python -m app.services.yolo_export --int8        # once, to create the .onnx files
+    python -m benchmarks.bench_yolo_backends [--images 'data/sessions/*/*.jpg'] [--repeat 5]
+"""
+import argparse
+import glob
+import multiprocessing
+import resource
+import statistics
+import time
+
+BACKENDS = {
+    "torch": {"yolo_backend": "torch"},
+    "onnx": {"yolo_backend": "onnx", "yolo_onnx_int8": False},
+    "onnx-int8": {"yolo_backend": "onnx", "yolo_onnx_int8": True},
+}
+
+
+def _run_backend(overrides: dict, paths: list[str], repeat: int) -> dict:
+    from app.config import settings
+
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+
+    started = time.perf_counter()
+    from app.services import yolo_damage_service
+
+    available = yolo_damage_service.yolo_available()
+    load_seconds = time.perf_counter() - started
+    if not available:
+        return {"error": "models not available"}
+
+    detections = [yolo_damage_service.detect_on_photo(image, "fronte") for image in images]  # warm-up
+    latencies = []
+    for _ in range(repeat):
+        for image in images:
+            t0 = time.perf_counter()
+            yolo_damage_service.detect_on_photo(image, "fronte")
+            latencies.append(time.perf_counter() - t0)
+    return {
+        "load_seconds": load_seconds,
+        "latencies": latencies,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "detections": detections,
+    }
+
+
+def _box(damage: dict) -> tuple[float, ...]:
+    return tuple(float(v) for v in damage["bounding_box"].split(","))
+
+
+def _iou(a: tuple[float, ...], b: tuple[float, ...]) -> float:
+    iw = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    ih = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = iw * ih
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _agreement(reference: list[list[dict]], candidate: list[list[dict]]) -> tuple[float, float]:
+    """(precision, recall) of [candidate] detections against [reference]."""
+    matched = total_ref = total_cand = 0
+    for ref, cand in zip(reference, candidate):
+        total_ref += len(ref)
+        total_cand += len(cand)
+        unused = list(ref)
+        for d in cand:
+            for r in unused:
+                if (r["damage_type"], r["zone"]) == (d["damage_type"], d["zone"]) and _iou(_box(r), _box(d)) >= 0.5:
+                    unused.remove(r)
+                    matched += 1
+                    break
+    precision = matched / total_cand if total_cand else 1.0
+    recall = matched / total_ref if total_ref else 1.0
+    return precision, recall
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", default="data/sessions/*/*.jpg", help="glob of photos to run on")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(args.images))
+    if not paths:
+        raise SystemExit(f"No images match {args.images}")
+
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for name in args.backends.split(","):
+        with ctx.Pool(1) as pool:
+            results[name] = pool.apply(_run_backend, (BACKENDS[name], paths, args.repeat))
+
+    reference = results.get("torch", {}).get("detections")
+    print(f"{len(paths)} photos x {args.repeat} runs")
+    print(f"{'backend':<10} {'load s':>7} {'mean ms':>8} {'p95 ms':>7} {'peak MB':>8} {'prec':>5} {'recall':>6}")
+    for name, res in results.items():
+        if "error" in res:
+            print(f"{name:<10} {res['error']}")
+            continue
+        lat = sorted(res["latencies"])
+        p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+        precision, recall = _agreement(reference, res["detections"]) if reference else (float("nan"),) * 2
+        print(
+            f"{name:<10} {res['load_seconds']:>7.2f} {statistics.mean(lat) * 1000:>8.1f} "
+            f"{p95 * 1000:>7.1f} {res['peak_rss_mb']:>8.0f} {precision:>5.2f} {recall:>6.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import io
 import os
 import tempfile
 from pathlib import Path
@@ -10,7 +11,7 @@ os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_TEST_DB_PATH}"
 
 
 @pytest.fixture(autouse=True, scope="session")
-def setup_test_db():
+def setup_test_db(tmp_path_factory):
     import asyncio
 
     # Disable API key auth for tests
@@ -18,6 +19,10 @@ def setup_test_db():
 
     settings.api_key = ""
     settings.openai_api_key = ""
+    settings.vlm_cache_enabled = False
+    # Blobs, staging files, renditions and models go to a temp dir, never ./data
+    settings.data_dir = str(tmp_path_factory.mktemp("data"))
+    settings.yolo_model_dir = os.path.join(settings.data_dir, "models")
 
     from app.database import Base, async_session, create_tables, engine
     from app.seed import seed_data
@@ -38,3 +43,33 @@ def setup_test_db():
 
     asyncio.run(_teardown())
     _TEST_DB_PATH.unlink(missing_ok=True)
+
+
+@pytest.fixture
+def make_jpeg():
+    """Factory for test JPEGs: make_jpeg(width, height, orientation=None).
+
+    Noise content, so they don't compress to nothing like a flat image would.
+    """
+    Image = pytest.importorskip("PIL.Image")
+
+    def _make(width: int, height: int, orientation: int | None = None) -> bytes:
+        im = Image.effect_noise((width, height), 60).convert("RGB")
+        exif = Image.Exif()
+        if orientation is not None:
+            exif[0x0112] = orientation
+        buf = io.BytesIO()
+        im.save(buf, format="JPEG", quality=95, exif=exif.tobytes())
+        return buf.getvalue()
+
+    return _make
+
+
+@pytest.fixture
+def data_dir(monkeypatch, tmp_path):
+    """Photo storage under [tmp_path], with no upload size limit."""
+    from app.config import settings
+
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "max_photo_size_bytes", 0)
+    return tmp_path
@@ -1,3 +1,4 @@
+import asyncio
 import io
 import os
 import tempfile
@@ -114,7 +115,7 @@ async def test_call_openai_issues_one_request_per_photo(monkeypatch):
         call_log: list[str] = []
 
         class FakeCompletions:
-            def create(self, **kwargs):
+            async def create(self, **kwargs):
                 # Inspect the messages to figure out which angle was sent.
                 content = kwargs["messages"][0]["content"]
                 prompt_text = content[0]["text"]
@@ -139,7 +140,7 @@ async def test_call_openai_issues_one_request_per_photo(monkeypatch):
             def __init__(self, **_kwargs):
                 self.chat = FakeChat()
 
-        with patch("openai.OpenAI", FakeClient):
+        with patch.object(ai_service, "get_openai_client", FakeClient):
             damages, raw = await _call_openai(photos, vehicle_type="piaggio")
 
         assert sorted(call_log) == ["fronte", "lato_destro", "lato_sinistro", "retro"]
@@ -164,7 +165,7 @@ async def test_call_openai_survives_single_photo_failure(monkeypatch):
         ]
 
         class FakeCompletions:
-            def create(self, **kwargs):
+            async def create(self, **kwargs):
                 prompt_text = kwargs["messages"][0]["content"][0]["text"]
                 if 'zone": "frontale"' in prompt_text:
                     raise RuntimeError("boom-fronte")
@@ -179,7 +180,7 @@ async def test_call_openai_survives_single_photo_failure(monkeypatch):
             def __init__(self, **_kwargs):
                 self.chat = FakeChat()
 
-        with patch("openai.OpenAI", FakeClient):
+        with patch.object(ai_service, "get_openai_client", FakeClient):
             damages, raw = await _call_openai(photos, vehicle_type="scudo")
 
         assert len(damages) == 1
@@ -213,3 +214,300 @@ async def test_analyze_session_no_photos():
         assert analysis is not None
         assert analysis.status == "completed"
         assert '"damages": []' in analysis.raw_response
+
+
+@pytest.mark.asyncio
+async def test_openai_client_is_shared_across_calls(monkeypatch):
+    """The AsyncOpenAI client (and its connection pool) is created once per process."""
+    from app.services import openai_client
+
+    monkeypatch.setattr(openai_client.settings, "openai_api_key", "sk-test")
+    await openai_client.close_openai_client()
+
+    first = openai_client.get_openai_client()
+    second = openai_client.get_openai_client()
+    assert first is second
+    await openai_client.close_openai_client()
+    assert openai_client.get_openai_client() is not first
+    await openai_client.close_openai_client()
+
+
+@pytest.mark.asyncio
+async def test_pipelined_upload_reuses_upload_time_calls(monkeypatch):
+    """With analysis_pipeline_on_upload, each photo is analysed once, at upload time."""
+    monkeypatch.setattr(ai_service.settings, "openai_api_key", "sk-test")
+    monkeypatch.setattr(ai_service.settings, "openai_model", "gpt-4o-mini")
+    monkeypatch.setattr(ai_service.settings, "analysis_pipeline_on_upload", True)
+
+    call_count = 0
+
+    class FakeCompletions:
+        async def create(self, **kwargs):
+            nonlocal call_count
+            call_count += 1
+            return _fake_openai_response(
+                '{"damages": [{"damage_type": "graffio", "severity": "lieve", "zone": "frontale"}]}'
+            )
+
+    class FakeClient:
+        chat = SimpleNamespace(completions=FakeCompletions())
+
+    monkeypatch.setattr(ai_service, "get_openai_client", FakeClient)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_session_with_photos(client, ["fronte", "retro"])
+
+    async with async_session() as db:
+        photos = (await db.execute(select(Photo).where(Photo.session_id == session_id))).scalars().all()
+    assert all(p.id in ai_service._prefetched for p in photos)
+
+    await analyze_session(session_id)
+
+    assert call_count == 2
+    assert not any(p.id in ai_service._prefetched for p in photos)
+    async with async_session() as db:
+        analysis = (await db.execute(
+            select(AnalysisResult).where(AnalysisResult.session_id == session_id)
+        )).scalars().first()
+        assert analysis.status == "completed"
+        damages = (await db.execute(
+            select(Damage).where(Damage.analysis_id == analysis.id)
+        )).scalars().all()
+        assert len(damages) == 2
+
+
+@pytest.mark.asyncio
+async def test_upload_time_calls_capped_per_user_and_expire(monkeypatch):
+    """Unclaimed upload-time calls are uncharged: capped per user, and dropped on
+    their own TTL or when the session goes away, with no further uploads."""
+    monkeypatch.setattr(ai_service.settings, "openai_api_key", "sk-test")
+    monkeypatch.setattr(ai_service.settings, "analysis_pipeline_on_upload", True)
+    monkeypatch.setattr(ai_service.settings, "analysis_pipeline_max_per_user", 1)
+    monkeypatch.setattr(ai_service.settings, "analysis_pipeline_ttl_seconds", 0.2)
+    monkeypatch.setattr(ai_service, "_prefetched", {})
+    never = asyncio.Event()
+
+    class FakeCompletions:
+        async def create(self, **kwargs):
+            await never.wait()
+
+    class FakeClient:
+        chat = SimpleNamespace(completions=FakeCompletions())
+
+    monkeypatch.setattr(ai_service, "get_openai_client", FakeClient)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        await _create_session_with_photos(client, ["fronte", "retro"])
+        assert len(ai_service._prefetched) == 1
+        (first,) = ai_service._prefetched.values()
+
+        await asyncio.sleep(0.3)
+        assert ai_service._prefetched == {}
+        assert first.task.cancelled()
+
+        session_id = await _create_session_with_photos(client, ["fronte"])
+        (second,) = ai_service._prefetched.values()
+        await client.delete(f"/api/v1/sessions/{session_id}")
+        assert ai_service._prefetched == {}
+        await asyncio.sleep(0)
+        assert second.task.cancelled()
+
+
+def _fake_yolo(detections_by_angle):
+    async def detect_damages(image, angle_label):
+        return detections_by_angle.get(angle_label, [])
+    return detect_damages
+
+
+async def _saved_damages(session_id):
+    async with async_session() as db:
+        analysis = (await db.execute(
+            select(AnalysisResult).where(AnalysisResult.session_id == session_id)
+        )).scalars().first()
+        damages = (await db.execute(
+            select(Damage).where(Damage.analysis_id == analysis.id)
+        )).scalars().all()
+    return analysis, damages
+
+
+@pytest.mark.asyncio
+async def test_yolo_engine_saves_boxes_and_confidence(monkeypatch):
+    """analysis_engine=yolo needs no API key and persists bbox + confidence."""
+    monkeypatch.setattr(ai_service.settings, "analysis_engine", "yolo")
+    monkeypatch.setattr(ai_service, "detect_damages", _fake_yolo({
+        "fronte": [{
+            "damage_type": "ammaccatura", "severity": "moderato", "zone": "frontale",
+            "description": "ammaccatura sul cofano (YOLO-n 71%)",
+            "bounding_box": "10,20,110,220", "confidence": 0.71,
+        }],
+    }))
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_session_with_photos(client, ["fronte", "retro"])
+
+    await analyze_session(session_id)
+
+    analysis, damages = await _saved_damages(session_id)
+    assert analysis.status == "completed"
+    assert "=== yolo/fronte ===" in analysis.raw_response
+    assert [(d.bounding_box, d.confidence) for d in damages] == [("10,20,110,220", 0.71)]
+
+
+@pytest.mark.asyncio
+async def test_hybrid_engine_adds_only_unreported_yolo_detections(monkeypatch):
+    monkeypatch.setattr(ai_service.settings, "analysis_engine", "hybrid")
+    monkeypatch.setattr(ai_service.settings, "openai_api_key", "sk-test")
+    monkeypatch.setattr(ai_service.settings, "openai_model", "gpt-4o-mini")
+    monkeypatch.setattr(ai_service, "detect_damages", _fake_yolo({
+        "fronte": [
+            {"damage_type": "graffio", "severity": "lieve", "zone": "frontale",
+             "bounding_box": "1,1,5,5", "confidence": 0.6},
+            {"damage_type": "rottura", "severity": "grave", "zone": "frontale",
+             "bounding_box": "7,7,9,9", "confidence": 0.8},
+        ],
+    }))
+
+    class FakeCompletions:
+        async def create(self, **kwargs):
+            return _fake_openai_response(
+                '{"damages": [{"damage_type": "graffio", "severity": "lieve", "zone": "frontale"}]}'
+            )
+
+    class FakeClient:
+        chat = SimpleNamespace(completions=FakeCompletions())
+
+    monkeypatch.setattr(ai_service, "get_openai_client", FakeClient)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_session_with_photos(client, ["fronte"])
+
+    await analyze_session(session_id)
+
+    _analysis, damages = await _saved_damages(session_id)
+    assert sorted((d.damage_type, d.bounding_box) for d in damages) == [
+        ("graffio", None), ("rottura", "7,7,9,9"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_cascade_escalates_only_uncertain_photos(monkeypatch):
+    monkeypatch.setattr(ai_service.settings, "analysis_engine", "cascade")
+    monkeypatch.setattr(ai_service.settings, "openai_api_key", "sk-test")
+    monkeypatch.setattr(ai_service.settings, "openai_model", "gpt-4o-mini")
+    monkeypatch.setattr(ai_service, "detect_damages", _fake_yolo({
+        "fronte": [{"damage_type": "graffio", "severity": "lieve", "zone": "frontale", "confidence": 0.9}],
+        "retro": [
+            {"damage_type": "ammaccatura", "severity": "moderato", "zone": "posteriore", "confidence": 0.5},
+            {"damage_type": "rottura", "severity": "grave", "zone": "posteriore", "confidence": 0.8},
+        ],
+    }))
+
+    vlm_prompts: list[str] = []
+
+    class FakeCompletions:
+        async def create(self, **kwargs):
+            vlm_prompts.append(kwargs["messages"][0]["content"][1]["text"])
+            return _fake_openai_response(
+                '{"damages": [{"damage_type": "ammaccatura", "severity": "moderato", "zone": "posteriore"}]}'
+            )
+
+    class FakeClient:
+        chat = SimpleNamespace(completions=FakeCompletions())
+
+    monkeypatch.setattr(ai_service, "get_openai_client", FakeClient)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_session_with_photos(client, ["fronte", "retro"])
+        await analyze_session(session_id)
+        results = (await client.get(f"/api/v1/sessions/{session_id}/results")).json()["data"]
+
+    assert vlm_prompts == ["--- FOTO POSTERIORE ---"]
+    _analysis, damages = await _saved_damages(session_id)
+    # fronte from YOLO; retro from the VLM plus YOLO's confident "rottura"
+    assert sorted((d.damage_type, d.zone) for d in damages) == [
+        ("ammaccatura", "posteriore"), ("graffio", "frontale"), ("rottura", "posteriore"),
+    ]
+    metrics = results["metrics"]
+    assert metrics["photos"] == 2
+    assert metrics["escalated"] == 1
+    assert metrics["escalation_reasons"] == {"retro": "uncertain"}
+    assert metrics["yolo_seconds"] >= 0 and metrics["vlm_seconds"] >= 0
+
+
+def _dmg(damage_type, zone="frontale", severity="lieve"):
+    return {"damage_type": damage_type, "severity": severity, "zone": zone}
+
+
+def test_vote_damages_keeps_majority_and_sets_confidence(monkeypatch):
+    monkeypatch.setattr(ai_service.settings, "vlm_vote_threshold", 0.5)
+    passes = [
+        [_dmg("graffio"), _dmg("graffio"), _dmg("crepa")],
+        [_dmg("graffio", severity="moderato"), _dmg("ammaccatura")],
+        [_dmg("graffio", severity="moderato"), _dmg("crepa")],
+        [_dmg("graffio")],
+    ]
+
+    voted = ai_service._vote_damages(passes, total=4)
+
+    assert sorted((d["damage_type"], d["confidence"]) for d in voted) == [
+        ("crepa", 0.5), ("graffio", 1.0),
+    ]
+    # the second scratch is only reported by one pass out of four
+    assert [d["damage_type"] for d in voted].count("graffio") == 1
+    assert not ai_service._vote_settled(passes[:2], total=4)
+    assert ai_service._vote_settled([[_dmg("graffio")]] * 2, total=3)
+    # kept either way, but the third pass could still decide lieve vs grave
+    assert not ai_service._vote_settled([[_dmg("graffio")], [_dmg("graffio", severity="grave")]], total=3)
+    assert ai_service._vote_settled(
+        [[_dmg("graffio")], [_dmg("graffio", severity="grave")], [_dmg("graffio")]], total=3,
+    )
+
+
+@pytest.mark.asyncio
+async def test_voting_cancels_pass_once_settled(monkeypatch):
+    monkeypatch.setattr(ai_service.settings, "openai_api_key", "sk-test")
+    monkeypatch.setattr(ai_service.settings, "openai_model", "gpt-4o-mini")
+    monkeypatch.setattr(ai_service.settings, "vlm_vote_passes", 3)
+    monkeypatch.setattr(ai_service.settings, "vlm_vote_threshold", 0.5)
+
+    calls = 0
+    completed = 0
+
+    class FakeCompletions:
+        async def create(self, **kwargs):
+            nonlocal calls, completed
+            calls += 1
+            if calls == 3:
+                await asyncio.Event().wait()  # the slow pass, only ends by cancellation
+            completed += 1
+            return _fake_openai_response(
+                '{"damages": [{"damage_type": "graffio", "severity": "lieve", "zone": "frontale"}]}'
+            )
+
+    class FakeClient:
+        chat = SimpleNamespace(completions=FakeCompletions())
+
+    monkeypatch.setattr(ai_service, "get_openai_client", FakeClient)
+    encoded = []
+    encode_image_base64 = ai_service._encode_image_base64
+    monkeypatch.setattr(
+        ai_service, "_encode_image_base64", lambda *a: encoded.append(a) or encode_image_base64(*a),
+    )
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        damages, raw = await asyncio.wait_for(
+            _call_openai([_make_fake_photo(tmpdir, "fronte", 0)], vehicle_type="piaggio"), 5,
+        )
+
+    # two agreeing passes settle a 3-pass vote; the third never completes
+    # and counts as not reporting the damage
+    assert completed == 2
+    assert damages == [{**_dmg("graffio"), "confidence": 0.6667}]
+    assert raw.count("[pass ") == 2
+    # all three passes sent the same payload, encoded once
+    assert len(encoded) == 1
@@ -0,0 +1,193 @@
+import os
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from app.models.photo import Photo
+from app.services import ai_service
+from app.services.damage_parser import DamageStreamParser
+
+_RESPONSE = (
+    "<think>maybe {\"damage_type\": \"graffio\"} here?</think>\n"
+    "```json\n"
+    '{"damages": ['
+    '{"damage_type": "graffio", "severity": "lieve", "zone": "frontale", "description": "segno {a} \\"x\\""}, '
+    '{"damage_type": "ammaccatura", "severity": "moderato", "zone": "frontale", "description": "parafango"}'
+    "]}\n```"
+)
+
+
+def _feed_in_chunks(parser: DamageStreamParser, text: str, size: int) -> list[list[dict]]:
+    return [parser.feed(text[i:i + size]) for i in range(0, len(text), size)]
+
+
+def test_parser_emits_each_damage_when_its_brace_closes():
+    parser = DamageStreamParser()
+    batches = _feed_in_chunks(parser, _RESPONSE, 3)
+    parser.close()
+
+    emitted = [d for batch in batches for d in batch]
+    assert [d["damage_type"] for d in emitted] == ["graffio", "ammaccatura"]
+    assert emitted[0]["description"] == 'segno {a} "x"'
+    # The first damage is emitted before the second one has even started.
+    first_batch = next(i for i, b in enumerate(batches) if b)
+    assert (first_batch + 1) * 3 <= _RESPONSE.index('"ammaccatura"')
+    assert parser.document == {"damages": emitted}
+
+
+def test_parser_keeps_entries_before_truncation():
+    truncated = _RESPONSE[: _RESPONSE.index('"parafango"')]
+    parser = DamageStreamParser()
+    _feed_in_chunks(parser, truncated, 7)
+    parser.close()
+
+    assert parser.document is None
+    assert [d["damage_type"] for d in parser.damages] == ["graffio"]
+
+
+def test_parser_ignores_think_block_split_across_chunks():
+    parser = DamageStreamParser()
+    for chunk in ["<thi", 'nk>{"damage_type": "crepa"}</th', "ink>", '{"damages": []}']:
+        parser.feed(chunk)
+    parser.close()
+
+    assert parser.damages == []
+    assert parser.document == {"damages": []}
+
+
+class _StreamingClient:
+    """Fake AsyncOpenAI whose completions stream [text] in small deltas
+    (or return it whole when not asked to stream)."""
+
+    def __init__(self, text: str, fail_after: int | None = None):
+        self.text = text
+        self.fail_after = fail_after
+        outer = self
+
+        class Completions:
+            async def create(self, **kwargs):
+                if not kwargs.get("stream"):
+                    message = SimpleNamespace(content=outer.text)
+                    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+                return outer._chunks()
+
+        self.chat = SimpleNamespace(completions=Completions())
+
+    async def _chunks(self):
+        for n, i in enumerate(range(0, len(self.text), 5)):
+            if self.fail_after is not None and n >= self.fail_after:
+                raise ConnectionError("stream dropped")
+            delta = SimpleNamespace(content=self.text[i:i + 5])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+def _photo(tmpdir: str) -> Photo:
+    path = os.path.join(tmpdir, "fronte.jpg")
+    with open(path, "wb") as f:
+        f.write(b"\xff\xd8\xff\xe0" + b"\x00" * 100)
+    return Photo(
+        id="photo-stream", session_id="sess-stream", angle_index=0, angle_label="fronte",
+        file_path=path, captured_at="2026-04-20T00:00:00Z", is_valid=1, upload_status="uploaded",
+    )
+
+
+@pytest.mark.asyncio
+async def test_streaming_call_reports_damages_as_they_arrive(monkeypatch):
+    monkeypatch.setattr(ai_service.settings, "vlm_streaming", True)
+    seen: list[str] = []
+
+    async def on_damage(damage):
+        seen.append(damage["damage_type"])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with patch.object(ai_service, "get_openai_client", lambda: _StreamingClient(_RESPONSE)):
+            damages, raw = await ai_service._call_openai(
+                [_photo(tmpdir)], vehicle_type="piaggio", on_damage=on_damage,
+            )
+
+    assert seen == ["graffio", "ammaccatura"]
+    assert [d["damage_type"] for d in damages] == seen
+    assert "<think>" in raw
+
+
+@pytest.mark.asyncio
+async def test_streaming_keeps_damages_emitted_before_stream_breaks(monkeypatch):
+    monkeypatch.setattr(ai_service.settings, "vlm_streaming", True)
+    monkeypatch.setattr(ai_service.settings, "vlm_cache_enabled", True)
+    cached: list[str] = []
+
+    async def store_response(key, model, response):
+        cached.append(response)
+
+    monkeypatch.setattr(ai_service.vlm_cache, "store_response", store_response)
+    cut = _RESPONSE.index('"parafango"') // 5
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        client = _StreamingClient(_RESPONSE, fail_after=cut)
+        with patch.object(ai_service, "get_openai_client", lambda: client):
+            damages, raw = await ai_service._call_openai([_photo(tmpdir)], vehicle_type="piaggio")
+
+    assert [d["damage_type"] for d in damages] == ["graffio"]
+    # A cut-off answer is marked as such and never cached
+    assert "[PARTIAL] Stream interrupted: stream dropped" in raw
+    assert cached == []
+
+
+_GRAFFIO = '{"damage_type": "graffio", "severity": "lieve", "zone": "frontale", "description": "x"}'
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ('{"damages": [' + _GRAFFIO + "]}", ["graffio"]),
+        ('{"danni": [' + _GRAFFIO + "]}", ["graffio"]),
+        ("```json\n{\"damages\": [" + _GRAFFIO + "]}\n```", ["graffio"]),
+        ("<think>{\"damages\": []}</think>{\"damages\": [" + _GRAFFIO + "]}", ["graffio"]),
+        ("Ecco il risultato: {\"damages\": [" + _GRAFFIO + "]} fine.", ["graffio"]),
+        ('{"damages": [' + _GRAFFIO + ', {"damage_type": "crepa", "sev', ["graffio"]),
+        ('{"damages": []}', []),
+    ],
+)
+def test_extract_damages_handles_wrapped_and_truncated_output(text, expected):
+    assert [d["damage_type"] for d in ai_service._extract_damages(text)] == expected
+
+
+def test_extract_damages_rejects_output_without_json():
+    with pytest.raises(ValueError):
+        ai_service._extract_damages("Non riesco ad analizzare la foto.")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "text",
+    [
+        _RESPONSE,
+        '{"danni": [' + _GRAFFIO + "]}",
+        # Damage-like objects outside the damages list, and a second document
+        '{"damages": [' + _GRAFFIO + '], "note": {"damage_type": "crepa", "severity": "grave",'
+        ' "zone": "frontale", "description": "y"}}\n{"damages": [' + _GRAFFIO + "]}",
+        '[' + _GRAFFIO + "]",
+        '{"damages": [' + _GRAFFIO + ', {"damage_type": "crepa", "sev',
+    ],
+)
+async def test_streaming_and_plain_calls_agree(monkeypatch, text):
+    results = {}
+    for streaming in (True, False):
+        monkeypatch.setattr(ai_service.settings, "vlm_streaming", streaming)
+        seen: list[dict] = []
+
+        async def on_damage(damage):
+            seen.append(damage)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with patch.object(ai_service, "get_openai_client", lambda: _StreamingClient(text)):
+                damages, _raw = await ai_service._call_openai(
+                    [_photo(tmpdir)], vehicle_type="piaggio", on_damage=on_damage,
+                )
+        assert seen == damages
+        results[streaming] = damages
+
+    assert results[True] == results[False]
+    assert results[True]
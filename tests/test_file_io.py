@@ -0,0 +1,100 @@
+import asyncio
+import io
+import os
+import threading
+import time
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.main import app
+from app.seed import SEED_USER_ID, SEED_VEHICLES
+from app.services import file_io, photo_store
+
+
+@pytest.fixture
+def io_pool(monkeypatch):
+    file_io.shutdown_io_executor()
+    monkeypatch.setattr(file_io.settings, "file_io_workers", 2)
+    yield
+    file_io.shutdown_io_executor()
+
+
+@pytest.mark.asyncio
+async def test_run_io_is_bounded_by_file_io_workers(io_pool):
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def _slow_io(i: int) -> int:
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.02)
+        with lock:
+            active -= 1
+        return i
+
+    results = await asyncio.gather(*(file_io.run_io(_slow_io, i) for i in range(8)))
+
+    assert results == list(range(8))
+    assert peak == 2
+    assert file_io.io_stats["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_event_loop_stays_responsive_during_slow_disk_uploads(io_pool, monkeypatch, tmp_path):
+    monkeypatch.setattr(photo_store.settings, "data_dir", str(tmp_path))
+    monkeypatch.setattr(photo_store.settings, "max_photo_size_bytes", 0)
+    place_file = photo_store._place_file
+
+    def _slow_place_file(staged_path, path, durable=False):
+        time.sleep(0.2)  # a slow or contended disk
+        place_file(staged_path, path, durable)
+
+    monkeypatch.setattr(photo_store, "_place_file", _slow_place_file)
+
+    lags = []
+    stop = asyncio.Event()
+
+    async def _ticker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - started - 0.01)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session = await client.post(
+            "/api/v1/sessions",
+            json={"vehicle_id": SEED_VEHICLES[0]["id"], "user_id": SEED_USER_ID},
+        )
+        session_id = session.json()["data"]["id"]
+
+        async def _upload(i: int):
+            return await client.post(
+                f"/api/v1/sessions/{session_id}/photos",
+                files={"file": ("p.jpg", io.BytesIO(os.urandom(512 * 1024)), "image/jpeg")},
+                data={"angle_index": str(i), "angle_label": "fronte"},
+            )
+
+        async def _health_latency() -> float:
+            await asyncio.sleep(0.05)  # once the uploads are in flight
+            started = time.perf_counter()
+            assert (await client.get("/health")).status_code == 200
+            return time.perf_counter() - started
+
+        ticker = asyncio.create_task(_ticker())
+        started = time.perf_counter()
+        *uploads, health = await asyncio.gather(*(_upload(i) for i in range(6)), _health_latency())
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await ticker
+
+    assert all(r.status_code == 201 for r in uploads)
+    # 6 x 200 ms of disk work on 2 threads: the uploads take a while...
+    assert elapsed >= 0.6
+    # ...but the loop never stalls behind them
+    assert max(lags) < 0.1
+    assert health < 0.1
@@ -0,0 +1,36 @@
+from io import BytesIO
+
+import pytest
+
+from app.services import ai_service
+from app.services.image_processing import prepare_jpeg, preprocess_stats
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def test_prepare_jpeg_downscales_and_applies_orientation(make_jpeg):
+    raw = make_jpeg(4000, 3000, orientation=6)  # 6 = rotate 90° CW on display
+    before = preprocess_stats["photos"]
+
+    out = prepare_jpeg(raw, max_edge=1024, quality=85)
+
+    with Image.open(BytesIO(out)) as im:
+        assert im.size == (768, 1024)
+        assert im.getexif().get(274) in (None, 1)
+    assert len(out) < len(raw)
+    assert preprocess_stats["photos"] == before + 1
+
+
+def test_prepare_jpeg_keeps_small_images_at_native_size(make_jpeg):
+    out = prepare_jpeg(make_jpeg(800, 600), max_edge=1536, quality=85)
+    with Image.open(BytesIO(out)) as im:
+        assert im.size == (800, 600)
+
+
+def test_max_edge_per_model_override(monkeypatch):
+    monkeypatch.setattr(ai_service.settings, "vlm_image_max_edge", 1536)
+    monkeypatch.setattr(
+        ai_service.settings, "vlm_image_max_edge_by_model", {"qwen3-vl-30b-a3b-instruct": 1280},
+    )
+    assert ai_service._max_edge_for_model("qwen/qwen3-vl-30b-a3b-instruct") == 1280
+    assert ai_service._max_edge_for_model("gpt-4o-mini") == 1536
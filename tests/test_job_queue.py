@@ -0,0 +1,218 @@
+import io
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import select
+
+from app.main import app
+from app.database import async_session
+from app.models.analysis import AnalysisResult
+from app.models.job import AnalysisJob
+from app.models.user import User
+from app.seed import SEED_VEHICLES, SEED_USER_ID
+from app.services import ai_service, job_queue
+
+
+async def _create_completed_session(client) -> str:
+    response = await client.post(
+        "/api/v1/sessions",
+        json={"vehicle_id": SEED_VEHICLES[0]["id"], "user_id": SEED_USER_ID},
+    )
+    session_id = response.json()["data"]["id"]
+    fake_image = io.BytesIO(b"\xff\xd8\xff\xe0" + b"\x00" * 100)
+    await client.post(
+        f"/api/v1/sessions/{session_id}/photos",
+        files={"file": ("test.jpg", fake_image, "image/jpeg")},
+        data={"angle_index": "0", "angle_label": "fronte"},
+    )
+    await client.post(f"/api/v1/sessions/{session_id}/complete")
+    return session_id
+
+
+async def _job_for(session_id: str) -> AnalysisJob:
+    async with async_session() as db:
+        result = await db.execute(select(AnalysisJob).where(AnalysisJob.session_id == session_id))
+        return result.scalars().one()
+
+
+async def _drain_queue() -> None:
+    while await job_queue.process_next_job():
+        pass
+
+
+@pytest.mark.asyncio
+async def test_complete_session_enqueues_job():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_completed_session(client)
+        # A second /complete must not stack a duplicate job
+        await client.post(f"/api/v1/sessions/{session_id}/complete")
+
+    job = await _job_for(session_id)
+    assert job.status == "queued"
+    assert job.attempts == 0
+
+
+@pytest.mark.asyncio
+async def test_worker_runs_job_and_marks_done(monkeypatch):
+    ran: list[str] = []
+
+    async def fake_analyze(session_id, charge_user=True):
+        ran.append(session_id)
+
+    monkeypatch.setattr(job_queue, "analyze_session", fake_analyze)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_completed_session(client)
+
+    await _drain_queue()
+
+    assert session_id in ran
+    job = await _job_for(session_id)
+    assert job.status == "done"
+    assert job.attempts == 1
+    assert job.finished_at is not None
+
+
+@pytest.mark.asyncio
+async def test_failed_job_is_retried_with_backoff_then_failed(monkeypatch):
+    async def failing_analyze(session_id, charge_user=True):
+        raise RuntimeError("provider down")
+
+    monkeypatch.setattr(job_queue, "analyze_session", failing_analyze)
+    monkeypatch.setattr(job_queue.settings, "analysis_job_max_attempts", 2)
+    monkeypatch.setattr(job_queue.settings, "analysis_job_retry_base_seconds", 30.0)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_completed_session(client)
+
+    await _drain_queue()
+    job = await _job_for(session_id)
+    assert job.status == "queued"
+    assert job.attempts == 1
+    assert job.run_after > time.time() + 20
+    assert "provider down" in job.last_error
+
+    # Make the retry due and run it: the second failure is final.
+    async with async_session() as db:
+        (await db.get(AnalysisJob, job.id)).run_after = time.time()
+        await db.commit()
+    await _drain_queue()
+
+    job = await _job_for(session_id)
+    assert job.status == "failed"
+    assert job.attempts == 2
+
+
+@pytest.mark.asyncio
+async def test_expired_lease_is_reclaimed(monkeypatch):
+    ran: list[str] = []
+
+    async def fake_analyze(session_id, charge_user=True):
+        ran.append(session_id)
+
+    monkeypatch.setattr(job_queue, "analyze_session", fake_analyze)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_completed_session(client)
+
+    # Simulate a worker that claimed the job and then died
+    async with async_session() as db:
+        job = (await db.execute(
+            select(AnalysisJob).where(AnalysisJob.session_id == session_id)
+        )).scalars().one()
+        job.status = "running"
+        job.attempts = 1
+        job.lease_expires_at = time.time() - 1
+        await db.commit()
+
+    await _drain_queue()
+
+    assert session_id in ran
+    job = await _job_for(session_id)
+    assert job.status == "done"
+    assert job.attempts == 2
+
+
+@pytest.mark.asyncio
+async def test_provider_outage_is_retried_and_charged_once(monkeypatch):
+    monkeypatch.setattr(ai_service.settings, "openai_api_key", "sk-test")
+    monkeypatch.setattr(ai_service.settings, "openai_model", "gpt-4o-mini")
+    monkeypatch.setattr(ai_service.settings, "provider_max_retries", 0)
+    monkeypatch.setattr(job_queue.settings, "analysis_job_max_attempts", 3)
+    outage = True
+
+    class FakeCompletions:
+        async def create(self, **kwargs):
+            if outage:
+                raise openai.APIConnectionError(request=httpx.Request("POST", "https://provider.test"))
+            message = SimpleNamespace(content='{"damages": []}')
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    class FakeClient:
+        chat = SimpleNamespace(completions=FakeCompletions())
+
+    monkeypatch.setattr(ai_service, "get_openai_client", FakeClient)
+
+    async def _remaining_calls() -> int:
+        async with async_session() as db:
+            return (await db.get(User, SEED_USER_ID)).remaining_calls
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_completed_session(client)
+    calls_before = await _remaining_calls()
+
+    await _drain_queue()
+    job = await _job_for(session_id)
+    assert job.status == "queued"
+    assert job.attempts == 1
+    assert "all 1 photos failed" in job.last_error
+
+    outage = False
+    async with async_session() as db:
+        (await db.get(AnalysisJob, job.id)).run_after = time.time()
+        await db.commit()
+    await _drain_queue()
+
+    job = await _job_for(session_id)
+    assert job.status == "done"
+    assert job.attempts == 2
+    assert await _remaining_calls() == calls_before - 1
+    async with async_session() as db:
+        analyses = (await db.execute(
+            select(AnalysisResult).where(AnalysisResult.session_id == session_id)
+        )).scalars().all()
+    assert [a.status for a in analyses] == ["completed"]
+
+
+@pytest.mark.asyncio
+async def test_reanalyze_rejected_while_job_is_running():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_completed_session(client)
+        # A worker holds the job
+        job_id = (await _job_for(session_id)).id
+        async with async_session() as db:
+            job = await db.get(AnalysisJob, job_id)
+            job.status = "running"
+            job.attempts = 1
+            job.lease_expires_at = time.time() + 60
+            await db.commit()
+
+        response = await client.post(f"/api/v1/sessions/{session_id}/reanalyze")
+        assert response.status_code == 409
+
+        # Once the worker's lease is gone the session can be reanalyzed
+        async with async_session() as db:
+            (await db.get(AnalysisJob, job_id)).lease_expires_at = time.time() - 1
+            await db.commit()
+        response = await client.post(f"/api/v1/sessions/{session_id}/reanalyze")
+        assert response.status_code == 200
@@ -0,0 +1,116 @@
+import base64
+import io
+import os
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import select
+
+from app.database import async_session
+from app.main import app
+from app.models.photo import Photo
+from app.seed import SEED_USER_ID, SEED_VEHICLES
+from app.services import ai_service, photo_store
+
+Image = pytest.importorskip("PIL.Image")
+
+
+@pytest.fixture
+def normalize_on_ingest(monkeypatch, data_dir):
+    monkeypatch.setattr(photo_store.settings, "photo_normalize_on_ingest", True)
+    monkeypatch.setattr(photo_store.settings, "photo_ingest_max_edge", 1536)
+    return data_dir
+
+
+async def _upload(client, content: bytes):
+    session = await client.post(
+        "/api/v1/sessions",
+        json={"vehicle_id": SEED_VEHICLES[0]["id"], "user_id": SEED_USER_ID},
+    )
+    session_id = session.json()["data"]["id"]
+    uploaded = await client.post(
+        f"/api/v1/sessions/{session_id}/photos",
+        files={"file": ("fronte.jpg", io.BytesIO(content), "image/jpeg")},
+        data={"angle_index": "0", "angle_label": "fronte"},
+    )
+    assert uploaded.status_code == 201
+    return session_id, uploaded.json()["data"]
+
+
+async def _stored(photo_id: str) -> Photo:
+    async with async_session() as db:
+        return await db.scalar(select(Photo).where(Photo.id == photo_id))
+
+
+@pytest.mark.asyncio
+async def test_rotated_photo_stored_upright_and_capped(normalize_on_ingest, make_jpeg):
+    original = make_jpeg(4000, 3000, orientation=6)  # 90° CW: upright it is portrait
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id, data = await _upload(client, original)
+        served = await client.get(f"/api/v1/sessions/{session_id}/photos/{data['photo_id']}")
+
+    photo = await _stored(data["photo_id"])
+    assert data["normalized_edge"] == photo.normalized_edge == 1536
+    assert data["size_bytes"] == len(served.content) < len(original)
+    assert photo.content_hash == photo_store.content_hash(served.content)
+    with Image.open(io.BytesIO(served.content)) as im:
+        assert im.size == (1152, 1536)
+        assert im.getexif().get(0x0112) in (None, 1)
+
+
+@pytest.mark.asyncio
+async def test_already_normalized_photo_kept_byte_for_byte(normalize_on_ingest, make_jpeg):
+    original = make_jpeg(1200, 900)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        _session_id, data = await _upload(client, original)
+
+    photo = await _stored(data["photo_id"])
+    assert photo.normalized_edge == 1200
+    assert photo.content_hash == photo_store.content_hash(original)
+
+
+@pytest.mark.asyncio
+async def test_undecodable_upload_stored_as_is(normalize_on_ingest):
+    original = b"\xff\xd8" + os.urandom(256)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id, data = await _upload(client, original)
+        served = await client.get(f"/api/v1/sessions/{session_id}/photos/{data['photo_id']}")
+
+    assert data["normalized_edge"] == 0
+    assert (await _stored(data["photo_id"])).normalized_edge == 0
+    assert served.content == original
+
+
+@pytest.mark.asyncio
+async def test_originals_kept_unless_normalization_enabled(data_dir, make_jpeg):
+    original = make_jpeg(2000, 1500, orientation=6)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id, data = await _upload(client, original)
+        served = await client.get(f"/api/v1/sessions/{session_id}/photos/{data['photo_id']}")
+
+    assert (await _stored(data["photo_id"])).normalized_edge == 0
+    assert served.content == original
+
+
+def test_vlm_encode_skips_decoding_photos_within_the_model_edge(monkeypatch, tmp_path, make_jpeg):
+    path = tmp_path / "p.jpg"
+    path.write_bytes(make_jpeg(1536, 1152))
+
+    def _no_decode(*args, **kwargs):
+        raise AssertionError("normalized photo decoded again")
+
+    monkeypatch.setattr(ai_service, "prepare_jpeg", _no_decode)
+    b64 = ai_service._encode_image_base64(str(path), None, 2048, normalized_edge=1536)
+    assert base64.b64decode(b64) == path.read_bytes()
+
+    # Stored larger than the model wants (e.g. the ingest cap was raised
+    # later): still downscaled per request
+    calls = []
+    monkeypatch.setattr(ai_service, "prepare_jpeg", lambda raw, *a: calls.append(a) or raw)
+    monkeypatch.setattr(ai_service.settings, "photo_ingest_max_edge", 1024)
+    ai_service._encode_image_base64(str(path), None, 1024, normalized_edge=1536)
+    assert calls == [(1024, ai_service.settings.vlm_image_jpeg_quality)]
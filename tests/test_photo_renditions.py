@@ -0,0 +1,97 @@
+import io
+import os
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.main import app
+from app.seed import SEED_USER_ID, SEED_VEHICLES
+from app.services import photo_renditions
+from app.services.photo_renditions import RenditionCache, rendition_cache
+
+Image = pytest.importorskip("PIL.Image")
+
+
+async def _upload_photo(client, content: bytes) -> tuple[str, str]:
+    session = await client.post(
+        "/api/v1/sessions",
+        json={"vehicle_id": SEED_VEHICLES[0]["id"], "user_id": SEED_USER_ID},
+    )
+    session_id = session.json()["data"]["id"]
+    uploaded = await client.post(
+        f"/api/v1/sessions/{session_id}/photos",
+        files={"file": ("fronte.jpg", io.BytesIO(content), "image/jpeg")},
+        data={"angle_index": "0", "angle_label": "fronte"},
+    )
+    return session_id, uploaded.json()["data"]["photo_id"]
+
+
+@pytest.mark.asyncio
+async def test_thumbnail_rendered_once_then_served_from_cache(data_dir, make_jpeg):
+    original = make_jpeg(2000, 1500)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id, photo_id = await _upload_photo(client, original)
+        url = f"/api/v1/sessions/{session_id}/photos/{photo_id}"
+        hits = rendition_cache.stats["hits"]
+        misses = rendition_cache.stats["misses"]
+
+        first = await client.get(url, params={"size": "thumb"})
+        second = await client.get(url, params={"size": "thumb"})
+        full = await client.get(url)
+
+    assert first.status_code == 200
+    assert first.headers["content-type"] == "image/jpeg"
+    with Image.open(io.BytesIO(first.content)) as im:
+        assert max(im.size) == photo_renditions.settings.photo_thumb_edge
+    assert len(first.content) < len(original) // 10
+    assert second.content == first.content
+    assert rendition_cache.stats["misses"] == misses + 1
+    assert rendition_cache.stats["hits"] == hits + 1
+    assert full.content == original
+
+
+@pytest.mark.asyncio
+async def test_webp_rendition(data_dir, make_jpeg):
+    if photo_renditions.resolve_format("webp") != "webp":
+        pytest.skip("Pillow built without WebP")
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id, photo_id = await _upload_photo(client, make_jpeg(1600, 1200))
+        response = await client.get(
+            f"/api/v1/sessions/{session_id}/photos/{photo_id}",
+            params={"size": "medium", "format": "webp"},
+        )
+        invalid = await client.get(
+            f"/api/v1/sessions/{session_id}/photos/{photo_id}", params={"size": "huge"},
+        )
+
+    assert response.headers["content-type"] == "image/webp"
+    with Image.open(io.BytesIO(response.content)) as im:
+        assert im.format == "WEBP"
+        assert im.size == (1024, 768)
+    assert invalid.status_code == 422
+
+
+def test_rendition_cache_evicts_least_recently_used(monkeypatch, tmp_path):
+    monkeypatch.setattr(photo_renditions.settings, "data_dir", str(tmp_path))
+    monkeypatch.setattr(photo_renditions.settings, "photo_rendition_cache_max_bytes", 250)
+    cache = RenditionCache()
+    paths = [cache.path_for(f"{i:02d}" + "k" * 30, ".jpg") for i in range(3)]
+
+    cache.put(paths[0], b"a" * 100)
+    cache.put(paths[1], b"b" * 100)
+    assert cache.get(paths[0]) == paths[0]  # 0 is now more recent than 1
+    cache.put(paths[2], b"c" * 100)
+
+    assert os.path.exists(paths[0]) and os.path.exists(paths[2])
+    assert not os.path.exists(paths[1])
+    assert cache.get(paths[1]) is None
+    assert cache.summary()["bytes"] == 200
+    assert cache.summary()["evictions"] == 1
+
+    # A fresh instance (new process) rebuilds the index from disk
+    assert RenditionCache().summary()["files"] == 0
+    restarted = RenditionCache()
+    assert restarted.get(paths[2]) == paths[2]
+    assert restarted.summary()["bytes"] == 200
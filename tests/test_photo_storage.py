@@ -0,0 +1,230 @@
+import io
+import os
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import select
+
+from app.database import async_session
+from app.main import app
+from app.models.photo_blob import PhotoBlob
+from app.seed import SEED_USER_ID, SEED_VEHICLES
+from app.services import photo_storage, photo_store
+from app.services.photo_storage import S3Storage
+
+
+class _FakeS3:
+    """In-memory stand-in for the few boto3 S3 client calls S3Storage makes."""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects: dict[tuple[str, str], bytes] = {}
+
+    def upload_file(self, path, bucket, key, ExtraArgs=None):
+        with open(path, "rb") as f:
+            self.objects[(bucket, key)] = f.read()
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey()
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def download_file(self, bucket, key, path):
+        with open(path, "wb") as f:
+            f.write(self.objects[(bucket, key)])
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete["Objects"]:
+            self.objects.pop((Bucket, obj["Key"]), None)
+
+    def generate_presigned_url(self, method, Params, ExpiresIn):
+        return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+@pytest.fixture
+def storage_settings(monkeypatch, tmp_path):
+    settings = photo_store.settings
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "s3_bucket", "photos-test")
+    return settings
+
+
+async def _upload(client, content: bytes) -> tuple[str, str]:
+    session = await client.post(
+        "/api/v1/sessions",
+        json={"vehicle_id": SEED_VEHICLES[0]["id"], "user_id": SEED_USER_ID},
+    )
+    session_id = session.json()["data"]["id"]
+    uploaded = await client.post(
+        f"/api/v1/sessions/{session_id}/photos",
+        files={"file": ("fronte.jpg", io.BytesIO(content), "image/jpeg")},
+        data={"angle_index": "0", "angle_label": "fronte"},
+    )
+    return session_id, uploaded.json()["data"]["photo_id"]
+
+
+async def _blob_row(digest: str):
+    async with async_session() as db:
+        return (await db.execute(
+            select(PhotoBlob.storage, PhotoBlob.data).where(PhotoBlob.hash == digest)
+        )).first()
+
+
+@pytest.mark.asyncio
+async def test_local_backend_keeps_bytes_out_of_the_db(monkeypatch, storage_settings):
+    monkeypatch.setattr(storage_settings, "photo_storage_backend", "local")
+    content = b"\xff\xd8" + os.urandom(64)
+    digest = photo_store.content_hash(content)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id, photo_id = await _upload(client, content)
+        assert await _blob_row(digest) == ("local", None)
+        served = await client.get(f"/api/v1/sessions/{session_id}/photos/{photo_id}")
+        assert served.content == content
+        assert await photo_store.load_bytes(digest) == content
+
+        await client.delete(f"/api/v1/sessions/{session_id}")
+
+    assert await _blob_row(digest) is None
+    assert not os.path.exists(photo_store.blob_path(digest))
+
+
+@pytest.mark.asyncio
+async def test_switching_backend_still_reads_existing_blobs(monkeypatch, storage_settings):
+    content = b"\xff\xd8" + os.urandom(64)
+    digest = photo_store.content_hash(content)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id, photo_id = await _upload(client, content)  # default: db
+        monkeypatch.setattr(storage_settings, "photo_storage_backend", "local")
+        os.remove(photo_store.blob_path(digest))
+
+        served = await client.get(f"/api/v1/sessions/{session_id}/photos/{photo_id}")
+
+    assert served.content == content
+    assert (await _blob_row(digest))[0] == "db"
+
+
+@pytest.mark.asyncio
+async def test_s3_backend_restores_redirects_and_deletes(monkeypatch, storage_settings):
+    fake = _FakeS3()
+    monkeypatch.setitem(photo_storage._backends, "s3", S3Storage(client=fake))
+    monkeypatch.setattr(storage_settings, "photo_storage_backend", "s3")
+    content = b"\xff\xd8" + os.urandom(64)
+    digest = photo_store.content_hash(content)
+    key = ("photos-test", f"photos/{digest[:2]}/{digest}.jpg")
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id, photo_id = await _upload(client, content)
+        url = f"/api/v1/sessions/{session_id}/photos/{photo_id}"
+        assert fake.objects[key] == content
+        assert await _blob_row(digest) == ("s3", None)
+
+        # Local copy wiped: streamed back from the bucket
+        os.remove(photo_store.blob_path(digest))
+        served = await client.get(url)
+        assert served.content == content
+        assert os.path.exists(photo_store.blob_path(digest))
+
+        monkeypatch.setattr(storage_settings, "photo_storage_redirect", True)
+        redirected = await client.get(url, follow_redirects=False)
+        assert redirected.status_code == 307
+        assert redirected.headers["location"].startswith(f"https://s3.test/{key[0]}/{key[1]}")
+
+        await client.delete(f"/api/v1/sessions/{session_id}")
+
+    assert key not in fake.objects
+    assert await _blob_row(digest) is None
+
+
+@pytest.mark.asyncio
+async def test_s3_backend_against_moto(monkeypatch, storage_settings, tmp_path):
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setattr(storage_settings, "s3_region", "us-east-1")
+
+    with moto.mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="photos-test")
+        storage = S3Storage()
+        staged = tmp_path / "staged.jpg"
+        staged.write_bytes(b"\xff\xd8" + b"\x01" * 64)
+        digest = "ab" + "0" * 62
+
+        await storage.put(None, digest, str(staged))
+        assert await storage.read(digest) == staged.read_bytes()
+        restored = tmp_path / "restored.jpg"
+        assert await storage.fetch_to_file(digest, str(restored))
+        assert restored.read_bytes() == staged.read_bytes()
+        assert (await storage.presigned_url(digest)).startswith("https://")
+
+        await storage.delete([digest])
+        assert await storage.read(digest) is None
+        assert not await storage.fetch_to_file(digest, str(tmp_path / "gone.jpg"))
+
+
+@pytest.mark.asyncio
+async def test_local_purge_keeps_blob_stored_again_meanwhile(monkeypatch, storage_settings):
+    monkeypatch.setattr(storage_settings, "photo_storage_backend", "local")
+    content = b"\xff\xd8" + os.urandom(64)
+    digest = photo_store.content_hash(content)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        await _upload(client, content)
+        async with async_session() as db:
+            orphans = await photo_store.release(db, [digest])
+            await db.commit()
+        assert orphans == [(digest, "local")]
+
+        # The same bytes are uploaded again before the purge runs
+        session_id, photo_id = await _upload(client, content)
+        await photo_store.purge(orphans)
+
+        served = await client.get(f"/api/v1/sessions/{session_id}/photos/{photo_id}")
+
+    assert served.content == content
+    assert await _blob_row(digest) == ("local", None)
+
+
+@pytest.mark.asyncio
+async def test_local_backend_fails_upload_it_cannot_write(monkeypatch, storage_settings):
+    monkeypatch.setattr(storage_settings, "photo_storage_backend", "local")
+    content = b"\xff\xd8" + os.urandom(64)
+    digest = photo_store.content_hash(content)
+    # A file where the blob's directory should be: the move can't succeed
+    blocker = os.path.dirname(photo_store.blob_path(digest))
+    os.makedirs(os.path.dirname(blocker), exist_ok=True)
+    with open(blocker, "wb"):
+        pass
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session = await client.post(
+            "/api/v1/sessions",
+            json={"vehicle_id": SEED_VEHICLES[0]["id"], "user_id": SEED_USER_ID},
+        )
+        uploaded = await client.post(
+            f"/api/v1/sessions/{session.json()['data']['id']}/photos",
+            files={"file": ("fronte.jpg", io.BytesIO(content), "image/jpeg")},
+            data={"angle_index": "0", "angle_label": "fronte"},
+        )
+
+    assert uploaded.status_code == 500
+    assert await _blob_row(digest) is None
+
+
+def test_storage_backends_must_implement_the_interface():
+    class Incomplete(photo_storage.PhotoStorage):
+        async def read(self, digest):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -1,8 +1,14 @@
 import io
+import os
 import pytest
 from httpx import ASGITransport, AsyncClient
+from sqlalchemy import inspect, select
 
+from app.database import async_session
 from app.main import app
+from app.models.photo import Photo
+from app.models.photo_blob import PhotoBlob
+from app.services import photo_store
 from app.seed import SEED_VEHICLES, SEED_USER_ID
 
 
@@ -81,3 +87,221 @@ async def test_complete_nonexistent_session():
         response = await client.post("/api/v1/sessions/nonexistent/complete")
 
     assert response.status_code == 404
+
+
+async def _upload(client, session_id, content: bytes, angle_index: int = 0):
+    return await client.post(
+        f"/api/v1/sessions/{session_id}/photos",
+        files={"file": ("test.jpg", io.BytesIO(content), "image/jpeg")},
+        data={"angle_index": str(angle_index), "angle_label": "fronte"},
+    )
+
+
+async def _blob(digest: str) -> PhotoBlob | None:
+    async with async_session() as db:
+        return await db.get(PhotoBlob, digest)
+
+
+@pytest.mark.asyncio
+async def test_duplicate_uploads_share_one_blob(monkeypatch, tmp_path):
+    monkeypatch.setattr(photo_store.settings, "data_dir", str(tmp_path))
+    content = b"\xff\xd8\xff\xe0" + os.urandom(64)
+    digest = photo_store.content_hash(content)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        first = await _create_session(client)
+        second = await _create_session(client)
+        await _upload(client, first, content)
+        await _upload(client, first, content, angle_index=1)  # retry
+        await _upload(client, second, content)
+
+        async with async_session() as db:
+            photos = (await db.execute(
+                select(Photo).where(Photo.content_hash == digest)
+            )).scalars().all()
+        assert len(photos) == 3
+        async with async_session() as db:
+            legacy = (await db.execute(
+                select(Photo.image_data).where(Photo.content_hash == digest)
+            )).scalars().all()
+        assert legacy == [None, None, None]
+        assert {p.file_path for p in photos} == {photo_store.blob_path(digest)}
+        assert (await _blob(digest)).ref_count == 3
+
+        # One file on disk; served from the DB copy once it is wiped
+        os.remove(photo_store.blob_path(digest))
+        served = await client.get(f"/api/v1/sessions/{first}/photos/{photos[0].id}")
+        assert served.status_code == 200
+        assert served.content == content
+        assert os.path.exists(photo_store.blob_path(digest))  # rehydrated
+
+        await client.delete(f"/api/v1/sessions/{first}")
+        assert (await _blob(digest)).ref_count == 1
+        await client.delete(f"/api/v1/sessions/{second}")
+
+    assert await _blob(digest) is None
+    assert not os.path.exists(photo_store.blob_path(digest))
+
+
+@pytest.mark.asyncio
+async def test_reanalyze_with_same_files_keeps_blob(monkeypatch, tmp_path):
+    monkeypatch.setattr(photo_store.settings, "data_dir", str(tmp_path))
+    content = b"\xff\xd8\xff\xe0" + os.urandom(64)
+    digest = photo_store.content_hash(content)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_session(client)
+        await _upload(client, session_id, content)
+        created_at = (await _blob(digest)).created_at
+
+        response = await client.post(
+            f"/api/v1/sessions/{session_id}/reanalyze",
+            files=[("files", ("fronte.jpg", io.BytesIO(content), "image/jpeg"))],
+        )
+        assert response.status_code == 200
+
+    blob = await _blob(digest)
+    assert blob.ref_count == 1
+    assert blob.created_at == created_at
+
+
+@pytest.mark.asyncio
+async def test_photo_bytes_are_deferred_and_legacy_blob_still_served(tmp_path):
+    content = b"\xff\xd8\xff\xe0" + os.urandom(64)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_session(client)
+        # Photo stored before the blob store: bytes in image_data, file wiped
+        async with async_session() as db:
+            db.add(Photo(
+                id=f"legacy-{session_id}",
+                session_id=session_id,
+                angle_index=0,
+                angle_label="fronte",
+                file_path=str(tmp_path / "gone.jpg"),
+                image_data=content,
+                captured_at="2026-04-20T00:00:00Z",
+                is_valid=1,
+                upload_status="uploaded",
+            ))
+            await db.commit()
+
+        async with async_session() as db:
+            photo = (await db.execute(
+                select(Photo).where(Photo.session_id == session_id)
+            )).scalars().one()
+            assert "image_data" in inspect(photo).unloaded
+
+        # Served from memory (image_data), with range support
+        partial = await client.get(
+            f"/api/v1/sessions/{session_id}/photos/{photo.id}", headers={"Range": "bytes=2-5"},
+        )
+        served = await client.get(f"/api/v1/sessions/{session_id}/photos/{photo.id}")
+        debug = await client.get(f"/api/v1/sessions/{session_id}/debug-photos")
+
+    assert partial.status_code == 206
+    assert partial.content == content[2:6]
+    assert served.content == content
+    assert debug.json()["data"][0]["blob_size_bytes"] == len(content)
+
+
+@pytest.mark.asyncio
+async def test_upload_over_size_limit_is_rejected(monkeypatch, tmp_path):
+    monkeypatch.setattr(photo_store.settings, "data_dir", str(tmp_path))
+    monkeypatch.setattr(photo_store.settings, "max_photo_size_bytes", 1000)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_session(client)
+        too_big = await _upload(client, session_id, b"\xff\xd8" + b"\x00" * 1000)
+        fits = await _upload(client, session_id, b"\xff\xd8" + b"\x00" * 998)
+
+    assert too_big.status_code == 413
+    assert fits.status_code == 201
+    assert fits.json()["data"]["size_bytes"] == 1000
+    assert os.listdir(tmp_path / "blobs" / "tmp") == []  # no staged leftovers
+
+
+class _ChunkedUpload:
+    """Minimal UploadFile stand-in with unknown size."""
+
+    def __init__(self, data: bytes):
+        self._stream = io.BytesIO(data)
+        self.reads = 0
+
+    async def read(self, size: int = -1) -> bytes:
+        self.reads += 1
+        return self._stream.read(size)
+
+
+@pytest.mark.asyncio
+async def test_stage_upload_hashes_in_chunks(monkeypatch, tmp_path):
+    monkeypatch.setattr(photo_store.settings, "data_dir", str(tmp_path))
+    monkeypatch.setattr(photo_store, "UPLOAD_CHUNK_BYTES", 1024)
+    data = os.urandom(5000)
+
+    upload = _ChunkedUpload(data)
+    staged = await photo_store.stage_upload(upload, max_bytes=5000)
+    assert upload.reads == 6  # 5 chunks + EOF
+    assert staged.digest == photo_store.content_hash(data)
+    assert staged.size == 5000
+    with open(staged.path, "rb") as f:
+        assert f.read() == data
+    await photo_store.discard(staged)
+
+    upload = _ChunkedUpload(data)
+    with pytest.raises(photo_store.PhotoTooLargeError):
+        await photo_store.stage_upload(upload, max_bytes=3000)
+    assert upload.reads == 3  # stopped as soon as the limit was crossed
+    assert os.listdir(tmp_path / "blobs" / "tmp") == []
+
+
+@pytest.mark.asyncio
+async def test_photo_caching_headers_304_and_ranges(monkeypatch, tmp_path):
+    monkeypatch.setattr(photo_store.settings, "data_dir", str(tmp_path))
+    content = b"\xff\xd8\xff\xe0" + os.urandom(96)
+    digest = photo_store.content_hash(content)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        session_id = await _create_session(client)
+        photo_id = (await _upload(client, session_id, content)).json()["data"]["photo_id"]
+        url = f"/api/v1/sessions/{session_id}/photos/{photo_id}"
+
+        full = await client.get(url)
+        assert full.headers["etag"] == f'"{digest}"'
+        assert "immutable" in full.headers["cache-control"]
+        assert "last-modified" in full.headers
+
+        # Revalidation never touches the blob, even with the file gone
+        os.remove(photo_store.blob_path(digest))
+        blob_reads = []
+        restore_file = photo_store.restore_file
+
+        async def _counting_restore(photo):
+            blob_reads.append(photo.id)
+            return await restore_file(photo)
+
+        monkeypatch.setattr(photo_store, "restore_file", _counting_restore)
+        cached = await client.get(url, headers={"If-None-Match": full.headers["etag"]})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        since = await client.get(url, headers={"If-Modified-Since": full.headers["last-modified"]})
+        assert since.status_code == 304
+        assert blob_reads == []
+
+        # Range while the file is restored from the DB, then on the restored file
+        from_blob = await client.get(url, headers={"Range": "bytes=4-19"})
+        from_disk = await client.get(url, headers={"Range": "bytes=-10"})
+        stale = await client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"other"'})
+        unsatisfiable = await client.get(url, headers={"Range": "bytes=500-"})
+
+    assert blob_reads == [photo_id]
+    assert from_blob.status_code == 206
+    assert from_blob.content == content[4:20]
+    assert from_blob.headers["content-range"] == f"bytes 4-19/{len(content)}"
+    assert from_disk.status_code == 206
+    assert from_disk.content == content[-10:]
+    assert stale.status_code == 200 and stale.content == content
+    assert unsatisfiable.status_code == 416
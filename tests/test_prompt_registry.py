@@ -0,0 +1,83 @@
+import io
+import os
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.main import app
+from app.seed import SEED_VEHICLES, SEED_USER_ID
+from app.services import ai_service
+from app.services.prompt_registry import PROMPTS_DIR, PromptRegistry, prompt_registry
+
+
+def test_registry_resolves_per_angle_and_fallback_prompts():
+    fronte = prompt_registry.get("piaggio", "fronte")
+    with open(os.path.join(PROMPTS_DIR, "scooter", "fronte.txt"), encoding="utf-8") as f:
+        assert fronte.text == f.read()
+    assert fronte.source.replace(os.sep, "/") == "scooter/fronte.txt"
+
+    # Unknown angle -> vehicle-specific fallback; unknown vehicle -> generic fallback
+    assert prompt_registry.get("scudo", "tetto").source == "damage_analysis_scudo.txt"
+    assert prompt_registry.get("sconosciuto", "fronte").source == "damage_analysis.txt"
+
+    # Same text -> same version; different file -> different version
+    assert prompt_registry.get("ligier", "fronte").version == fronte.version
+    assert prompt_registry.get("piaggio", "retro").version != fronte.version
+
+
+def test_registry_hot_reloads_on_mtime_change():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.makedirs(os.path.join(tmpdir, "scooter"))
+        path = os.path.join(tmpdir, "scooter", "fronte.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("v1")
+        with open(os.path.join(tmpdir, "damage_analysis.txt"), "w", encoding="utf-8") as f:
+            f.write("generic")
+
+        registry = PromptRegistry(tmpdir)
+        first = registry.get("piaggio", "fronte")
+        assert first.text == "v1"
+        assert registry.reload_if_changed() is False
+
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("v2")
+        os.utime(path, (os.path.getmtime(path) + 10, os.path.getmtime(path) + 10))
+
+        assert registry.reload_if_changed() is True
+        second = registry.get("piaggio", "fronte")
+        assert second.text == "v2"
+        assert second.version != first.version
+
+
+@pytest.mark.asyncio
+async def test_analysis_records_prompt_versions(monkeypatch):
+    monkeypatch.setattr(ai_service.settings, "openai_api_key", "sk-test")
+
+    class FakeCompletions:
+        async def create(self, **kwargs):
+            message = SimpleNamespace(content='{"damages": []}')
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    fake_client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+    monkeypatch.setattr(ai_service, "get_openai_client", lambda: fake_client)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post(
+            "/api/v1/sessions",
+            json={"vehicle_id": SEED_VEHICLES[0]["id"], "user_id": SEED_USER_ID},
+        )
+        session_id = response.json()["data"]["id"]
+        await client.post(
+            f"/api/v1/sessions/{session_id}/photos",
+            files={"file": ("test.jpg", io.BytesIO(b"\xff\xd8\xff\xe0" + b"\x00" * 100), "image/jpeg")},
+            data={"angle_index": "0", "angle_label": "fronte"},
+        )
+
+        await ai_service.analyze_session(session_id)
+        results = (await client.get(f"/api/v1/sessions/{session_id}/results")).json()["data"]
+
+    assert results["analysis_status"] == "completed"
+    assert results["prompt_versions"] == {"fronte": prompt_registry.get("piaggio", "fronte").version}
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+
+from app.main import app
+from app.services import ai_service
+from app.services.rate_limiter import ProviderLimiter, retry_after_seconds
+
+
+@pytest.mark.asyncio
+async def test_limiter_caps_concurrency_and_reports_queue():
+    limiter = ProviderLimiter(max_concurrency=2, requests_per_minute=0, tokens_per_minute=0)
+    peak = 0
+    depths: list[int] = []
+
+    async def call():
+        nonlocal peak
+        async with limiter.slot(estimated_tokens=10):
+            peak = max(peak, limiter.in_flight)
+            depths.append(limiter.queue_depth)
+            await asyncio.sleep(0.02)
+
+    await asyncio.gather(*(call() for _ in range(6)))
+
+    assert peak == 2
+    assert max(depths) > 0
+    stats = limiter.stats()
+    assert stats["total_calls"] == 6
+    assert stats["queue_depth"] == 0
+    assert stats["in_flight"] == 0
+    assert stats["max_wait_seconds"] > 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_spaces_calls_by_requests_per_minute():
+    # 600 RPM = 10/s with a burst of 600; drain the burst so the next call must wait.
+    limiter = ProviderLimiter(max_concurrency=4, requests_per_minute=600, tokens_per_minute=0)
+    limiter.requests.tokens = 0
+
+    started = time.monotonic()
+    async with limiter.slot(estimated_tokens=1):
+        pass
+    assert time.monotonic() - started >= 0.08
+
+
+def test_retry_after_header_parsing():
+    def err(headers):
+        return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+    assert retry_after_seconds(err({"retry-after": "7"}), attempt=0) == 7.0
+    assert retry_after_seconds(err({"retry-after-ms": "1500"}), attempt=0) == 1.5
+    # No header -> exponential fallback
+    assert retry_after_seconds(err({}), attempt=2) == 4.0
+
+
+@pytest.mark.asyncio
+async def test_create_completion_honours_retry_after_on_429(monkeypatch):
+    limiter = ProviderLimiter(max_concurrency=2, requests_per_minute=0, tokens_per_minute=0)
+    monkeypatch.setattr(ai_service, "provider_limiter", limiter)
+    monkeypatch.setattr(ai_service.settings, "provider_max_retries", 2)
+
+    class RateLimited(Exception):
+        status_code = 429
+        response = SimpleNamespace(headers={"retry-after-ms": "50"})
+
+    calls = 0
+
+    class FakeCompletions:
+        async def create(self, **kwargs):
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                raise RateLimited("slow down")
+            return SimpleNamespace(choices=[], usage=SimpleNamespace(total_tokens=123))
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions()))
+
+    started = time.monotonic()
+    await ai_service._create_completion(client, {"model": "m"})
+
+    assert calls == 2
+    assert time.monotonic() - started >= 0.05
+    assert limiter.stats()["rate_limited"] == 1
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_exposes_provider_stats():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.get("/api/v1/metrics")
+
+    assert response.status_code == 200
+    provider = response.json()["data"]["provider"]
+    assert {"queue_depth", "in_flight", "avg_wait_seconds"} <= provider.keys()
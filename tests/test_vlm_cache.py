@@ -0,0 +1,129 @@
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from app.database import async_session
+from app.models.photo import Photo
+from app.models.vlm_cache import VlmResponseCache
+from app.services import ai_service, vlm_cache
+from app.services.ai_service import _call_openai
+
+
+def _photo(tmpdir: str, angle_label: str, payload: bytes) -> Photo:
+    file_path = os.path.join(tmpdir, f"{angle_label}.jpg")
+    with open(file_path, "wb") as f:
+        f.write(payload)
+    return Photo(
+        id=f"photo-{angle_label}",
+        session_id="sess-cache",
+        angle_index=0,
+        angle_label=angle_label,
+        file_path=file_path,
+        captured_at="2026-04-20T00:00:00Z",
+        is_valid=1,
+        upload_status="uploaded",
+    )
+
+
+class _CountingClient:
+    def __init__(self):
+        self.calls = 0
+        outer = self
+
+        class Completions:
+            async def create(self, **kwargs):
+                outer.calls += 1
+                message = SimpleNamespace(
+                    content='{"damages": [{"damage_type": "graffio", "severity": "lieve", "zone": "frontale"}]}'
+                )
+                return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+        self.chat = SimpleNamespace(completions=Completions())
+
+
+@pytest.mark.asyncio
+async def test_unchanged_photo_is_served_from_cache(monkeypatch):
+    monkeypatch.setattr(ai_service.settings, "vlm_cache_enabled", True)
+    monkeypatch.setattr(ai_service.settings, "openai_model", "cache-test-model")
+    client = _CountingClient()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        photo = _photo(tmpdir, "fronte", b"\xff\xd8\xff\xe0cache-unchanged" + b"\x00" * 64)
+        with patch.object(ai_service, "get_openai_client", lambda: client):
+            first, _ = await _call_openai([photo], vehicle_type="piaggio")
+            second, raw = await _call_openai([photo], vehicle_type="piaggio")
+
+            # Different bytes -> different key -> real call
+            with open(photo.file_path, "wb") as f:
+                f.write(b"\xff\xd8\xff\xe0cache-changed" + b"\x00" * 64)
+            await _call_openai([photo], vehicle_type="piaggio")
+
+    assert client.calls == 2
+    assert first == second
+    assert "graffio" in raw
+
+
+def test_cache_key_depends_on_every_input():
+    kwargs = {"model": "m", "max_tokens": 10, "messages": [{"role": "user", "content": "x"}]}
+    base = vlm_cache.cache_key(b"img", "prompt", "m", kwargs)
+
+    assert base == vlm_cache.cache_key(b"img", "prompt", "m", {**kwargs, "messages": []})
+    assert base != vlm_cache.cache_key(b"img2", "prompt", "m", kwargs)
+    assert base != vlm_cache.cache_key(b"img", "prompt2", "m", kwargs)
+    assert base != vlm_cache.cache_key(b"img", "prompt", "m2", kwargs)
+    assert base != vlm_cache.cache_key(b"img", "prompt", "m", {**kwargs, "max_tokens": 11})
+
+
+@pytest.mark.asyncio
+async def test_cache_ttl_and_lru_eviction(monkeypatch):
+    monkeypatch.setattr(vlm_cache.settings, "vlm_cache_ttl_seconds", 60)
+    monkeypatch.setattr(vlm_cache.settings, "vlm_cache_max_entries", 2)
+
+    await vlm_cache.store_response("lru-a", "m", "a")
+    await vlm_cache.store_response("lru-b", "m", "b")
+    assert await vlm_cache.get_cached_response("lru-a") == "a"  # a is now most recent
+    await vlm_cache.store_response("lru-c", "m", "c")
+
+    assert await vlm_cache.get_cached_response("lru-b") is None
+    assert await vlm_cache.get_cached_response("lru-a") == "a"
+    assert await vlm_cache.get_cached_response("lru-c") == "c"
+
+    async with async_session() as db:
+        (await db.get(VlmResponseCache, "lru-c")).created_at = time.time() - 120
+        await db.commit()
+    assert await vlm_cache.get_cached_response("lru-c") is None
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_skips_encoding_blob_backed_photo(monkeypatch):
+    monkeypatch.setattr(ai_service.settings, "vlm_cache_enabled", True)
+    monkeypatch.setattr(ai_service.settings, "openai_model", "cache-test-model")
+    client = _CountingClient()
+    encodes = 0
+    encode = ai_service._encode_image_base64
+
+    def _counting_encode(*args):
+        nonlocal encodes
+        encodes += 1
+        return encode(*args)
+
+    monkeypatch.setattr(ai_service, "_encode_image_base64", _counting_encode)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        photo = _photo(tmpdir, "retro", b"\xff\xd8\xff\xe0cache-blob" + b"\x00" * 64)
+        photo.content_hash = "c0ffee" * 10 + "beef"
+        with patch.object(ai_service, "get_openai_client", lambda: client):
+            first, _ = await _call_openai([photo], vehicle_type="piaggio")
+            second, _ = await _call_openai([photo], vehicle_type="piaggio")
+
+            # Other resize parameters -> another payload -> not the same entry
+            monkeypatch.setattr(ai_service.settings, "vlm_image_max_edge", 512)
+            await _call_openai([photo], vehicle_type="piaggio")
+
+    assert first == second
+    assert client.calls == 2
+    assert encodes == 2  # the hit never read or re-encoded the photo
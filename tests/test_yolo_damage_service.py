@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.services import yolo_damage_service  # noqa: E402
+
+
+class FakeModel:
+    def __init__(self, names, boxes):
+        self.names = names
+        self._boxes = boxes  # list of (x1, y1, x2, y2, conf, cls)
+
+    def predict(self, inputs, **_kwargs):
+        rows = np.asarray(self._boxes, dtype=np.float32).reshape(-1, 6)
+        boxes = SimpleNamespace(xyxy=rows[:, :4], conf=rows[:, 4], cls=rows[:, 5])
+        return [SimpleNamespace(boxes=boxes) for _ in inputs]
+
+
+def _detect(monkeypatch, model_n, model_m):
+    monkeypatch.setattr(yolo_damage_service, "_MODEL_N", model_n)
+    monkeypatch.setattr(yolo_damage_service, "_MODEL_M", model_m)
+    monkeypatch.setattr(yolo_damage_service, "_load_models", lambda: None)
+    image = np.zeros((100, 100, 3), dtype=np.uint8)
+    return yolo_damage_service.detect_on_photo(image, "lato_destro")
+
+
+def test_overlapping_boxes_across_models_are_fused(monkeypatch):
+    model_n = FakeModel({0: "doorouter-dent", 1: "Headlight-damage"}, [
+        (100, 100, 200, 200, 0.8, 0),
+    ])
+    model_m = FakeModel({0: "dent", 1: "scratch"}, [
+        (110, 110, 210, 210, 0.5, 0),  # same dent, seen by the generic model
+    ])
+
+    (damage,) = _detect(monkeypatch, model_n, model_m)
+
+    assert damage["damage_type"] == "ammaccatura"
+    assert damage["zone"] == "laterale_destro"
+    assert damage["confidence"] == 0.8
+    assert "YOLO-m+n 80%" in damage["description"]
+    # confidence-weighted average: 100 + 10 * 0.5 / 1.3
+    assert damage["bounding_box"] == "104,104,204,204"
+
+
+def test_distinct_dents_of_one_type_are_kept(monkeypatch):
+    model_n = FakeModel({0: "doorouter-dent"}, [
+        (0, 0, 50, 50, 0.9, 0),
+        (400, 400, 450, 450, 0.6, 0),
+    ])
+
+    damages = _detect(monkeypatch, model_n, None)
+
+    assert [d["bounding_box"] for d in damages] == ["0,0,50,50", "400,400,450,450"]
+
+
+def test_class_mapping_and_thresholds(monkeypatch):
+    model_m = FakeModel({0: "dent", 1: "shattered_glass", 2: "none", 3: "unknown"}, [
+        (0, 0, 10, 10, 0.50, 0),   # dent >= 0.45 -> kept
+        (20, 20, 30, 30, 0.80, 1),  # shattered_glass < 0.85 -> dropped
+        (40, 40, 50, 50, 0.99, 2),  # placeholder class -> never
+        (60, 60, 70, 70, 0.99, 3),  # unmapped class -> dropped
+    ])
+    model_n = FakeModel({0: "Taillight-Damage"}, [(5, 5, 9, 9, 0.4, 0)])
+
+    damages = _detect(monkeypatch, model_n, model_m)
+
+    assert sorted((d["damage_type"], d["zone"]) for d in damages) == [
+        ("ammaccatura", "laterale_destro"),
+        ("rottura", "posteriore"),  # zone hint from the YOLOv11n class
+    ]
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import yolo_damage_service, yolo_models
+
+
+def _store(monkeypatch, tmp_path):
+    monkeypatch.setattr(yolo_models.settings, "yolo_model_dir", str(tmp_path))
+    path = yolo_models.weights_path("n")
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(b"weights-v1")
+    return path
+
+
+def test_manifest_records_and_verifies_checksums(monkeypatch, tmp_path):
+    path = _store(monkeypatch, tmp_path)
+    assert yolo_models.verify_file(path) is None
+
+    yolo_models.record_checksum(path)
+    assert yolo_models.verify_file(path) is True
+    assert yolo_models.verify_store() == []
+
+    with open(path, "wb") as f:
+        f.write(b"tampered")
+    assert yolo_models.verify_file(path) is False
+    assert yolo_models.verify_store() == ["yolov11n-car-damage/best.pt: checksum mismatch"]
+
+
+def test_offline_store_never_downloads(monkeypatch, tmp_path):
+    monkeypatch.setattr(yolo_models.settings, "yolo_model_dir", str(tmp_path))
+    monkeypatch.setattr(yolo_models.settings, "yolo_offline", True)
+    monkeypatch.setattr(
+        yolo_damage_service, "fetch_weights", lambda key: (_ for _ in ()).throw(AssertionError("download")),
+    )
+    assert yolo_damage_service._resolve_weights("n") is None
+
+    path = _store(monkeypatch, tmp_path)
+    yolo_models.record_checksum(path)
+    assert yolo_damage_service._resolve_weights("n") == path
+
+    with open(path, "wb") as f:
+        f.write(b"tampered")
+    assert yolo_damage_service._resolve_weights("n") is None
+
+
+def _fake_hub(monkeypatch, content: bytes) -> list[dict]:
+    downloads = []
+
+    def hf_hub_download(repo_id, filename, revision, local_dir):
+        downloads.append({"repo_id": repo_id, "revision": revision})
+        os.makedirs(local_dir, exist_ok=True)
+        with open(os.path.join(local_dir, filename), "wb") as f:
+            f.write(content)
+
+    monkeypatch.setitem(sys.modules, "huggingface_hub", SimpleNamespace(hf_hub_download=hf_hub_download))
+    return downloads
+
+
+def _pin(monkeypatch, content: bytes) -> None:
+    source = yolo_models.MODEL_SOURCES["n"]
+    pinned = source._replace(revision="abc123", sha256=hashlib.sha256(content).hexdigest())
+    monkeypatch.setitem(yolo_models.MODEL_SOURCES, "n", pinned)
+
+
+def test_fetch_checks_download_against_pinned_checksum(monkeypatch, tmp_path):
+    monkeypatch.setattr(yolo_models.settings, "yolo_model_dir", str(tmp_path))
+    _pin(monkeypatch, b"weights-v1")
+
+    downloads = _fake_hub(monkeypatch, b"weights-v1")
+    path = yolo_models.fetch_weights("n")
+    assert downloads == [{"repo_id": "vineetsarpal/yolov11n-car-damage", "revision": "abc123"}]
+    assert yolo_models.verify_file(path) is True
+    assert yolo_models.verify_store() == []
+
+    # A tampered first download is rejected, not recorded
+    os.remove(path)
+    _fake_hub(monkeypatch, b"tampered")
+    with pytest.raises(RuntimeError, match="Checksum mismatch"):
+        yolo_models.fetch_weights("n")
+    assert not os.path.exists(path)
+
+
+def test_unpinned_model_trusted_on_first_use(monkeypatch, tmp_path, caplog):
+    monkeypatch.setattr(yolo_models.settings, "yolo_model_dir", str(tmp_path))
+    monkeypatch.setitem(
+        yolo_models.MODEL_SOURCES, "n", yolo_models.MODEL_SOURCES["n"]._replace(revision=None, sha256=None),
+    )
+    downloads = _fake_hub(monkeypatch, b"weights-v1")
+
+    path = yolo_models.fetch_weights("n")
+    assert downloads == [{"repo_id": "vineetsarpal/yolov11n-car-damage", "revision": None}]
+    assert "no pinned sha256" in caplog.text
+    assert yolo_models.verify_file(path) is True
+
+    # From then on the recorded checksum is what the file is held to
+    assert yolo_models.fetch_weights("n") == path
+    assert len(downloads) == 1
+    with open(path, "wb") as f:
+        f.write(b"tampered")
+    with pytest.raises(RuntimeError, match="Checksum mismatch"):
+        yolo_models.fetch_weights("n")
+    assert not os.path.exists(path)
+
+
+def test_fresh_model_dir_resolves_weights(monkeypatch, tmp_path):
+    monkeypatch.setattr(yolo_models.settings, "yolo_model_dir", str(tmp_path))
+    monkeypatch.setattr(yolo_models.settings, "yolo_offline", False)
+    _fake_hub(monkeypatch, b"weights-v1")
+
+    for key in yolo_models.MODEL_SOURCES:
+        path = yolo_damage_service._resolve_weights(key)
+        assert path == yolo_models.weights_path(key)
+    assert yolo_models.verify_store() == []
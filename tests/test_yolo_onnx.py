@@ -0,0 +1,47 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("PIL.Image")
+
+from app.services.yolo_onnx import letterbox, postprocess  # noqa: E402
+
+
+def _head_output(anchors: list[tuple[float, float, float, float, int, float]], classes: int = 3):
+    """Raw (4 + classes, anchors) output from (cx, cy, w, h, class, score) tuples."""
+    out = np.zeros((4 + classes, len(anchors)), dtype=np.float32)
+    for j, (cx, cy, w, h, cls, score) in enumerate(anchors):
+        out[:4, j] = (cx, cy, w, h)
+        out[4 + cls, j] = score
+    return out
+
+
+def test_letterbox_keeps_aspect_and_pads():
+    image = np.zeros((300, 600, 3), dtype=np.uint8)
+    tensor, ratio, pad = letterbox(image, 640)
+    assert tensor.shape == (3, 640, 640)
+    assert ratio == pytest.approx(640 / 600)
+    assert pad == (0.0, 160.0)
+
+
+def test_postprocess_thresholds_nms_and_maps_back_to_image():
+    ratio, pad = 0.5, (0.0, 20.0)
+    output = _head_output([
+        (100, 120, 40, 40, 1, 0.9),   # kept
+        (102, 121, 40, 40, 1, 0.7),   # same class, overlapping -> suppressed
+        (102, 121, 40, 40, 2, 0.6),   # other class, same place -> kept
+        (300, 300, 20, 20, 0, 0.1),   # below threshold
+    ])
+
+    boxes, scores, cls = postprocess(output, conf=0.3, ratio=ratio, pad=pad, image_shape=(1000, 1000))
+
+    assert cls.tolist() == [1, 2]
+    assert scores.tolist() == pytest.approx([0.9, 0.6])
+    # (80..120, 100..140) in model space -> minus pad, / ratio
+    assert boxes[0].tolist() == pytest.approx([160, 160, 240, 240])
+
+
+def test_postprocess_with_no_detections():
+    boxes, scores, cls = postprocess(
+        _head_output([(10, 10, 5, 5, 0, 0.05)]), conf=0.3, ratio=1.0, pad=(0, 0), image_shape=(64, 64),
+    )
+    assert boxes.shape == (0, 4) and len(scores) == 0 and len(cls) == 0
@@ -0,0 +1,137 @@
+import asyncio
+import sys
+import tempfile
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import yolo_pool
+from app.services.yolo_pool import YoloBatcher
+
+
+@pytest.mark.asyncio
+async def test_batcher_groups_concurrent_requests(monkeypatch):
+    monkeypatch.setattr(yolo_pool.settings, "yolo_batch_window_ms", 50.0)
+    monkeypatch.setattr(yolo_pool.settings, "yolo_max_batch_size", 3)
+    batches: list[list] = []
+
+    async def run_batch(items):
+        batches.append(items)
+        return [[{"zone": angle}] for _path, angle in items]
+
+    batcher = YoloBatcher(run_batch=run_batch)
+    results = await asyncio.gather(*(
+        batcher.submit(angle.encode(), angle)
+        for angle in ("fronte", "retro", "lato_destro", "lato_sinistro")
+    ))
+    batcher.stop()
+
+    assert [len(b) for b in batches] == [3, 1]
+    assert [r[0]["zone"] for r in results] == ["fronte", "retro", "lato_destro", "lato_sinistro"]
+    stats = batcher.stats()
+    assert stats["batches"] == 2
+    assert stats["photos"] == 4
+    assert stats["max_batch_size"] == 3
+    assert stats["avg_batch_seconds"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_batch_failure_reaches_every_caller(monkeypatch):
+    monkeypatch.setattr(yolo_pool.settings, "yolo_batch_window_ms", 20.0)
+
+    async def run_batch(items):
+        raise RuntimeError("no models")
+
+    batcher = YoloBatcher(run_batch=run_batch)
+    results = await asyncio.gather(
+        batcher.submit(b"a", "fronte"), batcher.submit(b"b", "retro"),
+        return_exceptions=True,
+    )
+    batcher.stop()
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert batcher.stats()["batches"] == 0
+
+
+def test_detect_batch_decodes_upright_bgr_in_memory(monkeypatch):
+    """Bytes are EXIF-transposed and handed to the models as BGR arrays, no temp files."""
+    np = pytest.importorskip("numpy")
+    Image = pytest.importorskip("PIL.Image")
+    from app.services import yolo_damage_service
+
+    im = Image.new("RGB", (40, 20), (200, 10, 30))
+    exif = Image.Exif()
+    exif[274] = 6  # rotate 90° CW on display
+    buf = BytesIO()
+    im.save(buf, format="PNG", exif=exif.tobytes())
+
+    seen_inputs: list = []
+
+    class FakeModel:
+        names = {}
+
+        def predict(self, inputs, **_kwargs):
+            seen_inputs.extend(inputs)
+            empty = SimpleNamespace(xyxy=np.zeros((0, 4)), conf=np.zeros(0), cls=np.zeros(0))
+            return [SimpleNamespace(boxes=empty) for _ in inputs]
+
+    monkeypatch.setattr(yolo_damage_service, "_MODEL_N", FakeModel())
+    monkeypatch.setattr(yolo_damage_service, "_MODEL_M", None)
+    monkeypatch.setattr(yolo_damage_service, "_load_models", lambda: None)
+    monkeypatch.setattr(tempfile, "mkstemp", lambda *a, **k: pytest.fail("temp file written"))
+
+    assert yolo_damage_service.detect_batch([(buf.getvalue(), "fronte")]) == [[]]
+
+    (array,) = seen_inputs
+    assert isinstance(array, np.ndarray)
+    assert array.shape == (40, 20, 3)
+    assert tuple(array[0, 0]) == (30, 10, 200)
+
+
+def test_undecodable_photo_fails_only_its_own_slot(monkeypatch):
+    np = pytest.importorskip("numpy")
+    Image = pytest.importorskip("PIL.Image")
+    from app.services import yolo_damage_service
+
+    buf = BytesIO()
+    Image.new("RGB", (20, 20)).save(buf, format="PNG")
+    good = buf.getvalue()
+    seen_inputs: list = []
+
+    class FakeModel:
+        names = {0: "Runningboard-Damage"}
+
+        def predict(self, inputs, **_kwargs):
+            seen_inputs.extend(inputs)
+            boxes = SimpleNamespace(xyxy=np.array([[1, 1, 9, 9]]), conf=np.array([0.9]), cls=np.array([0]))
+            return [SimpleNamespace(boxes=boxes) for _ in inputs]
+
+    monkeypatch.setattr(yolo_damage_service, "_MODEL_N", FakeModel())
+    monkeypatch.setattr(yolo_damage_service, "_MODEL_M", None)
+    monkeypatch.setattr(yolo_damage_service, "_load_models", lambda: None)
+
+    found = yolo_damage_service.detect_batch([
+        (good, "fronte"), (b"\xff\xd8 not an image", "retro"), (good, "lato_destro"),
+    ])
+
+    assert len(seen_inputs) == 2
+    assert [len(f) for f in found] == [1, 0, 1]
+    assert found[0][0]["zone"] == "frontale"
+
+
+def test_torch_worker_capped_to_configured_threads(monkeypatch):
+    from app.services import yolo_damage_service
+
+    calls = []
+    monkeypatch.setitem(sys.modules, "torch", SimpleNamespace(set_num_threads=calls.append))
+    monkeypatch.setattr(yolo_damage_service, "warm_up", lambda: True)
+    monkeypatch.setattr(yolo_pool.settings, "yolo_torch_threads", 2)
+
+    monkeypatch.setattr(yolo_pool.settings, "yolo_backend", "onnx")
+    yolo_pool._init_worker()
+    assert calls == []
+
+    monkeypatch.setattr(yolo_pool.settings, "yolo_backend", "torch")
+    yolo_pool._init_worker()
+    assert calls == [2]